@@ -1,7 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, make_response
 import generateMotifs
+import keyMotifBuilder
+from feasibility import Feasibility
 #import pdfkit
 import asyncio
+import os
 
 app = Flask(__name__)
 
@@ -23,6 +26,8 @@ async def validate():
             'homVisible': False,
             'hairpinVisible': False,
             'gcVisible': False,
+            'seed': '',
+            'attempts': 1,
             }
 
     if request.method == 'POST':
@@ -39,6 +44,17 @@ async def validate():
             maxHairpin = 2
             loopMin = 2
             loopMax = 2
+            # optional, for reproducible runs
+            inputErrors = []
+            seed = request.form.get('seed', '').strip()
+            if seed and not seed.isdecimal():
+                inputErrors.append('The seed must be a whole number of 0 or more.')
+            seed = int(seed) if seed.isdecimal() else None
+            # optional, independent attempts run in parallel, at most one per core
+            attempts = request.form.get('attempts', '').strip()
+            if attempts and not (attempts.isdecimal() and int(attempts) > 0):
+                inputErrors.append('The number of attempts must be a whole number of 1 or more.')
+            numAttempts = min(int(attempts), os.cpu_count() or 1) if attempts.isdecimal() and int(attempts) > 0 else 1
             constraints = set()
             if request.form['homVisible'] == 'True':
                 constraints.add('hom')
@@ -68,6 +84,8 @@ async def validate():
                     'homVisible': False,
                     'hairpinVisible': False,
                     'gcVisible': False, 
+                    'seed': '' if seed is None else seed,
+                    'attempts': numAttempts,
                     # 'keyGc': request.form['keyGc'], 
                     # 'homVisible': request.form['homVisible'],
                     # 'hairpinVisible': request.form['hairpinVisible'],
@@ -79,7 +97,16 @@ async def validate():
             keys = ""
             isValid = False
 
-            blob = await asyncio.gather(generateMotifs.generateMotifs(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax))
+            if inputErrors:
+                return render_template('index.html', payloads="", motifs="", keys="", form=form, isValid=False, errors=inputErrors)
+
+            # Reject impossible requests before generating
+            feasibilityConstraints = keyMotifBuilder.get_constraints(maxHairpin=maxHairpin, payloadSize=payloadSize, keySize=keySize, keyNum=keyNum, payloadNum=payloadNum, maxHom=maxHomopolymer, minGc=gcContentMinPercentage, maxGc=gcContentMaxPercentage, loopMin=loopMin, loopMax=loopMax)
+            errors, warnings = Feasibility(feasibilityConstraints, constraints).check()
+            if errors:
+                return render_template('index.html', payloads="", motifs="", keys="", form=form, isValid=False, errors=errors)
+
+            blob = await asyncio.gather(generateMotifs.generateMotifs(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed, numAttempts))
             stringBlob = str(blob)
             if stringBlob[len(stringBlob)-4] == 's':
                 setThing = stringBlob[2:len(stringBlob)-9]
@@ -107,7 +134,7 @@ async def validate():
             for m in motifs.split("', '"):
                 finalMotifs += m + "    "
             # Render the page
-            return render_template('index.html', payloads=finalPayloads, motifs=finalMotifs, keys=finalKeys, form=form, isValid=isValid)
+            return render_template('index.html', payloads=finalPayloads, motifs=finalMotifs, keys=finalKeys, form=form, isValid=isValid, warnings=warnings)
         
         return render_template('index.html', payloads="", motifs="", keys="", form=form, isValid=False)
 
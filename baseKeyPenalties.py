@@ -2,11 +2,14 @@ import numpy as np
 from language import nucleotides
 from language import converse
 from basePenalties import BasePenalties
+from hyperparameters import HyperparameterPowers
+from packedSequences import PackedSequenceSet, pack_sequence, nucleotideCodes
+from hammingIndex import HammingIndex
 
 
 class BaseKeyPenalties(BasePenalties):
-    def __init__(self, constraints, hyperparams):
-        BasePenalties.__init__(self, constraints, hyperparams)
+    def __init__(self, constraints, hyperparams, hairpinEngine='recursive', hairpinMemoSize=0, precomputePowers=True):
+        BasePenalties.__init__(self, constraints, hyperparams, hairpinEngine=hairpinEngine, hairpinMemoSize=hairpinMemoSize, precomputePowers=precomputePowers)
         self.keys = set()
         self.keySize = constraints.keySize
 
@@ -26,6 +29,15 @@ class BaseKeyPenalties(BasePenalties):
         self.startJoints = set()
         self.endJoints = set()
 
+        # Prefixes of the keys and joints, for similarity and unique joints
+        self.keyPrefixes = PackedSequenceSet()
+        self.startJointPrefixes = PackedSequenceSet()
+        self.endJointPrefixes = PackedSequenceSet()
+
+        # Keys by Hamming distance
+        self.minKeyDistance = constraints.minKeyDistance
+        self.keyIndex = HammingIndex(self.keySize, self.minKeyDistance)
+
         # Key
         self.keySize = constraints.keySize
         self.startMinGcCountMotif = -1
@@ -41,6 +53,16 @@ class BaseKeyPenalties(BasePenalties):
         self.similarityHyperparams = hyperparams.similarity
         self.uniqueJointsHyperparams = hyperparams.uniqueJoints
 
+        # Hyperparameter powers
+        self.homPowers = HyperparameterPowers(hyperparams.hom, self.maxHom, self.keySize, self.precomputePowers)
+        self.similarityPowers = HyperparameterPowers(hyperparams.similarity, self.keySize, self.keySize, self.precomputePowers)
+        self.uniqueJointsPowers = HyperparameterPowers(hyperparams.uniqueJoints, int(self.keySize / 2), int(self.keySize / 2), self.precomputePowers)
+
+        # constraint -> penalties of key + n for every n in nucleotides
+        self.extensionPenalties = {'hom': self.homopolymer_extensions, 'hairpin': self.hairpin_extensions, 'keyGcContent': self.gc_extensions,
+                                   'similarity': self.similarity_extensions, 'uniqueJoints': self.unique_joints_extensions,
+                                   'keyDistance': self.key_distance_extensions}
+
     ### Get Penalties ###
 
     def get_all_penalties(self, key, nucleotide):
@@ -71,6 +93,58 @@ class BaseKeyPenalties(BasePenalties):
         curKey = key + nucleotide
         return self.unique_joints_penalty(curKey)
     
+    def score_extensions(self, key, constraints):
+        # penalties of key + n for every n in nucleotides (rows) and every constraint (columns),
+        # constraints without extension penalties are left at 0
+        scores = np.zeros((len(nucleotides), len(constraints)))
+        for i, constraint in enumerate(constraints):
+            if constraint in self.extensionPenalties:
+                scores[:, i] = self.extensionPenalties[constraint](key)
+        return scores
+
+    def homopolymer_extensions(self, key):
+        lastHom = 0
+        for i in range(len(key) - 1, -1, -1):
+            if key[i] != key[-1]:
+                break
+            lastHom += 1
+        return [self.homPowers.power(lastHom + 1 if key[-1:] == n else 1) for n in nucleotides]
+
+    def hairpin_extensions(self, key):
+        return [self.hairpin_penalty(key + n) for n in nucleotides]
+
+    def gc_extensions(self, key):
+        # GC counts of key (and of its end joint) once, the added nucleotide adds at most one
+        jointSize = int(self.keySize / 2)
+        gcCount = sum([1 if nuc in ['G', 'C'] else 0 for nuc in key])
+        endGcCount = sum([1 if nuc in ['G', 'C'] else 0 for nuc in key[jointSize:]])
+        penalties = []
+        for n in nucleotides:
+            isGc = 1 if n in ['G', 'C'] else 0
+            curGcCount, curEndGcCount = gcCount + isGc, endGcCount + (isGc if len(key) >= jointSize else 0)
+            penalties.append(self.key_GC_content_score(curGcCount, len(key) + 1) + self.key_motif_GC_content_score(curGcCount, curEndGcCount, len(key) + 1))
+        return penalties
+
+    def similarity_extensions(self, key):
+        code = pack_sequence(key)
+        return [self.similarityPowers.power(len(key) + 1 if ((code << 2) | nucleotideCodes[n]) in self.keyPrefixes.codes else 0) for n in nucleotides]
+
+    def unique_joints_extensions(self, key):
+        jointSize = int(self.keySize / 2)
+        numPossibleUniqueJoints = 4**jointSize
+        if len(self.startJoints) == numPossibleUniqueJoints and len(self.endJoints) == numPossibleUniqueJoints:
+            return [0] * len(nucleotides)
+        if len(key) < jointSize:
+            jointPrefix, prefixes, numJoints = key, self.startJointPrefixes, len(self.startJoints)
+        else:
+            jointPrefix, prefixes, numJoints = key[jointSize:], self.endJointPrefixes, len(self.endJoints)
+        weight = 100 * (numPossibleUniqueJoints - numJoints) / numPossibleUniqueJoints
+        code = pack_sequence(jointPrefix)
+        return [weight * self.uniqueJointsPowers.power(len(jointPrefix) + 1 if ((code << 2) | nucleotideCodes[n]) in prefixes.codes else 0) for n in nucleotides]
+
+    def key_distance_extensions(self, key):
+        return [self.key_distance_penalty(key + n) for n in nucleotides]
+
     ### Add Base to current Key ###
     
     async def add_base(self, newBase):
@@ -102,6 +176,9 @@ class BaseKeyPenalties(BasePenalties):
         if len(newKey) != self.keySize:
             return False
         self.keys.add(newKey)
+        self.keyPrefixes.add_prefixes(newKey)
+        self.keyIndex.add(newKey)
+        self.add_to_hairpin_index(self.keys, newKey)
         await self.add_joints(newKey)
         await self.add_motif_gc_info(newKey)
     
@@ -114,6 +191,8 @@ class BaseKeyPenalties(BasePenalties):
         jointSize = int(self.keySize / 2)
         self.startJoints.add(newKey[:jointSize])
         self.endJoints.add(newKey[jointSize:])
+        self.startJointPrefixes.add_prefixes(newKey[:jointSize])
+        self.endJointPrefixes.add_prefixes(newKey[jointSize:])
 
     async def add_motif_gc_info(self, k):
         jointSize = int(self.keySize / 2)
@@ -153,7 +232,7 @@ class BaseKeyPenalties(BasePenalties):
         homSize = self.homopolymer_stats(curKey)
         if homSize == 0:
             return 0
-        return self.homHyperparams.hyperparameter**(homSize / self.maxHom)
+        return self.homPowers.power(homSize)
 
     def homopolymer_stats(self, curKey):
         if len(curKey) <= 1:
@@ -172,29 +251,36 @@ class BaseKeyPenalties(BasePenalties):
 
     def key_GC_content_within_key(self, curKey):
         gcCount = self.curGcCount + 1 if curKey[len(curKey) - 1] in ['G', 'C'] else self.curGcCount
-        gcContent = (100 * gcCount) / len(curKey)
+        return self.key_GC_content_score(gcCount, len(curKey))
+
+    def key_GC_content_score(self, gcCount, keyLength):
+        gcContent = (100 * gcCount) / keyLength
         penalty = 0
         penalty = max(penalty, gcContent - self.maxGc)
         penalty = max(penalty, self.minGc - gcContent)
-        return penalty * (len(curKey) / self.keySize)
+        return penalty * (keyLength / self.keySize)
 
     def key_GC_content_within_motif(self, curKey):
         keyGcCount = self.curGcCount + 1 if curKey[len(curKey) - 1] in ['G', 'C'] else self.curGcCount
         jointSize = int(self.keySize / 2)
+        endGcCountMotif = sum([1 if curKey[x] in ['G', 'C'] else 0 for x in range(jointSize, len(curKey))])
+        return self.key_motif_GC_content_score(keyGcCount, endGcCountMotif, len(curKey))
+
+    def key_motif_GC_content_score(self, keyGcCount, endGcCountMotif, keyLength):
+        jointSize = int(self.keySize / 2)
 
         # motif gc is complementary
-        if len(curKey) <= jointSize:
+        if keyLength <= jointSize:
             startGcCountMotif = keyGcCount
-            curMotifSize = len(curKey) + self.payloadSize + jointSize
+            curMotifSize = keyLength + self.payloadSize + jointSize
             weight = curMotifSize / self.motifSize
             minGcContent = (100 * (startGcCountMotif + max(self.endMinGcCountMotif, 0))) / curMotifSize
             maxGcContent = (100 * (startGcCountMotif + max(self.endMaxGcCountMotif, 0))) / curMotifSize
         else:
-            endGcCountMotif = sum([1 if curKey[x] in ['G', 'C'] else 0 for x in range(jointSize, len(curKey))])
             startGcCountMotif = keyGcCount - endGcCountMotif
             startMinGcCountMotif = startGcCountMotif if self.startMinGcCountMotif == -1 else min(self.startMinGcCountMotif, startGcCountMotif)
             startMaxGcCountMotif = max(self.startMaxGcCountMotif, startGcCountMotif)
-            curMotifSize = len(curKey) + self.payloadSize
+            curMotifSize = keyLength + self.payloadSize
             weight = curMotifSize / self.motifSize
             minGcContent = (100 * (endGcCountMotif + startMinGcCountMotif)) / curMotifSize
             maxGcContent = (100 * (endGcCountMotif + startMaxGcCountMotif)) / curMotifSize
@@ -203,6 +289,20 @@ class BaseKeyPenalties(BasePenalties):
         score = max(score, weight * (maxGcContent - self.maxGc))
         return score
 
+    ### Validity ###
+
+    def is_valid(self, key, withConstraints):
+        # within the homopolymer, key GC and key distance limits of withConstraints, hairpins are not checked
+        if 'hom' in withConstraints and self.longest_homopolymer(key) > self.maxHom:
+            return False
+        if 'keyGcContent' in withConstraints:
+            gcContent = (100 * sum([1 if nuc in ['G', 'C'] else 0 for nuc in key])) / len(key)
+            if gcContent < self.minGc or gcContent > self.maxGc:
+                return False
+        if 'keyDistance' in withConstraints and not self.keyIndex.is_far(key):
+            return False
+        return True
+
     ### Hairpin Penalty ###
 
     def hairpin_penalty(self, curKey):
@@ -225,16 +325,14 @@ class BaseKeyPenalties(BasePenalties):
         weight = 0
 
         if len(curKey) <= jointSize:
-            for startJoint in self.startJoints:
-                if curKey == startJoint[:len(curKey)]:
-                    maxSimilarity = max(maxSimilarity, len(curKey))
+            if curKey in self.startJointPrefixes:
+                maxSimilarity = len(curKey)
             weight = 100 *(numPossibleUniqueJoints - len(self.startJoints)) / numPossibleUniqueJoints
         else:
-            for endJoint in self.endJoints:
-                if curKey[jointSize:] == endJoint[:len(curKey) - jointSize]:
-                    maxSimilarity = max(maxSimilarity, len(curKey) - jointSize)
+            if curKey[jointSize:] in self.endJointPrefixes:
+                maxSimilarity = len(curKey) - jointSize
             weight = 100 * (numPossibleUniqueJoints - len(self.endJoints)) / numPossibleUniqueJoints
-        return weight * self.uniqueJointsHyperparams.hyperparameter**(maxSimilarity / jointSize)
+        return weight * self.uniqueJointsPowers.power(maxSimilarity)
 
     ### Similarity ###
 
@@ -243,12 +341,15 @@ class BaseKeyPenalties(BasePenalties):
         return similarityStats
 
     def similarity_stats(self, curKey):
-        maxSimilarity = 0
-        
-        for k in self.keys:
-            if curKey == k[:len(curKey)]:
-                maxSimilarity = max(maxSimilarity, len(curKey))
-        return self.similarityHyperparams.hyperparameter**(maxSimilarity / self.keySize)
+        # curKey shares its whole length with a key if it is one of the key prefixes
+        maxSimilarity = len(curKey) if curKey in self.keyPrefixes else 0
+        return self.similarityPowers.power(maxSimilarity)
+
+    ### Key Distance ###
+
+    def key_distance_penalty(self, curKey):
+        # keys that every completion of curKey would leave closer than minKeyDistance
+        return self.keyIndex.prefix_conflicts(curKey)
     
 
 if __name__ == '__main__':
@@ -1,13 +1,25 @@
 import numpy as np
+from collections import Counter
 from language import nucleotides
 from language import converse
 from basePenalties import BasePenalties
+from hyperparameters import HyperparameterPowers
+from hairpinTracker import HairpinTracker
+from prefixTrie import PrefixTrie
+from hammingIndex import HammingIndex
+from keyAutomaton import KeyAutomaton
+from keyAutomaton import reverse_complement
+from kmerTable import KmerTable
+from kmerTable import rolling_kmers
+from kmerTable import junction_kmers
 
 
 class BasePayloadPenalties(BasePenalties):
-    def __init__(self, constraints, hyperparams):
-        BasePenalties.__init__(self, constraints, hyperparams)
+    def __init__(self, constraints, hyperparams, hairpinEngine='recursive', hairpinMemoSize=0, precomputePowers=True, prefixTrieSize=0):
+        BasePenalties.__init__(self, constraints, hyperparams, hairpinEngine=hairpinEngine, hairpinMemoSize=hairpinMemoSize, precomputePowers=precomputePowers)
         self.payloads = set()
+        # bumped by every added payload
+        self.payloadsVersion = 0
         self.motifSize = constraints.motifSize
 
         # Hairpin
@@ -27,8 +39,9 @@ class BasePayloadPenalties(BasePenalties):
         self.startJoints = set()
         self.endJoints = set()
         self.keySize = constraints.keySize
-        self.startJointHom = {'A':[], 'T':[], 'C':[], 'G':[]}
-        self.endJointHom = {'A':[], 'T':[], 'C':[], 'G':[]}
+        # run length -> number of joints
+        self.startJointHom = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+        self.endJointHom = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
         self.wholeJointHom = {'A':0, 'T':0, 'C':0, 'G':0}
         self.minJointsGcCount = -1
         self.maxJointsGcCount = -1
@@ -36,8 +49,24 @@ class BasePayloadPenalties(BasePenalties):
         # Payload
         self.payloadSize = constraints.payloadSize
         self.payloadNum = constraints.payloadNum
-        self.startHomPayload = {'A':[], 'T':[], 'C':[], 'G':[]}
-        self.endHomPayload = {'A':[], 'T':[], 'C':[], 'G':[]}
+        # payload being built and its GC count
+        self.curPayload = ''
+        self.curGcCount = 0
+        # run length -> number of payloads
+        self.startHomPayload = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+        self.endHomPayload = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+
+        # Payloads by Hamming distance
+        self.minPayloadDistance = constraints.minPayloadDistance
+        self.payloadIndex = HammingIndex(self.payloadSize, self.minPayloadDistance)
+
+        # Keys and joints inside the payload, with the automaton state of the last scored prefix
+        self.keyAutomaton = KeyAutomaton(())
+        self.automatonPrefix = ''
+        self.automatonState = 0
+
+        # Junction k-mers of the motifs of the added payloads, k = keySize
+        self.junctionKmers = KmerTable(self.keySize)
 
         # Hyperparameters
         self.homHyperparams = hyperparams.hom
@@ -47,10 +76,36 @@ class BasePayloadPenalties(BasePenalties):
         self.keyGcContentHyperparams = hyperparams.keyGcContent
         self.motifGcContentHyperparams = hyperparams.motifGcContent
 
+        # Hyperparameter powers
+        self.homPowers = HyperparameterPowers(hyperparams.hom, self.maxHom, self.motifSize, self.precomputePowers)
+
+        # Hairpins of the payload being built
+        self.hairpinTracker = HairpinTracker(self)
+
+        # Extension scores of the visited prefixes
+        self.prefixTrie = PrefixTrie(prefixTrieSize) if prefixTrieSize > 0 else None
+
+        # constraint -> penalties of payload + n for every n in nucleotides
+        self.extensionPenalties = {'hom': self.homopolymer_extensions, 'hairpin': self.hairpin_extensions, 'motifGcContent': self.get_gc_penalties,
+                                   'payloadDistance': self.payload_distance_extensions, 'keyInPayload': self.key_in_payload_extensions,
+                                   'jointRepeat': self.joint_repeat_extensions}
+
     ### Add Joints ###
 
     async def add_joints(self, joints):
         self.joints = joints
+        self.keyAutomaton = KeyAutomaton(set(joints) | {reverse_complement(joint) for joint in joints})
+        self.automatonPrefix = ''
+        self.automatonState = 0
+        # a motif is startJoint + payload + endJoint
+        jointSize = int(self.keySize / 2)
+        self.startJoints = {joint[jointSize:] for joint in joints}
+        self.endJoints = {joint[:jointSize] for joint in joints}
+        self.junctionKmers = KmerTable(self.keySize)
+        self.junctionKmers.add(junction_kmers(self.startJoints, self.endJoints, self.payloads, self.keySize))
+        self.clear_hairpin_memo()
+        if self.prefixTrie:
+            self.prefixTrie.clear()
         await self.generate_joint_pre_stats()
 
     ### Pre-stats ###
@@ -75,7 +130,7 @@ class BasePayloadPenalties(BasePenalties):
                 if cur != nuc:
                     if isEnd:
                         isEnd = False
-                        self.endJointHom[cur].append(curHom)
+                        self.endJointHom[cur][curHom] += 1
                     cur = nuc
                     curHom = 0
                 
@@ -93,7 +148,7 @@ class BasePayloadPenalties(BasePenalties):
             if isEnd:
                 self.wholeJointHom[cur] += 1
             else:
-                self.startJointHom[cur].append(curHom)
+                self.startJointHom[cur][curHom] += 1
 
             # Update start gc count
             startMinGcCount = curGcCount if startMinGcCount == -1 else min(startMinGcCount, curGcCount)
@@ -122,10 +177,111 @@ class BasePayloadPenalties(BasePenalties):
         curMotif = motif + nucleotide
         return self.motif_GC_content_penalty(curMotif)
 
+    def score_extensions(self, payload, constraints):
+        # penalties of payload + n for every n in nucleotides (rows) and every constraint (columns),
+        # constraints without extension penalties are left at 0
+        scores = np.zeros((len(nucleotides), len(constraints)))
+        node = self.prefixTrie.node(payload) if self.prefixTrie else None
+        for i, constraint in enumerate(constraints):
+            if constraint not in self.extensionPenalties:
+                continue
+            if node is None:
+                scores[:, i] = self.extensionPenalties[constraint](payload)
+                continue
+            version = self.scores_version(constraint)
+            cached = self.prefixTrie.get(node, constraint, version)
+            if cached is None:
+                cached = np.array(self.extensionPenalties[constraint](payload), dtype=float)
+                self.prefixTrie.put(node, constraint, version, cached)
+            scores[:, i] = cached
+        return scores
+
+    def scores_version(self, constraint):
+        # the scores cached for a prefix stay valid while this doesn't change; a change of joints clears them all
+        if constraint == 'hairpin':
+            return (self.payloadsVersion, self.hairpinHyperparams.hyperparameter)
+        if constraint == 'payloadDistance':
+            return self.payloadsVersion
+        if constraint == 'keyInPayload':
+            return self.keyInPayloadHyperparams.hyperparameter
+        if constraint == 'jointRepeat':
+            return (self.payloadsVersion, self.jointRepeatHyperparams.hyperparameter)
+        # homopolymers through a whole-joint run reach into the neighbouring payloads
+        if constraint == 'hom':
+            return (self.payloadsVersion if any(self.wholeJointHom.values()) else 0, self.homHyperparams.hyperparameter)
+        return 0
+
+    def homopolymer_extensions(self, payload):
+        lastHom = 0
+        for i in range(len(payload) - 1, -1, -1):
+            if payload[i] != payload[-1]:
+                break
+            lastHom += 1
+        return [self.homopolymer_run_stats(payload + n, lastHom + 1 if payload[-1:] == n else 1) for n in nucleotides]
+
+    def hairpin_extensions(self, payload):
+        return [self.hairpinTracker.get_hairpin_penalty(payload, n) for n in nucleotides]
+
+    def get_gc_penalties(self, payload):
+        # GC penalty of every nucleotide appended to payload, in the order of nucleotides
+        gcCount = self.payload_gc_count(payload)
+        return [self.motif_GC_content_score(gcCount + (1 if n in ['G', 'C'] else 0), len(payload) + 1) for n in nucleotides]
+
+    def payload_distance_extensions(self, payload):
+        # payloads that every completion of payload + n would leave closer than minPayloadDistance
+        return [self.payloadIndex.prefix_conflicts(payload + n) for n in nucleotides]
+
+    def key_in_payload_extensions(self, payload):
+        # keys and joints ending at the last base of payload + n
+        state = self.key_automaton_state(payload)
+        hyperparameter = self.keyInPayloadHyperparams.hyperparameter
+        return [hyperparameter * self.keyAutomaton.counts[self.keyAutomaton.step(state, n)] for n in nucleotides]
+
+    def key_automaton_state(self, payload):
+        # a payload grows one base at a time, so the state usually takes a single step
+        if payload != self.automatonPrefix:
+            if payload[:-1] == self.automatonPrefix and payload:
+                self.automatonState = self.keyAutomaton.step(self.automatonState, payload[-1])
+            else:
+                self.automatonState = self.keyAutomaton.state(payload)
+            self.automatonPrefix = payload
+        return self.automatonState
+
+    def joint_repeat_extensions(self, payload):
+        # junction k-mers completed by the last base of payload + n that the added payloads already have
+        hyperparameter = self.jointRepeatHyperparams.hyperparameter
+        return [hyperparameter * int(np.sum(self.junctionKmers.get(self.completed_junction_kmers(payload + n)))) for n in nucleotides]
+
+    def completed_junction_kmers(self, curPayload):
+        # junction k-mers whose last base is the last base of curPayload, see junction_kmers
+        jointSize = int(self.keySize / 2)
+        kmers = []
+        if self.startJoints and jointSize <= len(curPayload) <= self.keySize - 1:
+            kmers.append(rolling_kmers([startJoint + curPayload for startJoint in self.startJoints], self.keySize)[:, -1])
+        if len(curPayload) == self.payloadSize:
+            kmers.append(rolling_kmers([curPayload[-(self.keySize - 1):] + endJoint for endJoint in self.endJoints], self.keySize).ravel())
+        return np.unique(np.concatenate(kmers)) if kmers else np.zeros(0, dtype=np.uint64)
+
+    ### Add Base to current Payload ###
+
+    async def add_base(self, newBase):
+        self.curPayload += newBase
+        self.curGcCount += 1 if newBase in ['G', 'C'] else 0
+
+    ### Start New Payload ###
+
+    def start_new_payload(self):
+        self.curPayload = ''
+        self.curGcCount = 0
+
     ### Add Payloads ###
     
     async def add_payload(self, newPayload):
         self.payloads.add(newPayload)
+        self.payloadsVersion += 1
+        self.payloadIndex.add(newPayload)
+        self.junctionKmers.add(junction_kmers(self.startJoints, self.endJoints, [newPayload], self.keySize))
+        self.add_to_hairpin_index(self.payloads, newPayload)
         await self.add_hom_stats(newPayload)
     
     async def add_payloads(self, newPayloads):
@@ -145,15 +301,15 @@ class BasePayloadPenalties(BasePenalties):
             if cur != nuc:
                 if isStart:
                     isStart = False
-                    self.startHomPayload[cur].append(homCount)
+                    self.startHomPayload[cur][homCount] += 1
                 homCount = 0
                 cur = nuc
             homCount += 1
 
         # Update homopolymer stats
         if isStart:
-            self.startHomPayload[cur].append(homCount)
-        self.endHomPayload[cur].append(homCount)
+            self.startHomPayload[cur][homCount] += 1
+        self.endHomPayload[cur][homCount] += 1
        
     ### Homopolymer penalty ###
 
@@ -162,7 +318,6 @@ class BasePayloadPenalties(BasePenalties):
         return homStats
 
     def homopolymer_stats(self, curPayload):
-        curHoms = []
         curHom = 1
         cur = curPayload[-1]
         for i in range(len(curPayload) - 2, -1, -1):
@@ -170,48 +325,52 @@ class BasePayloadPenalties(BasePenalties):
             if cur != nuc:
                 break
             curHom += 1
+        return self.homopolymer_run_stats(curPayload, curHom)
+
+    def homopolymer_run_stats(self, curPayload, curHom):
+        # curHom: homopolymer length at the end of curPayload
+        curHoms = []
         newNuc = curPayload[-1]
 
         if not self.startJointHom[newNuc] and not self.endJointHom[newNuc] and self.wholeJointHom[newNuc] == 0:
-            return self.homHyperparams.hyperparameter**(curHom / self.maxHom)
+            return self.homPowers.power(curHom)
 
         # start and end joints
         if curHom == len(curPayload) and len(curPayload) == self.payloadSize:
             if not self.startJointHom[newNuc] and self.wholeJointHom[newNuc] == 0:
-                for endHom in self.endJointHom[newNuc]:
-                    curHoms.append(self.homHyperparams.hyperparameter**((curHom + endHom)/self.maxHom))
+                for endHom, count in self.endJointHom[newNuc].items():
+                    curHoms.append(count * self.homPowers.power(curHom + endHom))
             elif not self.endJointHom[newNuc] and self.wholeJointHom[newNuc] == 0:
-                for startHom in self.startJointHom[newNuc]:
-                    curHoms.append(self.homHyperparams.hyperparameter**((curHom + startHom)/self.maxHom))
+                for startHom, count in self.startJointHom[newNuc].items():
+                    curHoms.append(count * self.homPowers.power(curHom + startHom))
             else:
-                for startHom in self.startJointHom[newNuc]:
-                    for endHom in self.endJointHom[newNuc]:
-                        curHoms.append(self.homHyperparams.hyperparameter**((curHom + startHom + endHom)/self.maxHom))
+                for startHom, startCount in self.startJointHom[newNuc].items():
+                    for endHom, endCount in self.endJointHom[newNuc].items():
+                        curHoms.append(startCount * endCount * self.homPowers.power(curHom + startHom + endHom))
 
             if self.wholeJointHom[newNuc] != 0:
                 # Worst case: whole motif is homopolymer
-                curHoms.append(self.homHyperparams.hyperparameter**(self.motifSize))
+                curHoms.append(self.homPowers.power(self.motifSize * self.maxHom))
 
         # start joints
         elif curHom == len(curPayload):
             if not self.startJointHom[newNuc] and self.wholeJointHom[newNuc] == 0:
-                curHoms.append(self.homHyperparams.hyperparameter**(curHom/self.maxHom))
-            for startHom in self.startJointHom[newNuc]:
-                curHoms.append(self.homHyperparams.hyperparameter**((curHom + startHom)/ self.maxHom))
+                curHoms.append(self.homPowers.power(curHom))
+            for startHom, count in self.startJointHom[newNuc].items():
+                curHoms.append(count * self.homPowers.power(curHom + startHom))
 
             if self.wholeJointHom[newNuc] != 0:
-                curHoms.append(self.homHyperparams.hyperparameter**((curHom + self.keySize)/ self.maxHom))
+                curHoms.append(self.homPowers.power(curHom + self.keySize))
                 
-                for endHom in self.endHomPayload[newNuc]:
-                    for i in range(self.wholeJointHom[newNuc]):
-                        curHoms.append(self.homHyperparams.hyperparameter**((curHom + endHom + self.keySize)/ self.maxHom))
+                for endHom, count in self.endHomPayload[newNuc].items():
+                    curHoms.append(count * self.wholeJointHom[newNuc] * self.homPowers.power(curHom + endHom + self.keySize))
         
         # end joints
         elif len(curPayload) == self.payloadSize:
             if not self.endJointHom[newNuc] and self.wholeJointHom[newNuc] == 0:
-                curHoms.append(self.homHyperparams.hyperparameter**(curHom/self.maxHom))
-            for endHom in self.endJointHom[newNuc]:
-                curHoms.append(self.homHyperparams.hyperparameter**((curHom + endHom)/ self.maxHom))
+                curHoms.append(self.homPowers.power(curHom))
+            for endHom, count in self.endJointHom[newNuc].items():
+                curHoms.append(count * self.homPowers.power(curHom + endHom))
 
             if self.wholeJointHom[newNuc] != 0:
                 curStart = newNuc
@@ -222,13 +381,12 @@ class BasePayloadPenalties(BasePenalties):
                         break
                     curStartHom += 1
                     
-                curHoms.append(self.homHyperparams.hyperparameter**((curHom + curStartHom + self.keySize)/ self.maxHom))
-                for startHom in self.startHomPayload[newNuc]:
-                    for i in range(self.wholeJointHom[newNuc]):
-                        curHoms.append(self.homHyperparams.hyperparameter**((curHom + startHom + self.keySize)/ self.maxHom))
+                curHoms.append(self.homPowers.power(curHom + curStartHom + self.keySize))
+                for startHom, count in self.startHomPayload[newNuc].items():
+                    curHoms.append(count * self.wholeJointHom[newNuc] * self.homPowers.power(curHom + startHom + self.keySize))
         
         else:
-            curHoms.append(self.homHyperparams.hyperparameter**(curHom/ self.maxHom))
+            curHoms.append(self.homPowers.power(curHom))
         return np.sum(np.array(curHoms))
 
     ### Motif GC Content Penalty ###
@@ -238,12 +396,20 @@ class BasePayloadPenalties(BasePenalties):
         return motifGcContent
 
     def motif_GC_content_stats(self, curPayload):
+        gcCount = self.payload_gc_count(curPayload[:-1])
+        gcCount += 1 if curPayload[-1:] in ['G', 'C'] else 0
+        return self.motif_GC_content_score(gcCount, len(curPayload))
+
+    def payload_gc_count(self, payload):
+        if payload == self.curPayload:
+            return self.curGcCount
         gcCount = 0
-        for i in range(len(curPayload)):
-            nuc = curPayload[i]
+        for nuc in payload:
             gcCount += 1 if nuc in ['G', 'C'] else 0
-        
-        curMotifSize = len(curPayload) + self.keySize
+        return gcCount
+
+    def motif_GC_content_score(self, gcCount, payloadLength):
+        curMotifSize = payloadLength + self.keySize
         weight = curMotifSize / self.motifSize
         minGcContent = (100 * (gcCount + self.minJointsGcCount)) / curMotifSize
         maxGcContent = (100 * (gcCount + self.maxJointsGcCount)) / curMotifSize
@@ -252,6 +418,46 @@ class BasePayloadPenalties(BasePenalties):
         score = max(score, weight * (maxGcContent - self.maxGc))
         return score
 
+    ### Validity ###
+
+    def is_valid(self, payload, withConstraints):
+        # within the homopolymer (joint runs included), motif GC, payload distance, key-in-payload and joint repeat limits of withConstraints, hairpins are not checked
+        if 'hom' in withConstraints and self.longest_joined_homopolymer(payload) > self.maxHom:
+            return False
+        if 'motifGcContent' in withConstraints and self.motif_GC_content_stats(payload) > 0:
+            return False
+        if 'payloadDistance' in withConstraints and not self.payloadIndex.is_far(payload):
+            return False
+        if 'keyInPayload' in withConstraints and self.keyAutomaton.count(payload) > 0:
+            return False
+        if 'jointRepeat' in withConstraints and np.any(self.junctionKmers.get(junction_kmers(self.startJoints, self.endJoints, [payload], self.keySize))):
+            return False
+        return True
+
+    def longest_joined_homopolymer(self, payload):
+        # longest homopolymer of payload, with the joint runs before and after it joined to its first and last runs
+        startExtra, endExtra = self.joint_hom_extras()
+        first, last = nucleotides.index(payload[0]), nucleotides.index(payload[-1])
+        startHom = len(payload) - len(payload.lstrip(payload[0]))
+        endHom = len(payload) - len(payload.rstrip(payload[-1]))
+        if startHom == len(payload):
+            return startHom + startExtra[first] + endExtra[last]
+        return max(self.longest_homopolymer(payload), startExtra[first] + startHom, endHom + endExtra[last])
+
+    def joint_hom_extras(self):
+        # per nucleotide, longest run ending the joints before a payload (start) and starting the joints after it (end)
+        startExtra = []
+        endExtra = []
+        for n in nucleotides:
+            if self.wholeJointHom[n] > 0:
+                # the homopolymer goes on into the next payload, no payload may start or end with n
+                startExtra.append(self.maxHom)
+                endExtra.append(self.maxHom)
+            else:
+                startExtra.append(max(self.startJointHom[n], default=0))
+                endExtra.append(max(self.endJointHom[n], default=0))
+        return tuple(startExtra), tuple(endExtra)
+
     ### Hairpin Penalty ###
 
     def hairpin_penalty(self, curPayload):
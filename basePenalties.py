@@ -1,10 +1,25 @@
 import numpy as np
+from hyperparameters import HyperparameterPowers
 from language import nucleotides
 from language import converse
+from vectorizedHairpin import VectorizedHairpinCounter
+from stemIndex import IndexedHairpinCounter
+from iterativeHairpin import IterativeHairpinCounter
+from hairpinMemo import HairpinMemo
+
+# 'recursive' is the send_to_* walk below, the others are drop-in replacements of it
+hairpinEngines = {'recursive': None, 'vectorized': VectorizedHairpinCounter, 'indexed': IndexedHairpinCounter, 'iterative': IterativeHairpinCounter}
+
+# hairpin_count_* -> send_to_* it makes when stem1/stem2 move to other elem types,
+# with the elem it passes on (1: its stem1 elem, 2: its stem2 elem, 0: none)
+hairpinCountSends = {'count_elem1_elem1': {'send_to_elem2_elem1': 2, 'send_to_elem2_elem2': 0, 'send_to_elem1_elem2': 1},
+                     'count_elem1_elem2': {'send_to_elem2_elem1': 0, 'send_to_elem2_elem2': 2, 'send_to_elem1_elem1': 1},
+                     'count_elem2_elem1': {'send_to_elem1_elem1': 2, 'send_to_elem1_elem2': 0, 'send_to_elem2_elem2': 1},
+                     'count_elem2_elem2': {'send_to_elem1_elem1': 0, 'send_to_elem1_elem2': 2, 'send_to_elem2_elem1': 1}}
 
 
 class BasePenalties:
-    def __init__(self, constraints, hyperparams=None, joints=set(), payloads=set()):
+    def __init__(self, constraints, hyperparams=None, joints=set(), payloads=set(), hairpinEngine='recursive', hairpinMemoSize=0, precomputePowers=True):
         self.motifSize = constraints.motifSize
 
         # Hairpin
@@ -26,13 +41,130 @@ class BasePenalties:
         self.hairpinPenalty = 0
 
         # Hyperparameters
+        self.precomputePowers = precomputePowers
         if hyperparams:
             self.hairpinHyperparams = hyperparams.hairpin
+            self.hairpinPowers = HyperparameterPowers(hyperparams.hairpin, self.maxHairpin, self.maxHairpin, precomputePowers)
+
+        # Hairpin engine
+        assert(hairpinEngine in hairpinEngines)
+        self.hairpinEngine = hairpinEngine
+        self.hairpinCounter = hairpinEngines[hairpinEngine](self) if hairpinEngines[hairpinEngine] else None
+
+        # Memo of the recursive engine, 0 to turn off
+        self.hairpinMemo = HairpinMemo(hairpinMemoSize) if hairpinMemoSize > 0 else None
 
     ### Homopolymer Penalty ###
 
+    def longest_homopolymer(self, sequence):
+        longest = 0
+        hom = 0
+        for i in range(len(sequence)):
+            hom = hom + 1 if i > 0 and sequence[i] == sequence[i - 1] else 1
+            longest = max(longest, hom)
+        return longest
+
     ### Hairpin Penalty ###
 
+    def add_to_hairpin_index(self, elems, newElem):
+        self.clear_hairpin_memo()
+        if self.hairpinCounter:
+            self.hairpinCounter.add_elem(elems, newElem)
+
+    def clear_hairpin_memo(self):
+        if self.hairpinMemo:
+            self.hairpinMemo.clear()
+
+    def hairpin_memo_window(self, curElem, elems1, elems2, isKey, hairpinCount, stem1Start, stem2Start):
+        # memo context of the window, the send_to_* done at each j and, per hairpin_count_* and curJ, the j of its send
+        if self.hairpinMemo is None or not elems2:
+            return None
+        info = {'elem1Size': self.keySize if isKey else self.payloadSize, 'elem2Size': self.payloadSize if isKey else self.keySize}
+        context = self.hairpinMemo.context((curElem, isKey, hairpinCount, id(elems1), len(elems1), id(elems2), len(elems2)))
+        sends = []
+        for j in range(self.maxHairpin):
+            stem1Pos = stem1Start + j
+            stem2Pos = stem2Start + self.maxHairpin - 1 - j
+            if not (self.is_in_elem2(info, stem1Pos) or self.is_in_elem2(info, stem2Pos)):
+                sends.append('send_to_elem1_elem1')
+            elif not self.is_in_elem2(info, stem1Pos):
+                sends.append('send_to_elem1_elem2')
+            elif self.is_in_elem2(info, stem2Pos):
+                sends.append('send_to_elem2_elem2')
+            elif self.is_in_other_elem1(info, stem2Pos):
+                sends.append('send_to_elem2_elem1')
+            else:
+                sends.append(None)
+        sendPositions = {}
+        for counterName, counterSends in hairpinCountSends.items():
+            sendPositions[counterName] = [-1] * self.maxHairpin
+            for curJ in range(self.maxHairpin):
+                if sends[curJ] in counterSends:
+                    sendPositions[counterName][curJ] = curJ
+                elif curJ > 0:
+                    sendPositions[counterName][curJ] = sendPositions[counterName][curJ - 1]
+        return (context, sends, sendPositions)
+
+    def memoized_hairpin_count(self, counter, info, elem_1, elem_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
+        if info['memo'] is None:
+            counter(info, elem_1, elem_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins)
+            return
+
+        # pairs of elem_1/elem_2 compared before the walk is sent to other elems
+        context, sends, sendPositions = info['memo']
+        sendJ = sendPositions[counter.__name__][curJ]
+        key = (counter.__name__, elem_1, elem_2, curJ, sendJ, stem1Start % self.motifSize, stem2Start % self.motifSize, info['isKey'])
+        stemLength = self.hairpinMemo.get(key)
+        if stemLength is None:
+            stemLength = self.stem_pair_length(counter.__name__, info, elem_1, elem_2, curJ, sendJ, stem1Start, stem2Start)
+            self.hairpinMemo.put(key, stemLength)
+
+        if sendJ < 0:
+            if stemLength > 0:
+                self.add_hairpin(info, hairpinLength + stemLength, hairpins)
+            return
+        if stemLength < 0:
+            return
+
+        # the rest of the walk only depends on the elem passed on
+        hairpinLength += stemLength
+        sender = sends[sendJ]
+        passedOn = hairpinCountSends[counter.__name__][sender]
+        curE_1 = elem_1 if passedOn == 1 else ""
+        curE_2 = elem_2 if passedOn == 2 else ""
+        key = (sender, curE_1, curE_2, sendJ, stem1Start, stem2Start, hairpinLength, context)
+        sentHairpins = self.hairpinMemo.get(key)
+        if sentHairpins is None:
+            numHairpins = len(hairpins)
+            getattr(self, sender)(info, sendJ, stem1Start, stem2Start, hairpinLength, hairpins, curE_1, curE_2)
+            self.hairpinMemo.put(key, sum(hairpins[numHairpins:]))
+        elif sentHairpins:
+            hairpins.append(sentHairpins)
+
+    def stem_pair_length(self, counterName, info, elem_1, elem_2, curJ, sendJ, stem1Start, stem2Start):
+        # pairs matched from curJ down to sendJ (excluded), -1 on a mismatch;
+        # without a send, 0 unless a hairpin is found at j == 0
+        inElem2_1 = counterName.startswith('count_elem2')
+        inElem2_2 = counterName.endswith('elem2')
+        stemLength = 0
+        for j in range(curJ, sendJ, -1):
+            curStem1Pos = (stem1Start + j) % self.motifSize - (info['elem1Size'] if inElem2_1 else 0)
+            curStem2Pos = (stem2Start + self.maxHairpin - 1 - j) % self.motifSize - (info['elem1Size'] if inElem2_2 else 0)
+            if (not inElem2_1 and curStem1Pos >= len(elem_1)) or (not inElem2_2 and curStem2Pos >= len(elem_2)):
+                continue
+            if elem_1[curStem1Pos] != converse[elem_2[curStem2Pos]]:
+                return 0 if sendJ < 0 else -1
+            stemLength += 1
+            if j == 0:
+                return stemLength
+        return 0 if sendJ < 0 else stemLength
+
+    def add_hairpin(self, info, hairpinLength, hairpins):
+        if info['hairpinCount']:
+            hairpins.append(1)
+        else:
+            hairpins.append(self.hairpinPowers.power(hairpinLength))
+
     def hairpin_penalty(self, curElem, elems1, elems2, isKey = False):
         hairpinStats = self.forward_hairpin_counter(curElem, elems1, elems2, isKey) + self.backward_hairpin_counter(curElem, elems1, elems2, isKey)
         return hairpinStats
@@ -75,7 +207,7 @@ class BasePenalties:
             if info['hairpinCount']:
                 hairpins.append(1)
             else:
-                hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                hairpins.append(self.hairpinPowers.power(hairpinLength))
 
         for j in range(curJ, -1, -1):
 
@@ -89,7 +221,7 @@ class BasePenalties:
                 if info['hairpinCount']:
                     hairpins.append(1)
                 else:
-                    hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                    hairpins.append(self.hairpinPowers.power(hairpinLength))
                 return True
 
         return False
@@ -233,6 +365,9 @@ class BasePenalties:
         return True
 
     def hairpin_count_elem1_elem1(self, info, elem1_1, elem1_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
+        self.memoized_hairpin_count(self.count_elem1_elem1, info, elem1_1, elem1_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins)
+
+    def count_elem1_elem1(self, info, elem1_1, elem1_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
         for j in range(curJ, -1, -1):
             if self.send_to_elem2_elem1(info, j, stem1Start, stem2Start, hairpinLength, hairpins, curE1=elem1_2) or \
             self.send_to_elem2_elem2(info, j, stem1Start, stem2Start, hairpinLength, hairpins) or \
@@ -254,12 +389,15 @@ class BasePenalties:
                     if info['hairpinCount']:
                         hairpins.append(1)
                     else:
-                        hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                        hairpins.append(self.hairpinPowers.power(hairpinLength))
             else:
                 hairpinLength = 0
                 break
 
     def hairpin_count_elem1_elem2(self, info, elem1, elem2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
+        self.memoized_hairpin_count(self.count_elem1_elem2, info, elem1, elem2, curJ, stem1Start, stem2Start, hairpinLength, hairpins)
+
+    def count_elem1_elem2(self, info, elem1, elem2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
         for j in range(curJ, -1, -1):
             if self.send_to_elem2_elem1(info, j, stem1Start, stem2Start, hairpinLength, hairpins) or \
             self.send_to_elem2_elem2(info, j, stem1Start, stem2Start, hairpinLength, hairpins, curE2_2=elem2) or \
@@ -281,12 +419,15 @@ class BasePenalties:
                     if info['hairpinCount']:
                         hairpins.append(1)
                     else:
-                        hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                        hairpins.append(self.hairpinPowers.power(hairpinLength))
             else:
                 hairpinLength = 0
                 break
 
     def hairpin_count_elem2_elem1(self, info, elem2, elem1, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
+        self.memoized_hairpin_count(self.count_elem2_elem1, info, elem2, elem1, curJ, stem1Start, stem2Start, hairpinLength, hairpins)
+
+    def count_elem2_elem1(self, info, elem2, elem1, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
         for j in range(curJ, -1, -1):
             if self.send_to_elem1_elem1(info, j, stem1Start, stem2Start, hairpinLength, hairpins, curE1_2=elem1) or \
             self.send_to_elem1_elem2(info, j, stem1Start, stem2Start, hairpinLength, hairpins) or \
@@ -308,12 +449,15 @@ class BasePenalties:
                     if info['hairpinCount']:
                         hairpins.append(1)
                     else:
-                        hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                        hairpins.append(self.hairpinPowers.power(hairpinLength))
             else:
                 hairpinLength = 0
                 break
 
     def hairpin_count_elem2_elem2(self, info, elem2_1, elem2_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
+        self.memoized_hairpin_count(self.count_elem2_elem2, info, elem2_1, elem2_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins)
+
+    def count_elem2_elem2(self, info, elem2_1, elem2_2, curJ, stem1Start, stem2Start, hairpinLength, hairpins):
         for j in range(curJ, -1, -1):
             if self.send_to_elem1_elem1(info, j, stem1Start, stem2Start, hairpinLength, hairpins) or \
             self.send_to_elem1_elem2(info, j, stem1Start, stem2Start, hairpinLength, hairpins, curE2=elem2_2) or \
@@ -332,12 +476,14 @@ class BasePenalties:
                     if info['hairpinCount']:
                         hairpins.append(1)
                     else:
-                        hairpins.append(self.hairpinHyperparams.hyperparameter**(hairpinLength / self.maxHairpin))
+                        hairpins.append(self.hairpinPowers.power(hairpinLength))
             else:
                 hairpinLength = 0
                 break
 
     def backward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        if self.hairpinCounter:
+            return self.hairpinCounter.backward_hairpin_counter(curElem, elems1, elems2, isKey=isKey, hairpinCount=hairpinCount)
         hairpins = []
         for i in range(self.maxHairpin):
             stem1Start = len(curElem) - 1 - i
@@ -346,6 +492,8 @@ class BasePenalties:
         return np.sum(np.array(hairpins))
 
     def backward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        if self.hairpinCounter:
+            return self.hairpinCounter.backward_hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey=isKey, hairpinCount=hairpinCount, loopSizeMin=loopSizeMin, loopSizeMax=loopSizeMax)
         if loopSizeMin < 0 or loopSizeMax < 0:
             loopSizeMin = self.loopSizeMin
             loopSizeMax = self.loopSizeMax
@@ -364,13 +512,16 @@ class BasePenalties:
                     'elems2': elems2, 
                     'elem2Size': elem2Size,
                     'isKey': isKey,
-                    'hairpinCount': hairpinCount
+                    'hairpinCount': hairpinCount,
+                    'memo': self.hairpin_memo_window(curElem, elems1, elems2, isKey, hairpinCount, stem1Start, stem2Start)
                     }
             self.send_to_all_check(info, self.maxHairpin - 1, stem1Start, stem2Start, 0, hairpins)
 
         return np.sum(np.array(hairpins))
 
     def forward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        if self.hairpinCounter:
+            return self.hairpinCounter.forward_hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey=isKey, hairpinCount=hairpinCount, loopSizeMin=loopSizeMin, loopSizeMax=loopSizeMax)
         if loopSizeMin < 0 or loopSizeMax < 0:
             loopSizeMin = self.loopSizeMin
             loopSizeMax = self.loopSizeMax
@@ -389,7 +540,8 @@ class BasePenalties:
                     'elems2': elems2, 
                     'elem2Size': elem2Size,
                     'isKey': isKey,
-                    'hairpinCount': hairpinCount
+                    'hairpinCount': hairpinCount,
+                    'memo': self.hairpin_memo_window(curElem, elems1, elems2, isKey, hairpinCount, stem1Start, stem2Start)
                     }
 
             self.send_to_all_check(info, self.maxHairpin - 1, stem1Start, stem2Start, 0, hairpins)
@@ -398,6 +550,8 @@ class BasePenalties:
 
 
     def forward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        if self.hairpinCounter:
+            return self.hairpinCounter.forward_hairpin_counter(curElem, elems1, elems2, isKey=isKey, hairpinCount=hairpinCount)
         hairpins = []
         for i in range(self.maxHairpin):
             stem1Start = len(curElem) - 1 - i
@@ -0,0 +1,78 @@
+import numpy as np
+from language import nucleotides
+from exactSampler import ExactPayloadSampler
+from exactSampler import completion_counts
+from exactSampler import isGc
+
+
+class BeamPayloadSearch:
+    """Builds a payload keeping the beamWidth prefixes of lowest weighted penalty at every length.
+    A prefix is pruned as soon as no completion of it meets the homopolymer and GC limits of
+    withConstraints, so a search that ends with a payload never ran into an unsatisfiable
+    last position. Hairpins only rank the prefixes: a finished payload is not checked for them, so
+    'hairpin' in withConstraints weighs the search but is not enforced. Ties are broken at random by rng."""
+
+    def __init__(self, penalties, weights, rng, beamWidth=8):
+        assert(beamWidth > 0)
+        self.penalties = penalties
+        self.weights = weights
+        self.rng = rng
+        self.beamWidth = beamWidth
+        # prefixes whose extensions were scored
+        self.expanded = 0
+
+    ### Lower bound ###
+
+    def completion_bounds(self, withConstraints):
+        # (completion counts, None if homopolymers are free) and the payload GC count bounds
+        payloadSize, maxHom, minGcCount, maxGcCount, startExtra, endExtra = ExactPayloadSampler(self.penalties, self.rng).constraint_set()
+        if 'motifGcContent' not in withConstraints:
+            minGcCount, maxGcCount = 0, payloadSize
+        if 'hom' not in withConstraints:
+            return None, (minGcCount, maxGcCount)
+        return completion_counts(payloadSize, maxHom, minGcCount, maxGcCount, startExtra, endExtra), (minGcCount, maxGcCount)
+
+    def can_complete(self, table, gcBounds, length, state):
+        b, r, g = state
+        if table is not None:
+            return (b, r, g) in table[length]
+        return g <= gcBounds[1] and g + self.penalties.payloadSize - length >= gcBounds[0]
+
+    ### Search ###
+
+    def search(self, withConstraints, exclude=set()):
+        # lowest penalty payload not in exclude, None if every prefix was pruned
+        p = self.penalties
+        constraints = [constraint for constraint in withConstraints if constraint in p.extensionPenalties]
+        weights = np.array([self.weights[constraint] for constraint in constraints], dtype=float)
+        table, gcBounds = self.completion_bounds(withConstraints)
+
+        # (penalty, prefix, (b, r, g) of prefix, hairpin windows of prefix)
+        beam = [(0.0, '', None, None)]
+        for length in range(1, p.payloadSize + 1):
+            candidates = []
+            for penalty, prefix, state, windows in beam:
+                self.expanded += 1
+                p.hairpinTracker.restore(prefix, windows)
+                scores = p.score_extensions(prefix, constraints) @ weights
+                for c, n in enumerate(nucleotides):
+                    if state is None:
+                        nextState = (c, 1, int(isGc[c]))
+                    else:
+                        b, r, g = state
+                        nextState = (c, r + 1 if c == b else 1, g + isGc[c])
+                    if self.can_complete(table, gcBounds, length, nextState):
+                        candidates.append((penalty + scores[c], prefix + n, nextState, p.hairpinTracker.extension_state(prefix, n)))
+            if not candidates:
+                return None
+            ties = self.rng.random(len(candidates))
+            order = sorted(range(len(candidates)), key=lambda i: (candidates[i][0], ties[i]))
+            if length == p.payloadSize:
+                beam = [candidates[i] for i in order]
+            else:
+                beam = [candidates[i] for i in order[:self.beamWidth]]
+
+        for penalty, payload, state, windows in beam:
+            if payload not in exclude and p.is_valid(payload, withConstraints):
+                return payload
+        return None
@@ -0,0 +1,414 @@
+import itertools
+import multiprocessing
+import pytest
+import numpy as np
+import motifBuilder as mb
+import keyBuilder as kb
+import keyMotifBuilder as kmb
+import constraints as c
+import hyperparameters as h
+from nucleotideSampler import NucleotideSampler
+from populationBuilder import PopulationBuilder
+from exactSampler import ExactPayloadSampler
+from exactSampler import completion_counts
+from beamPayloadSearch import BeamPayloadSearch
+from packedSequences import PackedSequenceSet
+from libraryRepair import LibraryRepair
+from keyTable import key_table
+from keyTable import unpack_key
+from validation import Validate
+from language import nucleotides
+from keyAutomaton import reverse_complement
+
+
+def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=4, payloadNum=5, keyNum=4, maxHom=2, minGc=25, maxGc=60):
+    return c.Constraints(payloadSize, payloadNum, maxHom, maxHairpin, loopSize, minGc, maxGc, keySize, keyNum)
+
+def get_hyperparameters():
+    hyperparams = {'hom': 5, 'motifGcContent': 5, 'keyGcContent': 5, 'hairpin': 5}
+    return h.Hyperparameters(hyperparams)
+
+def get_weights():
+    return {'hom': 1, 'motifGcContent': 1, 'keyGcContent': 1, 'hairpin': 1}
+
+async def build_payloads(constraints, seed, withConstraints={'hom', 'motifGcContent', 'hairpin'}):
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), seed)
+    await motifBuilder.add_joints({'ATCG', 'TTAG', 'GCAA'})
+    return await motifBuilder.buildAllPayloads(withConstraints)
+
+###### Sampler ######
+
+def test_sampler_follows_probabilities():
+    sampler = NucleotideSampler(seed=1, blockSize=7)
+    p = [0.1, 0.0, 0.6, 0.3]
+    counts = {n: 0 for n in nucleotides}
+    for _ in range(10000):
+        counts[sampler.choose(p)] += 1
+    assert counts['T'] == 0
+    assert counts['A'] == pytest.approx(1000, abs=150)
+    assert counts['C'] == pytest.approx(6000, abs=300)
+    assert counts['G'] == pytest.approx(3000, abs=300)
+
+def test_sampler_never_draws_impossible_nucleotides():
+    sampler = NucleotideSampler(seed=2)
+    p = [0.5, 0.5 - 1e-12, 0.0, 0.0]
+    assert all(sampler.choose(p) in ['A', 'T'] for _ in range(1000))
+
+###### Builders ######
+
+@pytest.mark.asyncio
+async def test_payloads_are_reproducible_with_seed():
+    constraints = get_constraints()
+    payloads = await build_payloads(constraints, 3)
+    assert payloads == await build_payloads(constraints, 3)
+    assert all(len(payload) == constraints.payloadSize for payload in payloads)
+
+@pytest.mark.asyncio
+async def test_keys_are_reproducible_with_seed():
+    constraints = get_constraints()
+    withConstraints = {'hom', 'keyGcContent', 'hairpin'}
+    keys = await kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 3).buildAllKeys(withConstraints)
+    assert keys == await kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 3).buildAllKeys(withConstraints)
+    assert all(len(key) == constraints.keySize for key in keys)
+
+@pytest.mark.asyncio
+async def test_builders_skip_constraints_without_extension_penalties():
+    constraints = get_constraints()
+    # keyDistance and similarity aren't scored on payloads, motifGcContent isn't scored on keys
+    payloads = await build_payloads(constraints, 4, {'hom', 'motifGcContent', 'hairpin', 'keyDistance', 'similarity'})
+    assert payloads == await build_payloads(constraints, 4)
+    keys = await kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 4).buildAllKeys({'hom', 'keyGcContent', 'hairpin', 'motifGcContent'})
+    assert keys == await kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 4).buildAllKeys({'hom', 'keyGcContent', 'hairpin'})
+
+###### Population builder ######
+
+@pytest.mark.asyncio
+async def test_batch_builds_distinct_reproducible_payloads():
+    constraints = get_constraints(payloadNum=50)
+    withConstraints = {'hom', 'motifGcContent', 'hairpin'}
+    payloads = []
+    for _ in range(2):
+        motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 4)
+        await motifBuilder.add_joints({'ATCG', 'TTAG', 'GCAA'})
+        payloads.append(await motifBuilder.buildAllPayloadsBatch(withConstraints))
+        assert payloads[-1] == motifBuilder.penalties.payloads
+    assert payloads[0] == payloads[1]
+    assert len(payloads[0]) == constraints.payloadNum
+    assert all(len(payload) == constraints.payloadSize for payload in payloads[0])
+
+@pytest.mark.asyncio
+async def test_population_penalties_match_payload_penalties():
+    constraints = get_constraints(maxHairpin=2, loopSize=1, payloadSize=8, maxHom=2)
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 5)
+    await motifBuilder.add_joints({'ATCG', 'TTAG', 'GCAA'})
+    populationBuilder = PopulationBuilder(motifBuilder.penalties, get_weights(), motifBuilder.sampler.rng)
+    candidates = ['ACCTG', 'GGGCA', 'ACTTC']
+    payloads = np.array([[nucleotides.index(n) for n in candidate] + [0] * 3 for candidate in candidates], dtype=np.uint8)
+    gcCounts = np.array([sum(n in ['G', 'C'] for n in candidate) for candidate in candidates])
+    homs = np.array([1, 3, 1])
+    gcPenalties = populationBuilder.gc_penalties(gcCounts, 5)
+    homPenalties = populationBuilder.homopolymer_penalties(payloads, homs, 5)
+    hairpins = populationBuilder.hairpin_penalties(payloads, 5)
+    for i, candidate in enumerate(candidates):
+        assert list(gcPenalties[i]) == pytest.approx(motifBuilder.penalties.get_gc_penalties(candidate))
+        for j, n in enumerate(nucleotides):
+            curHom = homs[i] + 1 if candidate[-1] == n else 1
+            assert homPenalties[i, j] == pytest.approx(motifBuilder.penalties.homPowers.power(curHom))
+    # A CC T G + G closes the stem CC / GG
+    assert list(hairpins[0]) == [0, 0, 0, motifBuilder.penalties.hairpinPowers.power(2)]
+    assert not hairpins[1:].any()
+
+@pytest.mark.asyncio
+async def test_population_skips_constraints_without_batch_penalty():
+    constraints = get_constraints(payloadSize=8)
+    results = []
+    for withConstraints in [{'hom', 'motifGcContent'}, {'hom', 'motifGcContent', 'similarity'}]:
+        motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 6)
+        await motifBuilder.add_joints({'ATCG', 'TTAG', 'GCAA'})
+        populationBuilder = PopulationBuilder(motifBuilder.penalties, get_weights(), motifBuilder.sampler.rng)
+        payloads, scores = populationBuilder.build(withConstraints, 64)
+        results.append((payloads.tolist(), scores.tolist()))
+    assert results[0] == results[1]
+
+###### Exact sampler ######
+
+def is_valid_payload(payload, joints, constraints):
+    # every motif startJoint + payload + endJoint within the GC bounds, a motif being
+    # the second half of a joint, the payload and the first half of a joint
+    jointSize = constraints.keySize // 2
+    for joint1 in joints:
+        for joint2 in joints:
+            motif = joint1[jointSize:] + payload + joint2[:jointSize]
+            gcContent = 100 * sum(n in ['G', 'C'] for n in motif) / len(motif)
+            if gcContent < constraints.minGc or gcContent > constraints.maxGc:
+                return False
+            # homopolymers through the payload and the joints on both sides of it
+            chain = joint1 + payload + joint2
+            hom = 1
+            for i in range(1, len(chain)):
+                hom = hom + 1 if chain[i] == chain[i - 1] else 1
+                if hom > constraints.maxHom:
+                    return False
+    return True
+
+@pytest.mark.asyncio
+async def test_exact_sampler_counts_and_draws_only_valid_payloads():
+    constraints = get_constraints(payloadSize=6, maxHom=2, keySize=4, minGc=25, maxGc=75)
+    joints = {'ATCG', 'TTAG', 'GCAA'}
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 6)
+    await motifBuilder.add_joints(joints)
+    exactSampler = ExactPayloadSampler(motifBuilder.penalties, motifBuilder.sampler.rng)
+    valid = {''.join(payload) for payload in itertools.product(nucleotides, repeat=constraints.payloadSize)
+             if is_valid_payload(''.join(payload), joints, constraints)}
+    assert exactSampler.num_valid() == len(valid)
+    samples = [exactSampler.sample() for _ in range(2000)]
+    assert set(samples) <= valid
+    assert len(set(samples)) > len(valid) / 2
+
+@pytest.mark.asyncio
+async def test_exact_builder_reuses_cached_table():
+    constraints = get_constraints(payloadSize=12, payloadNum=20)
+    hits = completion_counts.cache_info().hits
+    for seed in [7, 8]:
+        motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), seed)
+        await motifBuilder.add_joints({'ATCG', 'TTAG', 'GCAA'})
+        payloads = await motifBuilder.buildAllPayloadsExact()
+        assert len(payloads) == constraints.payloadNum
+        assert payloads == motifBuilder.penalties.payloads
+    assert completion_counts.cache_info().hits > hits
+
+###### Beam search ######
+
+@pytest.mark.asyncio
+async def test_beam_search_builds_only_valid_payloads():
+    constraints = get_constraints(payloadSize=12, payloadNum=10, maxHom=2, minGc=40, maxGc=50)
+    # every joint half has one G/C
+    joints = {'ACGT', 'TGCA', 'AGTC'}
+    withConstraints = {'hom', 'motifGcContent', 'hairpin'}
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 11)
+    await motifBuilder.add_joints(joints)
+    payloads = await motifBuilder.buildAllPayloadsBeam(withConstraints, beamWidth=4)
+    assert len(payloads) == constraints.payloadNum
+    assert payloads == motifBuilder.penalties.payloads
+    assert all(is_valid_payload(payload, joints, constraints) for payload in payloads)
+    # hairpins only rank the prefixes, the homopolymer and GC limits hold on the whole library
+    validate = Validate(constraints)
+    await validate.add_keys_and_payloads({reverse_complement(joint) for joint in joints}, set(payloads))
+    assert validate.get_total_scores_of_constraints(['hom', 'motifGcContent']) == 0
+    # at most beamWidth prefixes are expanded at every length
+    assert constraints.payloadNum * constraints.payloadSize <= motifBuilder.expandedNodes <= constraints.payloadNum * (1 + 4 * (constraints.payloadSize - 1))
+
+@pytest.mark.asyncio
+async def test_beam_search_prunes_unsatisfiable_prefixes():
+    # no payload of size 4 next to these joints keeps a motif within 40-45% GC
+    constraints = get_constraints(payloadSize=4, minGc=40, maxGc=45)
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 12)
+    await motifBuilder.add_joints({'ATCG', 'GGCC'})
+    beamSearch = BeamPayloadSearch(motifBuilder.penalties, get_weights(), motifBuilder.sampler.rng)
+    assert beamSearch.search({'hom', 'motifGcContent'}) is None
+    assert beamSearch.expanded == 1
+
+###### Key table ######
+
+@pytest.mark.asyncio
+async def test_key_table_matches_validation():
+    constraints = c.Constraints(8, 5, 1, 1, -1, 25, 60, 4, 4, 0, 1)
+    homExcess, gcCounts, hairpins = key_table(constraints.keySize, constraints.maxHom, constraints.maxHairpin, constraints.loopSizeMin, constraints.loopSizeMax)
+    assert len(gcCounts) == 4**constraints.keySize
+    assert homExcess.dtype == gcCounts.dtype == hairpins.dtype == np.uint8
+    # row i is the key packed as i
+    for i in range(len(gcCounts)):
+        key = unpack_key(i, constraints.keySize)
+        validate = Validate(constraints)
+        validate.add_keys({key})
+        assert homExcess[i] == validate.get_key_homopolymer_penalty()
+        assert hairpins[i] == validate.get_key_hairpin_penalty()
+        assert gcCounts[i] == sum(n in ['G', 'C'] for n in key)
+
+@pytest.mark.asyncio
+async def test_key_table_selects_distinct_valid_keys():
+    constraints = get_constraints(keySize=6, keyNum=12, minGc=40, maxGc=60)
+    withConstraints = {'hom', 'keyGcContent', 'hairpin'}
+    for selection in ['weighted', 'diverse']:
+        keyBuilder = kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 15)
+        await keyBuilder.penalties.add_key('ACGTCA')
+        keys = await keyBuilder.buildAllKeysFromTable(withConstraints, selection)
+        assert len(keys) == constraints.keyNum and 'ACGTCA' not in keys
+        assert keyBuilder.penalties.keys == keys | {'ACGTCA'}
+        validate = Validate(constraints)
+        validate.add_keys(keys)
+        assert validate.get_total_scores_of_constraints(['keyHom', 'keyGcContent', 'keyHairpin']) == 0
+
+@pytest.mark.asyncio
+async def test_diverse_key_selection_spreads_keys():
+    constraints = get_constraints(keySize=4, keyNum=4)
+    keyBuilder = kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 16)
+    keys = list(await keyBuilder.buildAllKeysFromTable(set(), 'diverse'))
+    # 4 keys of size 4 can differ at every position
+    assert all(sum(a != b for a, b in zip(keys[i], keys[j])) == 4 for i in range(4) for j in range(i))
+
+###### Repair ######
+
+@pytest.mark.asyncio
+async def test_repair_mutates_only_offending_payloads():
+    constraints = get_constraints(payloadSize=8, maxHom=2, minGc=25, maxGc=75)
+    withConstraints = {'hom', 'motifGcContent'}
+    keys = {'ACGT', 'TGCA'}
+    payloads = {'ACGTTGCA', 'GATCCTAG', 'CAGTTCAG', 'ACAAAATG'}
+    libraryRepair = LibraryRepair(constraints, withConstraints, 13)
+    repairedKeys, repairedPayloads, isValid = await libraryRepair.repair(keys, payloads, maxSeconds=5)
+    assert isValid
+    assert repairedKeys == keys
+    assert len(repairedPayloads) == len(payloads)
+    assert payloads - repairedPayloads == {'ACAAAATG'}
+    validate = Validate(constraints)
+    await validate.add_keys_and_payloads(repairedKeys, repairedPayloads)
+    assert validate.get_total_scores_of_constraints(['hom', 'motifGcContent', 'keyGcContent']) == 0
+
+@pytest.mark.asyncio
+async def test_repair_removes_hairpins():
+    constraints = c.Constraints(8, 4, 2, 3, 3, 25, 75, 4, 2)
+    withConstraints = {'hom', 'motifGcContent', 'hairpin'}
+    keys = {'TAGT', 'TATT'}
+    payloads = {'ATATAGAA', 'ACGTTGCA'}
+    validate = Validate(constraints)
+    await validate.add_keys_and_payloads(set(keys), set(payloads))
+    assert validate.get_motifs_and_keys_hairpin_score() < 0
+    libraryRepair = LibraryRepair(constraints, withConstraints, 14)
+    repairedKeys, repairedPayloads, isValid = await libraryRepair.repair(keys, payloads, maxSeconds=5)
+    assert isValid and libraryRepair.steps > 0
+    validate = Validate(constraints)
+    await validate.add_keys_and_payloads(repairedKeys, repairedPayloads)
+    assert validate.get_total_scores_of_constraints(['hom', 'motifGcContent', 'keyGcContent', 'hairpin']) == 0
+
+@pytest.mark.asyncio
+async def test_repair_local_penalties_match_validation():
+    constraints = c.Constraints(8, 6, 2, 2, 1, 25, 75, 4, 3, minKeyDistance=2, minPayloadDistance=3)
+    withConstraints = {'hom', 'motifGcContent', 'hairpin', 'keyDistance', 'payloadDistance', 'keyInPayload', 'jointRepeat'}
+    rng = np.random.default_rng(1)
+    libraryRepair = LibraryRepair(constraints, withConstraints, 3)
+    v = libraryRepair.validate
+    await v.add_keys_and_payloads({'ACGT', 'TTAG', 'GGCA'}, {''.join(rng.choice(nucleotides, 8)) for _ in range(6)})
+    libraryRepair.build_indexes()
+    for _ in range(20):
+        isKey = bool(rng.integers(2))
+        elem = sorted(v.keys if isKey else v.payloads)[0]
+        newElem = ''.join(rng.choice(nucleotides, len(elem)))
+        if newElem in (v.keys if isKey else v.payloads):
+            continue
+        libraryRepair.full_penalty()
+        hairpins = libraryRepair.hairpins_with(isKey, elem)
+        await libraryRepair.replace(isKey, elem, newElem)
+        # hairpins from the other payloads and joints reaching into newElem included
+        penalty = libraryRepair.stats_penalty() + libraryRepair.hairpinEstimate - hairpins + libraryRepair.hairpins_with(isKey, newElem)
+        validate = Validate(constraints)
+        await validate.add_keys_and_payloads(set(v.keys), set(v.payloads))
+        assert penalty == -validate.get_total_scores_of_constraints(withConstraints | {'keyGcContent'})
+
+@pytest.mark.asyncio
+async def test_repair_keeps_the_hairpins_of_every_elem():
+    constraints = c.Constraints(8, 6, 3, 2, 1, 0, 100, 4, 3)
+    rng = np.random.default_rng(2)
+    libraryRepair = LibraryRepair(constraints, {'hairpin'}, 5)
+    v = libraryRepair.validate
+    await v.add_keys_and_payloads({'ACGT', 'TTAG', 'GGCA'}, {''.join(rng.choice(nucleotides, 8)) for _ in range(6)})
+    libraryRepair.build_indexes()
+    for isKey, elem in await libraryRepair.offenders():
+        if elem in (v.keys if isKey else v.payloads):
+            await libraryRepair.improve(isKey, elem)
+    assert libraryRepair.steps > 0
+    # the counts kept through the mutations are the ones of the library they led to
+    elemHairpins = libraryRepair.elemHairpins
+    libraryRepair.build_indexes()
+    assert elemHairpins == libraryRepair.elemHairpins
+    hairpinCount = v.get_motif_and_key_hairpin_penalty()
+    for payload in v.payloads:
+        validate = Validate(constraints)
+        await validate.add_keys_and_payloads(set(v.keys), v.payloads - {payload})
+        assert await libraryRepair.elem_penalty(False, payload) == hairpinCount - validate.get_motif_and_key_hairpin_penalty()
+
+###### Parallel attempts ######
+
+@pytest.mark.asyncio
+async def test_parallel_attempts_return_a_valid_library():
+    withConstraints = {'hom', 'motifGcContent', 'hairpin'}
+    keys, payloads, motifs, isValid = await kmb.buildAnswerParallel(withConstraints, 5, 8, 2, 2, 2, 25, 60, 1, 1, 2, 7, numAttempts=3, maxSeconds=10)
+    assert isValid is True
+    assert motifs == kmb.joints_to_motifs(kmb.keys_to_joints(keys), payloads)
+    # the attempts still running were ended
+    assert not multiprocessing.active_children()
+    validate = Validate(kmb.get_constraints(maxHairpin=2, payloadSize=8, keySize=2, keyNum=2, payloadNum=5, maxHom=1, minGc=25, maxGc=60, loopMin=1, loopMax=2))
+    await validate.add_keys_and_payloads(keys, payloads)
+    assert validate.get_total_scores_of_constraints(['hom', 'motifGcContent', 'keyGcContent', 'hairpin']) == 0
+
+###### Unique elements ######
+
+def test_packed_sequence_set():
+    sequences = PackedSequenceSet(['ACGT', 'AACGT'])
+    assert 'ACGT' in sequences and 'AACGT' in sequences and 'CGT' not in sequences
+    assert not sequences.add('ACGT')
+    assert sequences.add('TTTT')
+    assert len(sequences) == 3
+    assert set(sequences) == {'ACGT', 'AACGT', 'TTTT'}
+
+@pytest.mark.asyncio
+async def test_unique_payloads_reach_payload_num():
+    constraints = get_constraints(payloadSize=6, payloadNum=40, maxHom=2)
+    withConstraints = {'hom', 'motifGcContent', 'hairpin'}
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), get_weights(), 9)
+    # every joint half has one G/C
+    await motifBuilder.add_joints({'ACGT', 'TGCA', 'AGTC'})
+    payloads = await motifBuilder.buildAllUniquePayloads(withConstraints)
+    assert len(payloads) == constraints.payloadNum
+    assert payloads == motifBuilder.penalties.payloads
+    assert all(motifBuilder.penalties.is_valid(payload, withConstraints) for payload in payloads)
+
+@pytest.mark.asyncio
+async def test_unique_keys_stop_at_attempt_budget():
+    # only 8 keys of size 2 have one G/C
+    constraints = get_constraints(keySize=2, keyNum=20, minGc=50, maxGc=50)
+    withConstraints = {'hom', 'keyGcContent'}
+    keyBuilder = kb.KeyBuilder(constraints, get_hyperparameters(), get_weights(), 10)
+    keys = await keyBuilder.buildAllUniqueKeys(withConstraints, maxAttempts=200)
+    assert 0 < len(keys) <= 8
+    assert keys == keyBuilder.penalties.keys
+    assert all(keyBuilder.penalties.is_valid(key, withConstraints) for key in keys)
+
+@pytest.mark.asyncio
+async def test_unique_payloads_keep_min_distance():
+    constraints = c.Constraints(8, 30, 2, 2, 1, 25, 60, 4, 4, minPayloadDistance=3)
+    withConstraints = {'hom', 'motifGcContent', 'payloadDistance'}
+    weights = dict(get_weights(), payloadDistance=5)
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), weights, 11)
+    await motifBuilder.add_joints({'ACGT', 'TGCA', 'AGTC'})
+    payloads = await motifBuilder.buildAllUniquePayloads(withConstraints)
+    assert len(payloads) == constraints.payloadNum
+    assert all(sum(a != b for a, b in zip(p, q)) >= 3 for p, q in itertools.combinations(payloads, 2))
+
+@pytest.mark.asyncio
+async def test_unique_payloads_hold_no_key_or_joint():
+    constraints = get_constraints(payloadSize=8, payloadNum=20)
+    withConstraints = {'hom', 'motifGcContent', 'keyInPayload'}
+    weights = dict(get_weights(), keyInPayload=5)
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), weights, 12)
+    joints = {'ACGT', 'TGCA', 'AGTC'}
+    await motifBuilder.add_joints(joints)
+    payloads = await motifBuilder.buildAllUniquePayloads(withConstraints)
+    assert len(payloads) == constraints.payloadNum
+    # keys: ACGT, TGCA, GACT
+    assert not any(s in payload for payload in payloads for s in joints | {'GACT'})
+
+@pytest.mark.asyncio
+async def test_unique_payloads_share_no_junction():
+    constraints = get_constraints(payloadSize=8, payloadNum=6)
+    withConstraints = {'hom', 'motifGcContent', 'jointRepeat'}
+    weights = dict(get_weights(), jointRepeat=5)
+    motifBuilder = mb.MotifBuilder(constraints, get_hyperparameters(), weights, 13)
+    joints = {'ACGT', 'TGCA', 'AGTC'}
+    await motifBuilder.add_joints(joints)
+    payloads = await motifBuilder.buildAllUniquePayloads(withConstraints)
+    assert len(payloads) == constraints.payloadNum
+    validate = Validate(constraints)
+    # a key is the reverse complement of its joint and the other way round
+    await validate.add_keys_and_payloads(kmb.keys_to_joints(joints), payloads)
+    assert validate.get_joint_repeat_penalty() == 0
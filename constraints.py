@@ -1,5 +1,5 @@
 class Constraints:
-    def __init__(self, payloadSize=5, payloadNum=1, maxHom=2, maxHairpin=2, loopSize=-1, minGc=20, maxGc=60, keySize=1, keyNum=1, loopSizeMin=-1, loopSizeMax=-1):
+    def __init__(self, payloadSize=5, payloadNum=1, maxHom=2, maxHairpin=2, loopSize=-1, minGc=20, maxGc=60, keySize=1, keyNum=1, loopSizeMin=-1, loopSizeMax=-1, minKeyDistance=0, minPayloadDistance=0):
         # Payload information
         self.payloadSize = payloadSize
         self.payloadNum = payloadNum
@@ -20,6 +20,9 @@ class Constraints:
         self.loopSizeMax = loopSizeMax if loopSize == -1 else loopSize
         self.minGc = minGc
         self.maxGc = maxGc
+        # Fewest different nucleotides between two keys or two payloads, 0 for no limit
+        self.minKeyDistance = minKeyDistance
+        self.minPayloadDistance = minPayloadDistance
 
         # Assertions
         assert(maxHairpin <= self.motifSize)
@@ -34,6 +37,8 @@ class Constraints:
         assert(minGc <= maxGc)
         assert(minGc >= 0)
         assert(maxGc <= 100)
+        assert(0 <= minKeyDistance <= keySize)
+        assert(0 <= minPayloadDistance <= payloadSize)
         
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+from functools import lru_cache
+from language import nucleotides
+
+isGc = [n in ['G', 'C'] for n in nucleotides]
+
+
+@lru_cache(maxsize=32)
+def completion_counts(payloadSize, maxHom, minGcCount, maxGcCount, startExtra, endExtra):
+    """counts[i][(b, r, g)]: number of valid payloads completing a prefix of length i that ends
+    in a run of r nucleotides[b] and has g G/C; the prefix is a single run if r == i.
+    startExtra/endExtra[b]: homopolymer length a joint adds to a payload starting/ending with b."""
+    counts = [dict() for _ in range(payloadSize + 1)]
+    for i in range(payloadSize, 0, -1):
+        for b in range(len(nucleotides)):
+            for r in range(1, min(maxHom, i) + 1):
+                isStart = r == i
+                if isStart and r + startExtra[b] > maxHom:
+                    continue
+                for g in range(min(i, maxGcCount) + 1):
+                    if i == payloadSize:
+                        extra = endExtra[b] + (startExtra[b] if isStart else 0)
+                        count = int(r + extra <= maxHom and g >= minGcCount)
+                    else:
+                        count = 0
+                        for c in range(len(nucleotides)):
+                            count += counts[i + 1].get((c, r + 1 if c == b else 1, g + isGc[c]), 0)
+                    if count:
+                        counts[i][(b, r, g)] = count
+    return counts
+
+
+def num_valid_sequences(size, maxHom, minGcCount, maxGcCount, startExtra=(0, 0, 0, 0), endExtra=(0, 0, 0, 0)):
+    counts = completion_counts(size, maxHom, minGcCount, maxGcCount, startExtra, endExtra)
+    return sum(counts[1].get((b, 1, int(isGc[b])), 0) for b in range(len(nucleotides)))
+
+
+class ExactPayloadSampler:
+    """Samples payloads uniformly from the payloads whose homopolymers, including the ones
+    across the joints, are at most maxHom and whose motifs are all within the GC bounds.
+    Hairpins are not constrained. The completion counts are cached per constraint set."""
+
+    def __init__(self, penalties, rng):
+        self.penalties = penalties
+        self.rng = rng
+
+    def constraint_set(self):
+        p = self.penalties
+        startExtra, endExtra = p.joint_hom_extras()
+
+        if p.joints:
+            minJointsGcCount, maxJointsGcCount, motifSize = p.minJointsGcCount, p.maxJointsGcCount, p.motifSize
+        else:
+            minJointsGcCount, maxJointsGcCount, motifSize = 0, 0, p.payloadSize
+        # smallest and largest payload GC counts keeping every motif within [minGc, maxGc]
+        minGcCount = max(0, -(-p.minGc * motifSize // 100) - minJointsGcCount)
+        maxGcCount = p.maxGc * motifSize // 100 - maxJointsGcCount
+        return p.payloadSize, p.maxHom, minGcCount, maxGcCount, startExtra, endExtra
+
+    def num_valid(self):
+        return num_valid_sequences(*self.constraint_set())
+
+    def first_states(self):
+        return [(b, 1, int(isGc[b])) for b in range(len(nucleotides))]
+
+    def sample(self):
+        # None if no payload satisfies the constraints
+        counts = completion_counts(*self.constraint_set())
+        payloadSize = self.penalties.payloadSize
+        options = [(key, counts[1].get(key, 0)) for key in self.first_states()]
+        payload = ''
+        for i in range(1, payloadSize + 1):
+            total = sum(count for key, count in options)
+            if total == 0:
+                return None
+            x = self.random_below(total)
+            for key, count in options:
+                if x < count:
+                    break
+                x -= count
+            b, r, g = key
+            payload += nucleotides[b]
+            if i < payloadSize:
+                options = []
+                for c in range(len(nucleotides)):
+                    nextKey = (c, r + 1 if c == b else 1, g + isGc[c])
+                    options.append((nextKey, counts[i + 1].get(nextKey, 0)))
+        return payload
+
+    def random_below(self, total):
+        # uniform integer in [0, total), total can be larger than 64 bits
+        numBytes = (total.bit_length() + 64) // 8 + 1
+        return int.from_bytes(self.rng.bytes(numBytes), 'little') % total
@@ -0,0 +1,58 @@
+from exactSampler import num_valid_sequences
+
+
+class Feasibility:
+    """Number of distinct payloads and keys that can meet the constraints, known before any
+    generation. Homopolymer and GC limits are counted exactly by the exactSampler DP (for
+    payloads, over the GC range that some key could still bring within the motif bounds);
+    hairpins only lower an upper bound."""
+
+    def __init__(self, constraints, withConstraints):
+        self.constraints = constraints
+        self.withConstraints = withConstraints
+        # fewer valid elements than this many times the requested number: duplicates are likely
+        self.tightFactor = 10
+
+    ### Counts ###
+
+    def num_payloads(self):
+        c = self.constraints
+        maxHom = c.maxHom if 'hom' in self.withConstraints else c.payloadSize
+        minGcCount, maxGcCount = 0, c.payloadSize
+        if 'motifGcContent' in self.withConstraints:
+            # GC count of the whole motif, the key part brings 0 to keySize
+            minGcCount = max(minGcCount, -(-c.minGc * c.motifSize // 100) - c.keySize)
+            maxGcCount = min(maxGcCount, c.maxGc * c.motifSize // 100)
+        return min(num_valid_sequences(c.payloadSize, maxHom, minGcCount, maxGcCount), self.hairpin_bound(c.payloadSize))
+
+    def num_keys(self):
+        c = self.constraints
+        maxHom = c.maxHom if 'hom' in self.withConstraints else c.keySize
+        minGcCount, maxGcCount = 0, c.keySize
+        if 'keyGcContent' in self.withConstraints or 'motifGcContent' in self.withConstraints:
+            minGcCount = -(-c.minGc * c.keySize // 100)
+            maxGcCount = c.maxGc * c.keySize // 100
+        return min(num_valid_sequences(c.keySize, maxHom, minGcCount, maxGcCount), self.hairpin_bound(c.keySize))
+
+    def hairpin_bound(self, size):
+        # sequences none of whose disjoint windows of the shortest hairpin is a whole hairpin
+        c = self.constraints
+        if 'hairpin' not in self.withConstraints:
+            return 4**size
+        windowSize = 2 * c.maxHairpin + c.loopSizeMin
+        numWindows = size // windowSize
+        return (4**windowSize - 4**(windowSize - c.maxHairpin))**numWindows * 4**(size - numWindows * windowSize)
+
+    ### Check ###
+
+    def check(self):
+        # -> (errors: the request can't be met, warnings: it may not be met)
+        c = self.constraints
+        errors = []
+        warnings = []
+        for name, num, requested in [('payloads', self.num_payloads(), c.payloadNum), ('keys', self.num_keys(), c.keyNum)]:
+            if num < requested:
+                errors.append('At most %d distinct %s meet the constraints, %d requested.' % (num, name, requested))
+            elif num < self.tightFactor * requested:
+                warnings.append('Only %d distinct %s meet the constraints, %d requested: duplicates are likely.' % (num, name, requested))
+        return errors, warnings
@@ -0,0 +1,58 @@
+import itertools
+import pytest
+import constraints as c
+from feasibility import Feasibility
+from language import nucleotides
+
+
+def get_constraints(maxHairpin=2, payloadSize=6, keySize=4, payloadNum=5, keyNum=4, maxHom=2, minGc=25, maxGc=60, loopSizeMin=1, loopSizeMax=2):
+    return c.Constraints(payloadSize, payloadNum, maxHom, maxHairpin, -1, minGc, maxGc, keySize, keyNum, loopSizeMin, loopSizeMax)
+
+def max_hom(sequence):
+    maxHom = hom = 1
+    for i in range(1, len(sequence)):
+        hom = hom + 1 if sequence[i] == sequence[i - 1] else 1
+        maxHom = max(maxHom, hom)
+    return maxHom
+
+def all_sequences(size):
+    return [''.join(sequence) for sequence in itertools.product(nucleotides, repeat=size)]
+
+def test_keys_are_counted_exactly():
+    constraints = get_constraints()
+    feasibility = Feasibility(constraints, {'hom', 'keyGcContent'})
+    keys = [k for k in all_sequences(constraints.keySize) if max_hom(k) <= constraints.maxHom
+            and constraints.minGc <= 100 * sum(n in ['G', 'C'] for n in k) / constraints.keySize <= constraints.maxGc]
+    assert feasibility.num_keys() == len(keys)
+
+def test_payloads_are_counted_exactly_without_hairpins():
+    constraints = get_constraints()
+    feasibility = Feasibility(constraints, {'hom', 'motifGcContent'})
+    payloads = []
+    for payload in all_sequences(constraints.payloadSize):
+        gcCount = sum(n in ['G', 'C'] for n in payload)
+        # some key GC count in [0, keySize] brings the motif within the bounds
+        if max_hom(payload) <= constraints.maxHom and any(constraints.minGc <= 100 * (gcCount + keyGcCount) / constraints.motifSize <= constraints.maxGc for keyGcCount in range(constraints.keySize + 1)):
+            payloads.append(payload)
+    assert feasibility.num_payloads() == len(payloads)
+
+def test_hairpin_bound_is_an_upper_bound():
+    constraints = get_constraints(maxHairpin=2, payloadSize=7, loopSizeMin=1, loopSizeMax=1)
+    feasibility = Feasibility(constraints, {'hairpin'})
+    numWithoutHairpin = 0
+    for payload in all_sequences(constraints.payloadSize):
+        hasHairpin = False
+        for stem1Start in range(constraints.payloadSize - 4):
+            stem2 = payload[stem1Start + 3:stem1Start + 5]
+            if all({'A':'T', 'T':'A', 'C':'G', 'G':'C'}[payload[stem1Start + j]] == stem2[1 - j] for j in range(2)):
+                hasHairpin = True
+        numWithoutHairpin += 0 if hasHairpin else 1
+    assert numWithoutHairpin <= feasibility.num_payloads() < 4**constraints.payloadSize
+
+def test_check_rejects_impossible_and_warns_on_tight_requests():
+    constraints = get_constraints(payloadSize=3, payloadNum=100, keySize=2, keyNum=2, maxHom=1, minGc=20, maxGc=60)
+    errors, warnings = Feasibility(constraints, {'hom', 'motifGcContent', 'keyGcContent'}).check()
+    assert len(errors) == 1 and 'payloads' in errors[0]
+    assert len(warnings) == 1 and 'keys' in warnings[0]
+    errors, warnings = Feasibility(get_constraints(payloadSize=20, keySize=8), {'hom', 'motifGcContent', 'keyGcContent', 'hairpin'}).check()
+    assert errors == [] and warnings == []
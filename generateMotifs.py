@@ -1,9 +1,13 @@
 import keyMotifBuilder
 import asyncio
 
-async def generateMotifs(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax):
+async def generateMotifs(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed=None, numAttempts=1, maxSeconds=-1, repairSeconds=0):
     
-    blob = await asyncio.gather(keyMotifBuilder.buildAnswer(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax))
+    if numAttempts > 1:
+        # independent attempts on several cores, the first valid one wins
+        blob = await asyncio.gather(keyMotifBuilder.buildAnswerParallel(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed, numAttempts, maxSeconds, repairSeconds))
+    else:
+        blob = await asyncio.gather(keyMotifBuilder.buildAnswer(constraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed, repairSeconds))
     stringBlob = str(blob)
     if stringBlob[len(stringBlob)-4] == 's':
         setThing = stringBlob[2:len(stringBlob)-9]
@@ -0,0 +1,152 @@
+import itertools
+from language import converse
+
+
+class HairpinIndex:
+    """Payloads and joints by their k-mers at every offset, that lists the hairpins an elem takes part in
+    without walking the library. The hairpins are the ones Validate counts: stem1 starts in a payload or
+    joint, the elems its stems cross after it are any payloads and joints (the start elem is a choice once
+    more for the ones of its type), and a hairpin is one such choice whose stems pair."""
+
+    def __init__(self, penalties, payloads=(), joints=()):
+        self.maxHairpin = penalties.maxHairpin
+        # isJoint -> size, elems
+        self.sizes = {False: penalties.payloadSize, True: penalties.keySize}
+        self.elems = {False: set(), True: set()}
+        # (isJoint, offset, k-mer) -> elems having the k-mer (k <= maxHairpin) at offset
+        self.kmers = {}
+
+        # isJoint -> (groups, partners) of the windows crossing an elem of that type, and of the ones starting in it
+        self.layouts = {False: [], True: []}
+        self.startLayouts = {False: [], True: []}
+        for startIsJoint in [False, True]:
+            for stem1Start in range(self.sizes[startIsJoint]):
+                for loopSize in range(penalties.loopSizeMin, penalties.loopSizeMax + 1):
+                    self.add_layouts(startIsJoint, stem1Start, loopSize)
+
+        for payload in payloads:
+            self.add(payload, False)
+        for joint in joints:
+            self.add(joint, True)
+
+    ### Index ###
+
+    def add(self, elem, isJoint):
+        assert(len(elem) == self.sizes[isJoint])
+        if elem in self.elems[isJoint]:
+            return
+        self.elems[isJoint].add(elem)
+        for kmer in self.kmer_keys(elem, isJoint):
+            self.kmers.setdefault(kmer, set()).add(elem)
+
+    def remove(self, elem, isJoint):
+        if elem not in self.elems[isJoint]:
+            return
+        self.elems[isJoint].discard(elem)
+        for kmer in self.kmer_keys(elem, isJoint):
+            elems = self.kmers[kmer]
+            elems.discard(elem)
+            if not elems:
+                del self.kmers[kmer]
+
+    def kmer_keys(self, elem, isJoint):
+        return [(isJoint, offset, elem[offset:end]) for offset in range(len(elem)) for end in range(offset + 1, min(offset + self.maxHairpin, len(elem)) + 1)]
+
+    ### Windows ###
+
+    def add_layouts(self, startIsJoint, stem1Start, loopSize):
+        # slot k of the window is the kth elem from its start elem: (isJoint, stem position -> offset in the elem)
+        maxHairpin = self.maxHairpin
+        stem2Start = stem1Start + maxHairpin + loopSize
+        slots = {}
+        slotIsJoint, slotStart, k = startIsJoint, 0, 0
+        for pos in list(range(stem1Start, stem1Start + maxHairpin)) + list(range(stem2Start, stem2Start + maxHairpin)):
+            while pos >= slotStart + self.sizes[slotIsJoint]:
+                slotStart += self.sizes[slotIsJoint]
+                slotIsJoint = not slotIsJoint
+                k += 1
+            slots.setdefault(k, (slotIsJoint, {}))[1][pos] = pos - slotStart
+        partners = {}
+        for j in range(maxHairpin):
+            partners[stem1Start + j] = stem2Start + maxHairpin - 1 - j
+            partners[stem2Start + maxHairpin - 1 - j] = stem1Start + j
+
+        for k, (isJoint, _) in slots.items():
+            # the slots after the start one that can be the start elem again
+            tieable = [j for j, (slotIsJoint, _) in slots.items() if j > 0 and j != k and slotIsJoint == startIsJoint]
+            for ties in itertools.product([False, True], repeat=len(tieable)):
+                tied = {j for j, isTied in zip(tieable, ties) if isTied}
+                groups = self.groups(slots, partners, tied, k, isJoint)
+                self.layouts[isJoint].append((groups, partners))
+                if k == 0:
+                    self.startLayouts[isJoint].append((groups, partners))
+
+    def groups(self, slots, partners, tied, k, isJoint):
+        # (isJoint, stem position -> offset, role) of the elems to choose, the one of slot k first and then the ones with
+        # the most bases paired to the chosen ones; the elem of slot k is 'pinned', the slots before it are 'other' than it
+        # so that a hairpin is listed once, at its first slot of the elem
+        startIsJoint, startOffsets = slots[0]
+        startOffsets = dict(startOffsets)
+        for j in tied:
+            startOffsets.update(slots[j][1])
+        left = [(startIsJoint, startOffsets, 'pinned' if k == 0 else 'other' if startIsJoint == isJoint else 'any')]
+        for j, (slotIsJoint, offsets) in slots.items():
+            if j > 0 and j not in tied:
+                left.append((slotIsJoint, offsets, 'pinned' if j == k else 'other' if j < k and slotIsJoint == isJoint else 'any'))
+
+        groups = [group for group in left if group[2] == 'pinned']
+        left = [group for group in left if group[2] != 'pinned']
+        chosen = set(groups[0][1])
+        while left:
+            group = max(left, key=lambda group: sum(partners[pos] in chosen for pos in group[1]))
+            left.remove(group)
+            groups.append(group)
+            chosen.update(group[1])
+        return groups
+
+    ### Hairpins ###
+
+    def all_hairpins(self):
+        # every hairpin of the library, once
+        hairpins = []
+        for isJoint, elems in self.elems.items():
+            for elem in elems:
+                hairpins += self.hairpins(elem, isJoint, startsOnly=True)
+        return hairpins
+
+    def hairpins(self, elem, isJoint, startsOnly=False):
+        # hairpins elem takes part in, or only the ones starting in it, as the set of (isJoint, elem) each one crosses
+        hairpins = []
+        for groups, partners in (self.startLayouts if startsOnly else self.layouts)[isJoint]:
+            self.choose(elem, groups, partners, {}, [], hairpins)
+        return hairpins
+
+    def choose(self, elem, groups, partners, bases, chosen, hairpins):
+        # chooses the elems of the groups left, bases: stem position -> base of the chosen ones
+        if len(chosen) == len(groups):
+            hairpins.append(frozenset(chosen))
+            return
+        groupIsJoint, offsets, role = groups[len(chosen)]
+        fixed = {offset: converse[bases[partners[pos]]] for pos, offset in offsets.items() if partners[pos] in bases}
+        inner = [(offsets[pos], offsets[partners[pos]]) for pos in offsets if partners[pos] in offsets]
+        for candidate in ([elem] if role == 'pinned' else self.candidates(groupIsJoint, fixed)):
+            if role == 'other' and candidate == elem:
+                continue
+            if all(candidate[offset] == base for offset, base in fixed.items()) and all(candidate[o1] == converse[candidate[o2]] for o1, o2 in inner):
+                nextBases = dict(bases)
+                nextBases.update((pos, candidate[offset]) for pos, offset in offsets.items())
+                self.choose(elem, groups, partners, nextBases, chosen + [(groupIsJoint, candidate)], hairpins)
+
+    def candidates(self, isJoint, fixed):
+        # elems having the longest run of fixed bases (maxHairpin at most), every elem if none is fixed
+        if not fixed:
+            return self.elems[isJoint]
+        runStart, runEnd = 0, 0
+        for offset in fixed:
+            if offset - 1 not in fixed:
+                end = offset
+                while end in fixed and end - offset < self.maxHairpin:
+                    end += 1
+                if end - offset > runEnd - runStart:
+                    runStart, runEnd = offset, end
+        return self.kmers.get((isJoint, runStart, ''.join(fixed[o] for o in range(runStart, runEnd))), ())
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+
+class HairpinMemo:
+    # LRU cache of the hairpin walk: stem lengths matched by a pair of elems in a hairpin_count_*,
+    # and hairpins found by the send_to_* it makes with the elem it passes on
+    def __init__(self, maxSize):
+        assert(maxSize > 0)
+        self.maxSize = maxSize
+        self.cache = OrderedDict()
+        # (curElem, isKey, hairpinCount, elem sets) of a counter call -> small int used in the keys
+        self.contexts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def context(self, context):
+        return self.contexts.setdefault(context, len(self.contexts))
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.cache[key] = value
+        if len(self.cache) > self.maxSize:
+            self.cache.popitem(last=False)
+
+    def clear(self):
+        self.cache.clear()
+        self.contexts.clear()
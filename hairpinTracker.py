@@ -0,0 +1,179 @@
+import numpy as np
+from language import converse
+from stemIndex import StemIndex
+from stemIndex import cur_option
+from stemIndex import combine_options
+
+
+class HairpinTracker:
+    """Hairpin penalty of a payload built one nucleotide at a time.
+    For every window whose stem1 holds the last bases of the payload, the stem2
+    k-mers asked for by the known part of stem1 are kept per crossed payload/joint
+    together with their number of matches, so a new nucleotide only extends one
+    k-mer per window. Windows that the stem index can't count use the penalties'
+    own hairpin counter."""
+
+    def __init__(self, penalties):
+        self.penalties = penalties
+        self.geometries = {}
+        self.payloadIndex = StemIndex(penalties.payloads, penalties.maxHairpin)
+        self.jointIndex = StemIndex(penalties.joints, penalties.maxHairpin)
+        self.start()
+
+    ### State ###
+
+    def start(self):
+        self.prefix = ''
+        self.windows = {}
+        self.pending = {}
+
+    def sync(self, payload):
+        p = self.penalties
+        if not self.payloadIndex.is_index_of(p.payloads) or not self.jointIndex.is_index_of(p.joints):
+            self.payloadIndex = self.refresh(self.payloadIndex, p.payloads)
+            self.jointIndex = self.refresh(self.jointIndex, p.joints)
+            self.start()
+
+        if payload == self.prefix:
+            return
+        if payload[:-1] == self.prefix and payload[-1:] in self.pending:
+            self.windows = self.pending[payload[-1]]
+        else:
+            self.start()
+            for i in range(len(payload)):
+                self.windows = self.extend(self.windows, payload[:i + 1])
+        self.prefix = payload
+        self.pending = {}
+
+    def extension_state(self, payload, nucleotide):
+        # windows of payload + nucleotide, None if that extension wasn't scored last
+        return self.pending.get(nucleotide) if payload == self.prefix else None
+
+    def restore(self, payload, windows):
+        # continues from windows returned by extension_state for payload
+        if windows is None:
+            return
+        self.prefix = payload
+        self.windows = windows
+        self.pending = {}
+
+    def refresh(self, stemIndex, elems):
+        if stemIndex.elems is not elems:
+            return StemIndex(elems, self.penalties.maxHairpin)
+        for elem in elems:
+            stemIndex.add(elem)
+        return stemIndex
+
+    ### Penalty ###
+
+    def get_hairpin_penalty(self, payload, nucleotide):
+        self.sync(payload)
+        curPayload = payload + nucleotide
+        windows = self.extend(self.windows, curPayload)
+        self.pending[nucleotide] = windows
+        return self.hairpin_penalty(windows, curPayload)
+
+    def hairpin_penalty(self, windows, curPayload):
+        p = self.penalties
+        hairpins = []
+        hairpinScore = 0
+        for key, window in windows.items():
+            direction, stem1Start, loopSize = key
+            if window is None or len(curPayload) > p.payloadSize:
+                counter = p.forward_hairpin_counter_at_startPos if direction == 1 else p.backward_hairpin_counter_at_startPos
+                counter(curPayload, p.payloads, p.joints, stem1Start, hairpins, hairpinCount=False, loopSizeMin=loopSize, loopSizeMax=loopSize)
+            else:
+                hairpinScore += self.window_score(key, window, curPayload)
+
+        return hairpinScore + np.sum(np.array(hairpins))
+
+    def window_score(self, key, window, curPayload):
+        p = self.penalties
+        stem2End, instances = self.geometry(key)
+        stems, counts = window
+
+        # (number of pairs skipped because curPayload is too short) -> number of hairpins
+        skipped = {0: 1}
+        for (isElem2, elemStart, end), stem, count in zip(instances, stems, counts):
+            options = [] if count is None else [(count, 0)]
+            if not isElem2:
+                options.append(cur_option(curPayload, stem, end - len(stem) - elemStart, end == stem2End))
+            skipped = combine_options(skipped, options)
+            if not skipped:
+                return 0
+
+        numKnown = min(p.maxHairpin, len(curPayload) - key[1])
+        return sum(count * p.hairpinPowers.power(numKnown - s) for s, count in skipped.items())
+
+    ### Windows ###
+
+    def geometry(self, key):
+        # payloads/joints crossed by stem2 as (isElem2, elemStart, end)
+        if key not in self.geometries:
+            p = self.penalties
+            direction, stem1Start, loopSize = key
+            stem2Start = stem1Start + direction * (loopSize + p.maxHairpin)
+            stem2End = stem2Start + p.maxHairpin
+            instances = []
+            pos = stem2Start
+            while pos < stem2End:
+                elemStart = pos - pos % p.motifSize
+                isElem2 = pos % p.motifSize >= p.payloadSize
+                end = min(stem2End, elemStart + (p.motifSize if isElem2 else p.payloadSize))
+                instances.append((isElem2, elemStart, end))
+                pos = end
+            self.geometries[key] = (stem2End, instances)
+        return self.geometries[key]
+
+    def extend(self, windows, curPayload):
+        # windows of curPayload[:-1] -> windows of curPayload
+        p = self.penalties
+        payloadLength = len(curPayload)
+        stemBase = converse[curPayload[-1]]
+        nextWindows = {}
+        for direction in (1, -1):
+            for loopSize in range(p.loopSizeMin, p.loopSizeMax + 1):
+                for stem1Start in range(payloadLength - p.maxHairpin, payloadLength):
+                    key = (direction, stem1Start, loopSize)
+                    window = self.new_window(key) if stem1Start == payloadLength - 1 else windows.get(key)
+                    if window is not None:
+                        window = self.extend_window(key, window, payloadLength - stem1Start, stemBase)
+                    nextWindows[key] = window
+        return nextWindows
+
+    def new_window(self, key):
+        p = self.penalties
+        stem1Start = key[1]
+        if stem1Start + p.maxHairpin > p.payloadSize or not self.payloadIndex.has_only_size(p.payloadSize) \
+            or not self.jointIndex.has_only_size(p.keySize):
+            return None
+
+        counts = []
+        for isElem2, elemStart, end in self.geometry(key)[1]:
+            if isElem2:
+                if not self.jointIndex.members:
+                    return None
+                counts.append(len(self.jointIndex.members))
+            elif elemStart != 0:
+                counts.append(len(self.payloadIndex.members))
+            else:
+                counts.append(None)
+        return ([''] * len(counts), counts)
+
+    def extend_window(self, key, window, numKnown, stemBase):
+        # the new nucleotide pairs with the first known position of stem2
+        p = self.penalties
+        stem2End, instances = self.geometry(key)
+        q = stem2End - numKnown
+        stems, counts = list(window[0]), list(window[1])
+        for i, (isElem2, elemStart, end) in enumerate(instances):
+            if q < end:
+                break
+
+        stems[i] = stemBase + stems[i]
+        if counts[i]:
+            if isElem2:
+                counts[i] = self.jointIndex.count(q - elemStart - p.payloadSize, stems[i])
+            else:
+                counts[i] = self.payloadIndex.count(q - elemStart, stems[i])
+        return (stems, counts)
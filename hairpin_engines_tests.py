@@ -0,0 +1,360 @@
+import random
+import pytest
+import basePayloadPenalties as bpp
+import baseKeyPenalties as bkp
+import validation as v
+import constraints as c
+import hyperparameters as h
+from hairpinTracker import HairpinTracker
+from hairpinMemo import HairpinMemo
+from hairpinIndex import HairpinIndex
+from keyAutomaton import reverse_complement
+
+
+def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=2, payloadNum=5, maxHom=1, minGc=25, maxGc=60, loopSizeMin=-1, loopSizeMax=-1):
+    return c.Constraints(payloadSize, payloadNum, maxHom, maxHairpin, loopSize, minGc, maxGc, keySize, 1, loopSizeMin, loopSizeMax)
+
+def get_hyperparameters(hairpinHyperparam=5):
+    hyperparams = {'hom': 5, 'motifGcContent': 5, 'keyGcContent': 5, 'hairpin': hairpinHyperparam}
+    return h.Hyperparameters(hyperparams)
+
+def get_score(elemLength, elemHyperparam, maxElem):
+    if elemLength == 0:
+        return 0
+    return elemHyperparam**(elemLength/maxElem)
+
+def random_elems(rng, num, size):
+    return {''.join(rng.choice('ATCG') for _ in range(size)) for _ in range(num)}
+
+async def get_payload_penalties(constraints, hyperparams, joints, payloads, hairpinEngine):
+    basePayloadPenalties = bpp.BasePayloadPenalties(constraints, hyperparams, hairpinEngine=hairpinEngine)
+    await basePayloadPenalties.add_joints(joints)
+    await basePayloadPenalties.add_payloads(payloads)
+    return basePayloadPenalties
+
+###### Vectorized engine ######
+
+@pytest.mark.asyncio
+async def test_vectorized_stem1_in_payload1_and_key_stem2_in_payload2():
+    maxHairpin = 3
+    loopSize = 2
+    payloadSize = 8
+    hairpinHyperparam = 5
+    constraints = get_constraints(maxHairpin, loopSize, payloadSize)
+    hyperparams = get_hyperparameters(hairpinHyperparam)
+    joints = {'AT', 'GC'}
+    payloads = {'TATAAGGA'}
+    basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'vectorized')
+    curPayload = 'CT'
+    hairpinScore = basePayloadPenalties.backward_hairpin_counter(curPayload, payloads, joints)
+    result = get_score(3, hairpinHyperparam, maxHairpin) + get_score(1, hairpinHyperparam, maxHairpin) * len(joints)
+    assert result == pytest.approx(hairpinScore)
+
+@pytest.mark.asyncio
+async def test_vectorized_forward_stem1_in_payload1_stem2_in_payload12_and_payload2():
+    maxHairpin = 4
+    loopSize = 8
+    payloadSize = 7
+    hairpinHyperparam = 5
+    constraints = get_constraints(maxHairpin, loopSize, payloadSize)
+    hyperparams = get_hyperparameters(hairpinHyperparam)
+    joints = {'AT', 'CC'}
+    payloads = {'CCATCGG'}
+    basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'vectorized')
+    curPayload = 'CTAGATC'
+    hairpinScore = basePayloadPenalties.forward_hairpin_counter(curPayload, payloads, joints)
+    result = get_score(4, hairpinHyperparam, maxHairpin) * 2
+    assert result == pytest.approx(hairpinScore)
+
+@pytest.mark.asyncio
+async def test_vectorized_validation_stem1_in_key_stem2_in_key_edge():
+    maxHairpin = 2
+    loopSize = 10
+    keySize = 4
+    payloadSize = 9
+    constraints = get_constraints(maxHairpin, loopSize, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'ATAATAAAA', 'AAAAAAATA'}
+    keys = {'ATTT', 'TATT', 'TTTT'}
+    validate = v.Validate(constraints, hairpinEngine='vectorized')
+    await validate.add_keys_and_payloads(keys, payloads)
+    hairpinCount = validate.get_motifs_and_keys_hairpin_score()
+    result = -3
+    assert result == hairpinCount
+
+@pytest.mark.asyncio
+async def test_vectorized_matches_recursive_payload_penalties():
+    rng = random.Random(6)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        payloadSize = rng.randint(3, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, rng.choice([2, 4]), loopSizeMin=rng.randint(0, 3), loopSizeMax=rng.randint(3, 6))
+        joints = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(0, 4), payloadSize)
+        recursive = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'recursive')
+        vectorized = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'vectorized')
+        for curPayload in [''] + [''.join(rng.choice('ATCG') for _ in range(n)) for n in range(1, payloadSize + 1)]:
+            assert recursive.hairpin_penalty(curPayload) == pytest.approx(vectorized.hairpin_penalty(curPayload))
+
+@pytest.mark.asyncio
+async def test_vectorized_matches_recursive_key_penalties():
+    rng = random.Random(5)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        keySize = rng.choice([2, 4, 6])
+        constraints = get_constraints(rng.randint(1, 3), -1, rng.randint(2, 6), keySize, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 5))
+        keys = random_elems(rng, rng.randint(0, 4), keySize)
+        recursive = bkp.BaseKeyPenalties(constraints, hyperparams)
+        vectorized = bkp.BaseKeyPenalties(constraints, hyperparams, hairpinEngine='vectorized')
+        await recursive.add_keys(keys)
+        await vectorized.add_keys(keys)
+        for n in range(keySize + 1):
+            curKey = ''.join(rng.choice('ATCG') for _ in range(n))
+            assert recursive.hairpin_penalty(curKey) == pytest.approx(vectorized.hairpin_penalty(curKey))
+
+@pytest.mark.asyncio
+async def test_vectorized_matches_recursive_validation():
+    rng = random.Random(7)
+    for _ in range(20):
+        payloadSize = rng.randint(4, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, 2, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 4))
+        keys = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(1, 4), payloadSize)
+        recursive = v.Validate(constraints)
+        vectorized = v.Validate(constraints, hairpinEngine='vectorized')
+        await recursive.add_keys_and_payloads(keys, payloads)
+        await vectorized.add_keys_and_payloads(keys, payloads)
+        assert recursive.get_motifs_and_keys_hairpin_score() == vectorized.get_motifs_and_keys_hairpin_score()
+        assert recursive.get_keys_hairpin_score() == vectorized.get_keys_hairpin_score()
+
+###### Indexed engine ######
+
+@pytest.mark.asyncio
+async def test_indexed_stem1_in_payload1_and_key_stem2_in_payload2():
+    maxHairpin = 3
+    loopSize = 2
+    payloadSize = 8
+    hairpinHyperparam = 5
+    constraints = get_constraints(maxHairpin, loopSize, payloadSize)
+    hyperparams = get_hyperparameters(hairpinHyperparam)
+    joints = {'AT', 'GC'}
+    payloads = {'TATAAGGA'}
+    basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'indexed')
+    curPayload = 'CT'
+    hairpinScore = basePayloadPenalties.backward_hairpin_counter(curPayload, payloads, joints)
+    result = get_score(3, hairpinHyperparam, maxHairpin) + get_score(1, hairpinHyperparam, maxHairpin) * len(joints)
+    assert result == pytest.approx(hairpinScore)
+
+@pytest.mark.asyncio
+async def test_indexed_follows_added_payloads():
+    rng = random.Random(11)
+    hyperparams = get_hyperparameters()
+    constraints = get_constraints(3, -1, 8, 2, loopSizeMin=1, loopSizeMax=4)
+    joints = random_elems(rng, 3, constraints.keySize)
+    recursive = await get_payload_penalties(constraints, hyperparams, joints, set(), 'recursive')
+    indexed = await get_payload_penalties(constraints, hyperparams, joints, set(), 'indexed')
+    for payload in random_elems(rng, 6, constraints.payloadSize):
+        curPayload = ''.join(rng.choice('ATCG') for _ in range(rng.randint(1, constraints.payloadSize)))
+        assert recursive.hairpin_penalty(curPayload) == pytest.approx(indexed.hairpin_penalty(curPayload))
+        await recursive.add_payload(payload)
+        await indexed.add_payload(payload)
+
+@pytest.mark.asyncio
+async def test_indexed_matches_recursive_payload_penalties():
+    rng = random.Random(6)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        payloadSize = rng.randint(3, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, rng.choice([2, 4]), loopSizeMin=rng.randint(0, 3), loopSizeMax=rng.randint(3, 6))
+        joints = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(0, 4), payloadSize)
+        recursive = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'recursive')
+        indexed = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'indexed')
+        for curPayload in [''] + [''.join(rng.choice('ATCG') for _ in range(n)) for n in range(1, payloadSize + 1)]:
+            assert recursive.hairpin_penalty(curPayload) == pytest.approx(indexed.hairpin_penalty(curPayload))
+
+@pytest.mark.asyncio
+async def test_indexed_matches_recursive_key_penalties():
+    rng = random.Random(5)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        keySize = rng.choice([2, 4, 6])
+        constraints = get_constraints(rng.randint(1, 3), -1, rng.randint(2, 6), keySize, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 5))
+        keys = random_elems(rng, rng.randint(0, 4), keySize)
+        recursive = bkp.BaseKeyPenalties(constraints, hyperparams)
+        indexed = bkp.BaseKeyPenalties(constraints, hyperparams, hairpinEngine='indexed')
+        await recursive.add_keys(keys)
+        await indexed.add_keys(keys)
+        for n in range(keySize + 1):
+            curKey = ''.join(rng.choice('ATCG') for _ in range(n))
+            assert recursive.hairpin_penalty(curKey) == pytest.approx(indexed.hairpin_penalty(curKey))
+
+###### Hairpin tracker ######
+
+@pytest.mark.asyncio
+async def test_tracker_matches_payload_penalties():
+    rng = random.Random(5)
+    hyperparams = get_hyperparameters()
+    for _ in range(10):
+        payloadSize = rng.randint(3, 9)
+        constraints = get_constraints(rng.randint(1, 4), -1, payloadSize, rng.choice([2, 4]), loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 5))
+        joints = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, joints, set(), 'vectorized')
+        hairpinTracker = HairpinTracker(basePayloadPenalties)
+        for _ in range(3):
+            payload = ''
+            for _ in range(payloadSize):
+                for n in 'ATCG':
+                    assert basePayloadPenalties.get_hairpin_penalty(payload, n) == pytest.approx(hairpinTracker.get_hairpin_penalty(payload, n))
+                payload += rng.choice('ATCG')
+            await basePayloadPenalties.add_payload(payload)
+
+@pytest.mark.asyncio
+async def test_tracker_restarts_on_unrelated_prefix():
+    constraints = get_constraints(3, 2, 8)
+    hyperparams = get_hyperparameters()
+    basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, {'AT', 'GC'}, {'TATAAGGA'}, 'vectorized')
+    hairpinTracker = HairpinTracker(basePayloadPenalties)
+    for payload in ['CTA', 'CTAG', 'GG', 'CTAGGA']:
+        assert basePayloadPenalties.get_hairpin_penalty(payload, 'T') == pytest.approx(hairpinTracker.get_hairpin_penalty(payload, 'T'))
+
+@pytest.mark.asyncio
+async def test_tracker_continues_from_restored_windows():
+    constraints = get_constraints(3, 2, 8)
+    hyperparams = get_hyperparameters()
+    basePayloadPenalties = await get_payload_penalties(constraints, hyperparams, {'AT', 'GC'}, {'TATAAGGA'}, 'vectorized')
+    hairpinTracker = HairpinTracker(basePayloadPenalties)
+    hairpinTracker.get_hairpin_penalty('CTA', 'G')
+    windows = hairpinTracker.extension_state('CTA', 'G')
+    assert hairpinTracker.extension_state('CT', 'G') is None
+    hairpinTracker.get_hairpin_penalty('GGTT', 'A')
+    hairpinTracker.restore('CTAG', windows)
+    assert basePayloadPenalties.get_hairpin_penalty('CTAG', 'T') == pytest.approx(hairpinTracker.get_hairpin_penalty('CTAG', 'T'))
+
+###### Iterative engine ######
+
+@pytest.mark.asyncio
+async def test_iterative_validation_stem1_in_key_stem2_in_key_edge():
+    maxHairpin = 2
+    loopSize = 10
+    keySize = 4
+    payloadSize = 9
+    constraints = get_constraints(maxHairpin, loopSize, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'ATAATAAAA', 'AAAAAAATA'}
+    keys = {'ATTT', 'TATT', 'TTTT'}
+    validate = v.Validate(constraints, hairpinEngine='iterative')
+    await validate.add_keys_and_payloads(keys, payloads)
+    hairpinCount = validate.get_motifs_and_keys_hairpin_score()
+    result = -3
+    assert result == hairpinCount
+
+@pytest.mark.asyncio
+async def test_iterative_matches_recursive_payload_penalties():
+    rng = random.Random(6)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        payloadSize = rng.randint(3, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, rng.choice([2, 4]), loopSizeMin=rng.randint(0, 3), loopSizeMax=rng.randint(3, 6))
+        joints = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(0, 4), payloadSize)
+        recursive = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'recursive')
+        iterative = await get_payload_penalties(constraints, hyperparams, joints, payloads, 'iterative')
+        for curPayload in [''] + [''.join(rng.choice('ATCG') for _ in range(n)) for n in range(1, payloadSize + 1)]:
+            assert recursive.hairpin_penalty(curPayload) == pytest.approx(iterative.hairpin_penalty(curPayload))
+
+@pytest.mark.asyncio
+async def test_iterative_matches_recursive_key_penalties():
+    rng = random.Random(5)
+    hyperparams = get_hyperparameters()
+    for _ in range(20):
+        keySize = rng.choice([2, 4, 6])
+        constraints = get_constraints(rng.randint(1, 3), -1, rng.randint(2, 6), keySize, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 5))
+        keys = random_elems(rng, rng.randint(0, 4), keySize)
+        recursive = bkp.BaseKeyPenalties(constraints, hyperparams)
+        iterative = bkp.BaseKeyPenalties(constraints, hyperparams, hairpinEngine='iterative')
+        await recursive.add_keys(keys)
+        await iterative.add_keys(keys)
+        for n in range(keySize + 1):
+            curKey = ''.join(rng.choice('ATCG') for _ in range(n))
+            assert recursive.hairpin_penalty(curKey) == pytest.approx(iterative.hairpin_penalty(curKey))
+
+@pytest.mark.asyncio
+async def test_iterative_matches_recursive_validation():
+    rng = random.Random(7)
+    for _ in range(20):
+        payloadSize = rng.randint(4, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, 2, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 4))
+        keys = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(1, 4), payloadSize)
+        recursive = v.Validate(constraints)
+        iterative = v.Validate(constraints, hairpinEngine='iterative')
+        await recursive.add_keys_and_payloads(keys, payloads)
+        await iterative.add_keys_and_payloads(keys, payloads)
+        assert recursive.get_motifs_and_keys_hairpin_score() == iterative.get_motifs_and_keys_hairpin_score()
+        assert recursive.get_keys_hairpin_score() == iterative.get_keys_hairpin_score()
+
+###### Hairpin memo ######
+
+def test_memo_evicts_least_recently_used():
+    hairpinMemo = HairpinMemo(2)
+    hairpinMemo.put('a', 1)
+    hairpinMemo.put('b', 2)
+    assert hairpinMemo.get('a') == 1
+    hairpinMemo.put('c', 3)
+    assert hairpinMemo.get('b') is None
+    assert hairpinMemo.get('c') == 3
+    assert (hairpinMemo.hits, hairpinMemo.misses, len(hairpinMemo)) == (2, 1, 2)
+
+@pytest.mark.asyncio
+async def test_memo_matches_recursive_validation():
+    rng = random.Random(7)
+    for _ in range(20):
+        payloadSize = rng.randint(4, 8)
+        constraints = get_constraints(rng.randint(1, 4), -1, payloadSize, 2, loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 4))
+        keys = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(1, 4), payloadSize)
+        recursive = v.Validate(constraints, hairpinMemoSize=0)
+        memoized = v.Validate(constraints, hairpinMemoSize=20)
+        await recursive.add_keys_and_payloads(keys, payloads)
+        await memoized.add_keys_and_payloads(keys, payloads)
+        for _ in range(2):
+            assert recursive.get_motifs_and_keys_hairpin_score() == memoized.get_motifs_and_keys_hairpin_score()
+            assert recursive.get_keys_hairpin_score() == memoized.get_keys_hairpin_score()
+
+@pytest.mark.asyncio
+async def test_memo_is_reused_and_cleared_on_new_elems():
+    constraints = get_constraints(3, -1, 8, 4, loopSizeMin=1, loopSizeMax=3)
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads({'ATTT', 'TATT', 'GCAT'}, {'ATATAGAA', 'AAAAAATA', 'CCGATTGA'})
+    hairpinCount = validate.get_motifs_and_keys_hairpin_score()
+    misses = validate.hairpinMemo.misses
+    assert misses > 0
+    assert hairpinCount == validate.get_motifs_and_keys_hairpin_score()
+    assert validate.hairpinMemo.misses == misses
+    assert validate.hairpinMemo.hits > 0
+    validate.add_keys({'ATTT'})
+    assert len(validate.hairpinMemo) == 0
+
+###### Hairpin index ######
+
+@pytest.mark.asyncio
+async def test_hairpin_index_matches_validation():
+    rng = random.Random(8)
+    for _ in range(20):
+        payloadSize = rng.randint(3, 8)
+        constraints = get_constraints(rng.randint(1, 3), -1, payloadSize, rng.choice([2, 4]), loopSizeMin=rng.randint(0, 2), loopSizeMax=rng.randint(2, 4))
+        keys = random_elems(rng, rng.randint(1, 3), constraints.keySize)
+        payloads = random_elems(rng, rng.randint(1, 4), payloadSize)
+        validate = v.Validate(constraints)
+        await validate.add_keys_and_payloads(set(keys), set(payloads))
+        hairpinIndex = HairpinIndex(validate, validate.payloads, validate.joints)
+        hairpinCount = validate.get_motif_and_key_hairpin_penalty()
+        assert len(hairpinIndex.all_hairpins()) == hairpinCount
+        # the hairpins of an elem are the ones that go away with it, Validate without joints counts them as any elem
+        for key in (keys if len(keys) > 1 else set()):
+            validate = v.Validate(constraints)
+            await validate.add_keys_and_payloads(keys - {key}, set(payloads))
+            assert len(hairpinIndex.hairpins(reverse_complement(key), True)) == hairpinCount - validate.get_motif_and_key_hairpin_penalty()
+        for payload in payloads:
+            validate = v.Validate(constraints)
+            await validate.add_keys_and_payloads(set(keys), payloads - {payload})
+            assert len(hairpinIndex.hairpins(payload, False)) == hairpinCount - validate.get_motif_and_key_hairpin_penalty()
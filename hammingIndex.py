@@ -0,0 +1,144 @@
+import numpy as np
+from language import nucleotides
+from packedSequences import nucleotideCodes
+
+# 2 bits per nucleotide (index in language.nucleotides), 32 nucleotides per uint64 word,
+# first nucleotide in the highest bits of the first word
+basesPerWord = 32
+lowBits = np.uint64(0x5555555555555555)
+
+
+def pack_words(sequence, numWords):
+    words = np.zeros(numWords, dtype=np.uint64)
+    for w in range(numWords):
+        code = 0
+        for n in sequence[w * basesPerWord:(w + 1) * basesPerWord]:
+            code = (code << 2) | nucleotideCodes[n]
+        words[w] = code
+    return words
+
+def popcount(x):
+    # bits set in every uint64 of x
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    x = x - ((x >> np.uint64(1)) & lowBits)
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+def hamming_distances(codes, words):
+    # number of different nucleotides between words and every row of codes
+    x = codes ^ words
+    x = (x | (x >> np.uint64(1))) & lowBits
+    return popcount(x).sum(axis=1, dtype=np.int64)
+
+
+class HammingIndex:
+    """Sequences of one size, packed in uint64 words, that tells which of them are fewer than
+    minDistance nucleotides away from a sequence. Two sequences within minDistance - 1 mismatches
+    are equal on at least one of minDistance blocks (pigeonhole principle), so only the sequences
+    sharing a block with it are compared."""
+
+    def __init__(self, size, minDistance, sequences=()):
+        assert(0 <= minDistance <= size)
+        self.size = size
+        self.minDistance = minDistance
+        self.numWords = -(-size // basesPerWord)
+        self.codes = np.zeros((16, self.numWords), dtype=np.uint64)
+        self.sequences = []
+        self.rows = {}
+
+        numBlocks = max(minDistance, 1)
+        bounds = [(size * i) // numBlocks for i in range(numBlocks + 1)]
+        self.blocks = list(zip(bounds[:-1], bounds[1:]))
+        # block of a sequence -> rows of the sequences with that block
+        self.tables = [{} for _ in self.blocks]
+
+        # sequences compared by neighbours
+        self.compared = 0
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __contains__(self, sequence):
+        return sequence in self.rows
+
+    def add(self, sequence):
+        # True if sequence was not in the index yet
+        assert(len(sequence) == self.size)
+        if sequence in self.rows:
+            return False
+        row = len(self.sequences)
+        if row == len(self.codes):
+            self.codes = np.concatenate((self.codes, np.zeros_like(self.codes)))
+        self.codes[row] = pack_words(sequence, self.numWords)
+        self.sequences.append(sequence)
+        self.rows[sequence] = row
+        for table, (start, end) in zip(self.tables, self.blocks):
+            table.setdefault(sequence[start:end], []).append(row)
+        return True
+
+    def remove(self, sequence):
+        # True if sequence was in the index, the last row takes its place
+        if sequence not in self.rows:
+            return False
+        row = self.rows.pop(sequence)
+        last = len(self.sequences) - 1
+        lastSequence = self.sequences.pop()
+        for table, (start, end) in zip(self.tables, self.blocks):
+            rows = table[sequence[start:end]]
+            rows.remove(row)
+            if not rows:
+                del table[sequence[start:end]]
+        if row != last:
+            self.codes[row] = self.codes[last]
+            self.sequences[row] = lastSequence
+            self.rows[lastSequence] = row
+            for table, (start, end) in zip(self.tables, self.blocks):
+                rows = table[lastSequence[start:end]]
+                rows[rows.index(last)] = row
+        return True
+
+    ### Distance ###
+
+    def neighbours(self, sequence):
+        # sequences of the index fewer than minDistance nucleotides away from sequence, sequence included
+        if self.minDistance <= 1:
+            return [sequence] if sequence in self.rows else []
+        rows = set()
+        for table, (start, end) in zip(self.tables, self.blocks):
+            rows.update(table.get(sequence[start:end], ()))
+        if not rows:
+            return []
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        self.compared += len(rows)
+        distances = hamming_distances(self.codes[rows], pack_words(sequence, self.numWords))
+        return [self.sequences[row] for row in rows[distances < self.minDistance]]
+
+    def is_far(self, sequence):
+        return not self.neighbours(sequence)
+
+    def prefix_conflicts(self, prefix):
+        # number of sequences of the index that stay fewer than minDistance nucleotides away
+        # from every completion of prefix
+        slack = self.minDistance - 1 - (self.size - len(prefix))
+        if slack < 0 or not self.sequences:
+            return 0
+        # the blocks outside prefix hold at most size - len(prefix) of the minDistance blocks, so more than
+        # slack blocks are inside it and a sequence within slack mismatches is equal on one of them
+        rows = set()
+        for table, (start, end) in zip(self.tables, self.blocks):
+            if end <= len(prefix):
+                rows.update(table.get(prefix[start:end], ()))
+        if not rows:
+            return 0
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        self.compared += len(rows)
+        rest = self.size - len(prefix)
+        words = pack_words(prefix + nucleotides[0] * rest, self.numWords)
+        # code 3 has both bits set
+        mask = pack_words(nucleotides[3] * len(prefix) + nucleotides[0] * rest, self.numWords)
+        distances = hamming_distances(self.codes[rows] & mask, words)
+        return int(np.sum(distances <= slack))
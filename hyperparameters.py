@@ -40,3 +40,31 @@ class Hyperparameters:
         if constraint == 'uniqueJoints':
                 self.uniqueJoints.give_hyperparameter(hyperparameter)
                 return
+        if constraint == 'keyInPayload':
+                self.keyInPayload.give_hyperparameter(hyperparameter)
+                return
+        if constraint == 'jointRepeat':
+                self.jointRepeat.give_hyperparameter(hyperparameter)
+                return
+
+
+class HyperparameterPowers:
+    # hyperparameter**(k / maxSize) for every integer k up to size, rebuilt if the hyperparameter is changed
+    def __init__(self, constraintHyperparameters, maxSize, size, precompute=True):
+        self.constraintHyperparameters = constraintHyperparameters
+        self.maxSize = maxSize
+        self.size = size
+        self.precompute = precompute
+        self.hyperparameter = None
+        self.powers = []
+
+    def power(self, k):
+        hyperparameter = self.constraintHyperparameters.hyperparameter
+        if not self.precompute:
+            return hyperparameter**(k / self.maxSize)
+        if hyperparameter != self.hyperparameter:
+            self.hyperparameter = hyperparameter
+            self.powers = [hyperparameter**(i / self.maxSize) for i in range(self.size + 1)]
+        if 0 <= k <= self.size:
+            return self.powers[k]
+        return hyperparameter**(k / self.maxSize)
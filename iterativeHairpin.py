@@ -0,0 +1,347 @@
+from language import converse
+
+# work items of the scan stack: (CHECK, curJ, hairpinLength, curE1_1, curE1_2, curE2_1, curE2_2)
+# or (ELEM*_ELEM*, stem1 elem, stem2 elem, curJ, hairpinLength) for the hairpin_count_* loops
+CHECK = 0
+ELEM1_ELEM1 = 1
+ELEM1_ELEM2 = 2
+ELEM2_ELEM1 = 3
+ELEM2_ELEM2 = 4
+
+
+class HairpinScan:
+    # state of one counter call, reused across calls and windows
+    __slots__ = ('curElem', 'elems1', 'elems2', 'elem1Size', 'elem2Size', 'hairpinCount', 'hairpinPowers',
+                 'inCur1', 'inCur2', 'inElem2_1', 'inElem2_2', 'sameElem1', 'sameElem2', 'stem1Pos', 'stem2Pos',
+                 'returns', 'stack', 'total')
+
+    def __init__(self, maxHairpin):
+        # per j of the current window
+        self.inCur1 = [False] * maxHairpin
+        self.inCur2 = [False] * maxHairpin
+        self.inElem2_1 = [False] * maxHairpin
+        self.inElem2_2 = [False] * maxHairpin
+        self.sameElem1 = [False] * maxHairpin
+        self.sameElem2 = [False] * maxHairpin
+        self.stem1Pos = [0] * maxHairpin
+        self.stem2Pos = [0] * maxHairpin
+        # return value of send_to_all_check at (curJ + 1, hairpinLength > 0)
+        self.returns = [False] * (2 * maxHairpin + 2)
+        self.stack = []
+        self.total = 0
+
+
+class IterativeHairpinCounter:
+    """Same walk as the recursive hairpin counter of BasePenalties, driven by an
+    explicit stack. Whether a send_to_* call returns True only depends on the
+    window, so it is tabulated per window and every call only pushes its
+    hairpin_count_* / send_to_all_check work items. Hairpins are summed in the scan."""
+
+    def __init__(self, penalties):
+        self.penalties = penalties
+        self.scan = HairpinScan(penalties.maxHairpin)
+
+    def add_elem(self, elems, newElem):
+        pass
+
+    ### Counters ###
+
+    def backward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        return self.hairpin_counter(curElem, elems1, elems2, isKey, hairpinCount, -1)
+
+    def forward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        return self.hairpin_counter(curElem, elems1, elems2, isKey, hairpinCount, 1)
+
+    def backward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        return self.hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, -1)
+
+    def forward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        return self.hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, 1)
+
+    def hairpin_counter(self, curElem, elems1, elems2, isKey, hairpinCount, direction):
+        p = self.penalties
+        scan = self.start(curElem, elems1, elems2, isKey, hairpinCount)
+        for i in range(p.maxHairpin):
+            self.scan_at_startPos(scan, len(curElem) - 1 - i, p.loopSizeMin, p.loopSizeMax, direction)
+        return scan.total
+
+    def hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, direction):
+        if loopSizeMin < 0 or loopSizeMax < 0:
+            loopSizeMin = self.penalties.loopSizeMin
+            loopSizeMax = self.penalties.loopSizeMax
+
+        scan = self.start(curElem, elems1, elems2, isKey, hairpinCount)
+        self.scan_at_startPos(scan, stem1Start, loopSizeMin, loopSizeMax, direction)
+        if scan.total:
+            hairpins.append(scan.total)
+        return sum(hairpins)
+
+    def start(self, curElem, elems1, elems2, isKey, hairpinCount):
+        p = self.penalties
+        scan = self.scan
+        scan.curElem = curElem
+        scan.elems1 = elems1
+        scan.elems2 = elems2
+        scan.elem1Size = p.keySize if isKey else p.payloadSize
+        scan.elem2Size = p.payloadSize if isKey else p.keySize
+        scan.hairpinCount = hairpinCount
+        scan.hairpinPowers = None if hairpinCount else p.hairpinPowers
+        scan.total = 0
+        return scan
+
+    def scan_at_startPos(self, scan, stem1Start, loopSizeMin, loopSizeMax, direction):
+        maxHairpin = self.penalties.maxHairpin
+        stack = scan.stack
+        for loopSize in range(loopSizeMin, loopSizeMax + 1):
+            self.load_window(scan, stem1Start, stem1Start + direction * (loopSize + maxHairpin))
+            stack.append((CHECK, maxHairpin - 1, 0, '', '', '', ''))
+            while stack:
+                item = stack.pop()
+                if item[0] == CHECK:
+                    self.send_to_all_check(scan, item[1], item[2], item[3], item[4], item[5], item[6])
+                else:
+                    self.hairpin_count(scan, item[0], item[1], item[2], item[3], item[4])
+
+    def record(self, scan, hairpinLength):
+        if scan.hairpinCount:
+            scan.total += 1
+        else:
+            scan.total += scan.hairpinPowers.power(hairpinLength)
+
+    ### Window ###
+
+    def load_window(self, scan, stem1Start, stem2Start):
+        motifSize = self.penalties.motifSize
+        maxHairpin = self.penalties.maxHairpin
+        elem1Size = scan.elem1Size
+        elem2Size = scan.elem2Size
+        for j in range(maxHairpin):
+            pos1 = stem1Start + j
+            pos2 = stem2Start + maxHairpin - 1 - j
+            inCur1 = pos1 >= 0 and pos1 < elem1Size
+            inCur2 = pos2 >= 0 and pos2 < elem1Size
+            inElem2_1 = pos1 % motifSize >= elem1Size
+            inElem2_2 = pos2 % motifSize >= elem1Size
+            scan.inCur1[j] = inCur1
+            scan.inCur2[j] = inCur2
+            scan.inElem2_1[j] = inElem2_1
+            scan.inElem2_2[j] = inElem2_2
+            scan.stem1Pos[j] = pos1 % motifSize
+            scan.stem2Pos[j] = pos2 % motifSize
+
+            # same quirks as is_in_same_elem1 / is_in_same_elem2
+            if inElem2_1 or inElem2_2:
+                scan.sameElem1[j] = False
+            else:
+                scan.sameElem1[j] = (inCur1 and inCur2) \
+                    or ((not inCur1) and pos1 < 0 and pos2 < 0 and pos2 >= - elem2Size - elem1Size) \
+                    or ((not inCur1) and pos1 >= elem1Size and pos2 > elem1Size and pos1 < elem2Size + elem1Size * 2)
+            scan.sameElem2[j] = inElem2_1 and inElem2_2 \
+                and ((pos1 < 0 and pos2 < 0 and pos2 >= - elem2Size) or (pos1 >= elem1Size and pos2 > 0 and pos2 < elem1Size + elem2Size))
+
+        # send_to_all_check returns, bottom-up over curJ
+        hasElems2 = bool(scan.elems2)
+        returns = scan.returns
+        returns[0] = returns[1] = False
+        for curJ in range(maxHairpin):
+            inElem2_1 = scan.inElem2_1[curJ]
+            inElem2_2 = scan.inElem2_2[curJ]
+            for hasHairpin in (0, 1):
+                before = returns[2 * curJ + hasHairpin]
+                if not (inElem2_1 or inElem2_2):
+                    sent = True
+                elif inElem2_1 and scan.inCur2[curJ]:
+                    sent = False
+                else:
+                    sent = hasElems2 or before
+                returns[2 * curJ + 2 + hasHairpin] = sent or (curJ == 0 and hasHairpin == 1) or before
+
+    def check_returns(self, scan, curJ, hairpinLength):
+        return scan.returns[2 * curJ + 2 + (hairpinLength > 0)]
+
+    ### Send to ###
+
+    def send_to_all_check(self, scan, curJ, hairpinLength, curE1_1, curE1_2, curE2_1, curE2_2):
+        if curJ < 0 and hairpinLength > 0:
+            self.record(scan, hairpinLength)
+
+        for _ in range(curJ, -1, -1):
+            if self.send_to_elem1_elem1(scan, curJ, hairpinLength, curE1_1, curE1_2) \
+                or self.send_to_elem1_elem2(scan, curJ, hairpinLength, curE1_1, curE2_2) \
+                or self.send_to_elem2_elem1(scan, curJ, hairpinLength, curE2_1, curE1_2) \
+                or self.send_to_elem2_elem2(scan, curJ, hairpinLength, curE2_1, curE2_2):
+                return
+
+            curJ -= 1
+            if curJ < 0 and hairpinLength > 0:
+                self.record(scan, hairpinLength)
+                return
+
+    def send_to_elem1_elem1(self, scan, curJ, hairpinLength, curE1_1, curE1_2):
+        if scan.inElem2_1[curJ] or scan.inElem2_2[curJ]:
+            return False
+
+        push = scan.stack.append
+        curElem = scan.curElem
+        sameElem1 = scan.sameElem1[curJ]
+        if curE1_1 and curE1_2:
+            push((ELEM1_ELEM1, curE1_1, curE1_2, curJ, hairpinLength))
+        elif curE1_1:
+            if not scan.inCur2[curJ]:
+                for e1 in scan.elems1:
+                    if not (sameElem1 and curE1_1 != e1):
+                        push((ELEM1_ELEM1, curE1_1, e1, curJ, hairpinLength))
+            push((ELEM1_ELEM1, curE1_1, curElem, curJ, hairpinLength))
+        elif curE1_2:
+            if not scan.inCur1[curJ]:
+                for e1 in scan.elems1:
+                    if not (sameElem1 and e1 != curE1_2):
+                        push((ELEM1_ELEM1, e1, curE1_2, curJ, hairpinLength))
+            push((ELEM1_ELEM1, curElem, curE1_2, curJ, hairpinLength))
+        else:
+            inCur1 = scan.inCur1[curJ]
+            inCur2 = scan.inCur2[curJ]
+            if inCur1 and not inCur2:
+                for e1_2 in scan.elems1:
+                    if not (sameElem1 and curElem != e1_2):
+                        push((ELEM1_ELEM1, curElem, e1_2, curJ, hairpinLength))
+            elif inCur2 and not inCur1:
+                for e1_1 in scan.elems1:
+                    if not (sameElem1 and curElem != e1_1):
+                        push((ELEM1_ELEM1, e1_1, curElem, curJ, hairpinLength))
+            elif not (inCur1 or inCur2):
+                for e1_1 in scan.elems1:
+                    for e1_2 in scan.elems1:
+                        if not (sameElem1 and e1_1 != e1_2):
+                            push((ELEM1_ELEM1, e1_1, e1_2, curJ, hairpinLength))
+            push((ELEM1_ELEM1, curElem, curElem, curJ, hairpinLength))
+        return True
+
+    def send_to_elem1_elem2(self, scan, curJ, hairpinLength, curE1, curE2):
+        if scan.inElem2_1[curJ] or not scan.inElem2_2[curJ]:
+            return False
+
+        push = scan.stack.append
+        if curE1 and curE2:
+            push((ELEM1_ELEM2, curE1, curE2, curJ, hairpinLength))
+        elif curE1:
+            for e2 in scan.elems2:
+                push((ELEM1_ELEM2, curE1, e2, curJ, hairpinLength))
+        elif curE2:
+            if not scan.inCur1[curJ]:
+                for e1 in scan.elems1:
+                    push((ELEM1_ELEM2, e1, curE2, curJ, hairpinLength))
+            push((ELEM1_ELEM2, scan.curElem, curE2, curJ, hairpinLength))
+        else:
+            for e2 in scan.elems2:
+                if not scan.inCur1[curJ]:
+                    for e1 in scan.elems1:
+                        push((ELEM1_ELEM2, e1, e2, curJ, hairpinLength))
+                push((ELEM1_ELEM2, scan.curElem, e2, curJ, hairpinLength))
+
+        if not (curE2 or scan.elems2):
+            push((CHECK, curJ - 1, hairpinLength, curE1, '', '', curE2))
+            return self.check_returns(scan, curJ - 1, hairpinLength)
+        return True
+
+    def send_to_elem2_elem1(self, scan, curJ, hairpinLength, curE2, curE1):
+        if not scan.inElem2_1[curJ] or scan.inCur2[curJ] or scan.inElem2_2[curJ]:
+            return False
+
+        push = scan.stack.append
+        if curE2 and curE1:
+            push((ELEM2_ELEM1, curE2, curE1, curJ, hairpinLength))
+        elif curE2:
+            if not scan.inCur2[curJ]:
+                for e1 in scan.elems1:
+                    push((ELEM2_ELEM1, curE2, e1, curJ, hairpinLength))
+            push((ELEM2_ELEM1, curE2, scan.curElem, curJ, hairpinLength))
+        elif curE1:
+            for e2 in scan.elems2:
+                push((ELEM2_ELEM1, e2, curE1, curJ, hairpinLength))
+        else:
+            for e2 in scan.elems2:
+                if not scan.inCur2[curJ]:
+                    for e1 in scan.elems1:
+                        push((ELEM2_ELEM1, e2, e1, curJ, hairpinLength))
+                push((ELEM2_ELEM1, e2, scan.curElem, curJ, hairpinLength))
+
+        if not (curE2 or scan.elems2):
+            push((CHECK, curJ - 1, hairpinLength, '', curE1, curE2, ''))
+            return self.check_returns(scan, curJ - 1, hairpinLength)
+        return True
+
+    def send_to_elem2_elem2(self, scan, curJ, hairpinLength, curE2_1, curE2_2):
+        if not (scan.inElem2_1[curJ] and scan.inElem2_2[curJ]):
+            return False
+
+        push = scan.stack.append
+        sameElem2 = scan.sameElem2[curJ]
+        if curE2_1 and curE2_2:
+            push((ELEM2_ELEM2, curE2_1, curE2_2, curJ, hairpinLength))
+        elif curE2_1:
+            for e2_2 in scan.elems2:
+                if not (sameElem2 and curE2_1 != e2_2):
+                    push((ELEM2_ELEM2, curE2_1, e2_2, curJ, hairpinLength))
+        elif curE2_2:
+            for e2_1 in scan.elems2:
+                if not (sameElem2 and e2_1 != curE2_2):
+                    push((ELEM2_ELEM2, e2_1, curE2_2, curJ, hairpinLength))
+        else:
+            for e2_1 in scan.elems2:
+                for e2_2 in scan.elems2:
+                    if not (sameElem2 and e2_1 != e2_2):
+                        push((ELEM2_ELEM2, e2_1, e2_2, curJ, hairpinLength))
+
+        if not ((curE2_1 and curE2_2) or scan.elems2):
+            push((CHECK, curJ - 1, hairpinLength, '', '', curE2_1, curE2_2))
+            return self.check_returns(scan, curJ - 1, hairpinLength)
+        return True
+
+    ### Hairpin count ###
+
+    def hairpin_count(self, scan, kind, elem1, elem2, curJ, hairpinLength):
+        # elem1 holds stem1 and elem2 holds stem2, of the types given by kind
+        elem1Size = scan.elem1Size
+        for j in range(curJ, -1, -1):
+            if kind == ELEM1_ELEM1:
+                if self.send_to_elem2_elem1(scan, j, hairpinLength, '', elem2) \
+                    or self.send_to_elem2_elem2(scan, j, hairpinLength, '', '') \
+                    or self.send_to_elem1_elem2(scan, j, hairpinLength, elem1, ''):
+                    return
+                curStem1Pos = scan.stem1Pos[j]
+                curStem2Pos = scan.stem2Pos[j]
+                if curStem1Pos >= len(elem1) or curStem2Pos >= len(elem2):
+                    continue
+            elif kind == ELEM1_ELEM2:
+                if self.send_to_elem2_elem1(scan, j, hairpinLength, '', '') \
+                    or self.send_to_elem2_elem2(scan, j, hairpinLength, '', elem2) \
+                    or self.send_to_elem1_elem1(scan, j, hairpinLength, elem1, ''):
+                    return
+                curStem1Pos = scan.stem1Pos[j]
+                curStem2Pos = scan.stem2Pos[j] - elem1Size
+                if curStem1Pos >= len(elem1):
+                    continue
+            elif kind == ELEM2_ELEM1:
+                if self.send_to_elem1_elem1(scan, j, hairpinLength, '', elem2) \
+                    or self.send_to_elem1_elem2(scan, j, hairpinLength, '', '') \
+                    or self.send_to_elem2_elem2(scan, j, hairpinLength, elem1, ''):
+                    return
+                curStem1Pos = scan.stem1Pos[j] - elem1Size
+                curStem2Pos = scan.stem2Pos[j]
+                if curStem2Pos >= len(elem2):
+                    continue
+            else:
+                if self.send_to_elem1_elem1(scan, j, hairpinLength, '', '') \
+                    or self.send_to_elem1_elem2(scan, j, hairpinLength, '', elem2) \
+                    or self.send_to_elem2_elem1(scan, j, hairpinLength, elem1, ''):
+                    return
+                curStem1Pos = scan.stem1Pos[j] - elem1Size
+                curStem2Pos = scan.stem2Pos[j] - elem1Size
+
+            if elem1[curStem1Pos] == converse[elem2[curStem2Pos]]:
+                hairpinLength += 1
+                if j == 0:
+                    self.record(scan, hairpinLength)
+            else:
+                break
@@ -0,0 +1,81 @@
+from collections import deque
+from language import converse
+from packedSequences import nucleotideCodes
+
+
+def reverse_complement(sequence):
+    # joint of a key and key of a joint
+    return ''.join(converse[n] for n in reversed(sequence))
+
+
+class KeyAutomaton:
+    """Aho-Corasick automaton of a set of sequences (keys and joints), with the failure links
+    folded into the transitions: reading a payload is one transition per base, and every
+    state knows the sequences that end at it."""
+
+    def __init__(self, sequences):
+        self.sequences = sorted(set(sequences))
+        # state -> next state per nucleotide code, -1 until the trie is completed
+        self.transitions = [[-1] * len(nucleotideCodes)]
+        # state -> indexes in self.sequences of the sequences ending at it
+        self.ends = [[]]
+
+        for i, sequence in enumerate(self.sequences):
+            state = 0
+            for n in sequence:
+                code = nucleotideCodes[n]
+                if self.transitions[state][code] == -1:
+                    self.transitions[state][code] = len(self.transitions)
+                    self.transitions.append([-1] * len(nucleotideCodes))
+                    self.ends.append([])
+                state = self.transitions[state][code]
+            self.ends[state].append(i)
+
+        # breadth first, so the failure state of a state is complete before it
+        failures = [0] * len(self.transitions)
+        queue = deque()
+        for code, child in enumerate(self.transitions[0]):
+            if child == -1:
+                self.transitions[0][code] = 0
+            else:
+                queue.append(child)
+        while queue:
+            state = queue.popleft()
+            self.ends[state] = self.ends[state] + self.ends[failures[state]]
+            for code, child in enumerate(self.transitions[state]):
+                if child == -1:
+                    self.transitions[state][code] = self.transitions[failures[state]][code]
+                else:
+                    failures[child] = self.transitions[failures[state]][code]
+                    queue.append(child)
+        self.counts = [len(ends) for ends in self.ends]
+
+    ### Search ###
+
+    def step(self, state, n):
+        return self.transitions[state][nucleotideCodes[n]]
+
+    def state(self, sequence):
+        state = 0
+        for n in sequence:
+            state = self.transitions[state][nucleotideCodes[n]]
+        return state
+
+    def count(self, sequence):
+        # number of occurrences of the sequences of the automaton in sequence
+        state = 0
+        count = 0
+        for n in sequence:
+            state = self.transitions[state][nucleotideCodes[n]]
+            count += self.counts[state]
+        return count
+
+    def occurrences(self, sequence):
+        # (end position, found sequence) of every occurrence in sequence
+        state = 0
+        found = []
+        for pos, n in enumerate(sequence):
+            state = self.transitions[state][nucleotideCodes[n]]
+            for i in self.ends[state]:
+                found.append((pos + 1, self.sequences[i]))
+        return found
@@ -3,12 +3,16 @@ from constraints import Constraints
 from validation import Validate
 from hyperparameters import Hyperparameters
 from language import nucleotides
+from nucleotideSampler import NucleotideSampler
+from packedSequences import PackedSequenceSet
+from keyTable import KeyTable
 
+import time
 import numpy as np
 
 
 class KeyBuilder:
-    def __init__(self, constraints, hyperparameters, weights):
+    def __init__(self, constraints, hyperparameters, weights, seed=None):
         self.constraints = constraints
         
         self.hyperparameters = hyperparameters
@@ -18,60 +22,42 @@ class KeyBuilder:
         self.keySize = constraints.keySize
 
         self.penalties = BaseKeyPenalties(constraints, hyperparameters)
+        self.sampler = NucleotideSampler(seed)
 
     ### Build Keys ###
 
     async def buildKey(self, withConstraints):
+        key = await self.drawKey(withConstraints)
+        await self.penalties.add_key(key)
+        return key
+
+    async def drawKey(self, withConstraints):
+        # key built against the current keys, without adding it
         key = ''
 
         self.penalties.start_new_key()
         for _ in range(self.keySize):
             
-            constraintPenalties = {}
             # 'hom', 'hairpin', 'keyGcContent'
-            for constraint in withConstraints:
-                constraintPenalties[constraint] = []
-
-            for n in nucleotides:
-
-                for constraint in constraintPenalties:
-                    if constraint == 'hom':
-                            homPenalty = self.penalties.get_homopolymer_penalty(key, n)
-                            constraintPenalties[constraint].append(homPenalty)
-                    if constraint == 'hairpin':
-                            hairpinPenalty = self.penalties.get_hairpin_penalty(key, n)
-                            constraintPenalties[constraint].append(hairpinPenalty)
-                    if constraint == 'keyGcContent':
-                            keyGcPenalty = self.penalties.get_gc_penalty(key, n)
-                            constraintPenalties[constraint].append(keyGcPenalty)
-                        # case 'similarity':
-                        #     similarity = self.get_similarity_penalty(key, n)
-                        #     constraintPenalties[constraint].append(similarity)
-                        # case 'uniqueJoints':
-                        #     uniqueJoints = self.get_unique_joints_penalty(key, n)
-                        #     constraintPenalties[constraint].append(uniqueJoints)
-            
-                
-
-            for constraint in constraintPenalties:
-                constraintPenalties[constraint] = np.array(constraintPenalties[constraint])
+            # constraints without extension penalties don't weigh on the draw
+            constraints = [constraint for constraint in withConstraints if constraint in self.penalties.extensionPenalties]
+            constraintPenalties = self.penalties.score_extensions(key, constraints)
 
-            if not withConstraints:
+            if not constraints:
                 p = [0.25, 0.25, 0.25, 0.25]
             else:
                 lp = 0
-                for constraint in constraintPenalties:
+                for i, constraint in enumerate(constraints):
                     weight = self.weights[constraint]
-                    lp -= 1.0 * weight * constraintPenalties[constraint]
+                    lp -= 1.0 * weight * constraintPenalties[:, i]
                 p = np.exp(lp)
-                p /= p.sum()
+                p = (p / p.sum()).tolist()
 
-            new_nucleotide = np.random.choice(nucleotides, p=p)
+            new_nucleotide = self.sampler.choose(p)
         
             key += new_nucleotide
             await self.penalties.add_base(new_nucleotide)
 
-        await self.penalties.add_key(key)
         return key
     
     async def buildAllKeys(self, withConstraints):
@@ -81,6 +67,29 @@ class KeyBuilder:
             allKeys.add(key)
         return allKeys
 
+    async def buildAllUniqueKeys(self, withConstraints, maxAttempts=-1, maxSeconds=-1):
+        # draws until keyNum distinct valid keys are built or the attempt/time budget runs out
+        if maxAttempts < 0:
+            maxAttempts = 10 * self.keyNum
+        startTime = time.monotonic()
+        seen = PackedSequenceSet(self.penalties.keys)
+        allKeys = set()
+        for _ in range(maxAttempts):
+            if len(allKeys) == self.keyNum or (maxSeconds >= 0 and time.monotonic() - startTime > maxSeconds):
+                break
+            key = await self.drawKey(withConstraints)
+            if seen.add(key) and self.penalties.is_valid(key, withConstraints):
+                allKeys.add(key)
+                await self.penalties.add_key(key)
+        return allKeys
+
+    async def buildAllKeysFromTable(self, withConstraints, selection='weighted'):
+        # keys picked from the table of all keys of keySize, see KeyTable
+        keyTable = KeyTable(self.constraints, self.weights, self.sampler.rng)
+        allKeys = keyTable.select(withConstraints, self.keyNum, selection, self.penalties.keys)
+        await self.penalties.add_keys(allKeys)
+        return set(allKeys)
+
 
 async def main():
     payloadSize = 8
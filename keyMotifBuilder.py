@@ -2,10 +2,14 @@ from motifBuilder import MotifBuilder
 from keyBuilder import KeyBuilder
 from constraints import Constraints
 from validation import Validate
+from libraryRepair import LibraryRepair
 from hyperparameters import Hyperparameters
 from language import converse
 
 import numpy as np
+import asyncio
+import os
+import multiprocessing
 
 def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=2, keyNum=5, payloadNum=5, maxHom=1, minGc=25, maxGc=60, loopMin=-1, loopMax=-1):
     payloadSize = payloadSize
@@ -29,13 +33,13 @@ def get_hyperparameters(hom=5, keyGcContent=5, motifGcContent=5, hairpin=5):
     hyperparams = {'hom': hom, 'keyGcContent': keyGcContent, 'motifGcContent': motifGcContent, 'hairpin': hairpin}
     return Hyperparameters(hyperparams)
 
-async def buildKeys(withConstraints, constraints, internalHyperparameters, weights):
-    keyBuilder = KeyBuilder(constraints, internalHyperparameters, weights)
+async def buildKeys(withConstraints, constraints, internalHyperparameters, weights, seed=None):
+    keyBuilder = KeyBuilder(constraints, internalHyperparameters, weights, seed)
     keys = await keyBuilder.buildAllKeys(withConstraints)
     return keys
 
-async def buildMotifs(withConstraints, constraints, internalHyperparameters, weights, joints):
-    motifBuilder = MotifBuilder(constraints, internalHyperparameters, weights)
+async def buildMotifs(withConstraints, constraints, internalHyperparameters, weights, joints, seed=None):
+    motifBuilder = MotifBuilder(constraints, internalHyperparameters, weights, seed)
     await motifBuilder.add_joints(joints)
     motifs = await motifBuilder.buildAllPayloads(withConstraints)
     return motifs
@@ -49,16 +53,25 @@ def keys_to_joints(keys):
         joints.add(joint)
     return joints
 
-async def build_motifs_and_keys(withKeyConstraints, withMotifConstraints, constraints):
+async def build_motifs_and_keys(withKeyConstraints, withMotifConstraints, constraints, seed=None):
     import asyncio
 
     internalHyperparameters = get_hyperparameters()
     weights = get_weights()
+    # independent streams for keys and payloads
+    keySeed, payloadSeed = np.random.SeedSequence(seed).spawn(2)
     
-    keys = await buildKeys(withKeyConstraints, constraints, internalHyperparameters, weights)
+    keys = await buildKeys(withKeyConstraints, constraints, internalHyperparameters, weights, keySeed)
     joints = keys_to_joints(keys)
-    payloads = await buildMotifs(withMotifConstraints, constraints, internalHyperparameters, weights, joints)
-    
+    payloads = await buildMotifs(withMotifConstraints, constraints, internalHyperparameters, weights, joints, payloadSeed)
+    motifs = joints_to_motifs(joints, payloads)
+
+  #  print('keys: ', keys)
+   # print('payloads: ', payloads)
+    #print('motifs: ', motifs)
+    return keys, payloads, motifs
+
+def joints_to_motifs(joints, payloads):
     startJoint = set()
     endJoint = set()
     for j in joints:
@@ -71,11 +84,7 @@ async def build_motifs_and_keys(withKeyConstraints, withMotifConstraints, constr
         for eJoint in endJoint:
             for p in payloads:
                 motifs.add(sJoint + p + eJoint)
-
-  #  print('keys: ', keys)
-   # print('payloads: ', payloads)
-    #print('motifs: ', motifs)
-    return keys, payloads, motifs
+    return motifs
 
 async def main():
     maxHom = 2
@@ -101,7 +110,12 @@ async def main():
     # print('gcKeyScore: ', gcKeyScore)
     return  keys, payloads, motifs, totalScore == 0
 
-async def buildAnswer(withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax):
+async def buildAnswer(withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed=None, repairSeconds=0):
+    keys, payloads, motifs, totalScore = await build_answer_and_score(withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed, repairSeconds)
+    return keys, payloads, motifs, bool(totalScore == 0)
+
+async def build_answer_and_score(withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed=None, repairSeconds=0):
+    # keys, payloads, motifs and their total validation score, 0 if valid and negative otherwise
     constraints = get_constraints(maxHairpin=maxHairpin, loopSize=-1, payloadSize=payloadSize, keySize=keySize, keyNum=keyNum, payloadNum=payloadNum, maxHom=maxHomopolymer, minGc=gcContentMinPercentage, maxGc=gcContentMaxPercentage, loopMin=loopMin, loopMax=loopMax)
     withKeyConstraints = set()
     withMotifConstraints = set()
@@ -117,7 +131,7 @@ async def buildAnswer(withConstraints, payloadNum, payloadSize, keyNum, keySize,
         withKeyConstraints.add('hairpin')
         withMotifConstraints.add('hairpin')
 
-    keys, payloads, motifs = await build_motifs_and_keys(withKeyConstraints, withMotifConstraints, constraints)
+    keys, payloads, motifs = await build_motifs_and_keys(withKeyConstraints, withMotifConstraints, constraints, seed)
 
     # Validation
     keyMotifsValidation = Validate(constraints)
@@ -132,12 +146,69 @@ async def buildAnswer(withConstraints, payloadNum, payloadSize, keyNum, keySize,
         totalScore += keyMotifsValidation.get_keys_gc_score()
     if 'hairpin' in withConstraints:
         totalScore += keyMotifsValidation.get_motifs_and_keys_hairpin_score()
+
+    # mutate the offending keys and payloads instead of giving up on the library
+    if totalScore != 0 and repairSeconds > 0:
+        repairSeed = np.random.SeedSequence(seed).spawn(3)[2]
+        libraryRepair = LibraryRepair(constraints, withConstraints, repairSeed)
+        keys, payloads, isValid = await libraryRepair.repair(keys, payloads, repairSeconds)
+        return keys, payloads, joints_to_motifs(keys_to_joints(keys), payloads), -float(libraryRepair.penalty)
     # print('homScore: ', homScore)
     # print('gcMotifScore: ', gcMotifScore)
     # print('hairpinScore: ', hairpinScore)
     # print('gcKeyScore: ', gcKeyScore)
-    return  keys, payloads, motifs, totalScore == 0
-   
+    return  keys, payloads, motifs, float(totalScore)
+
+### Parallel attempts ###
+
+def build_answer_attempt(args, seed, repairSeconds):
+    # runs in a worker process
+    return asyncio.run(build_answer_and_score(*args, seed, repairSeconds))
+
+async def buildAnswerParallel(withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax, seed=None, numAttempts=4, maxSeconds=-1, repairSeconds=0):
+    # independent attempts in worker processes: the first valid one, or the best one finished by maxSeconds
+    args = (withConstraints, payloadNum, payloadSize, keyNum, keySize, maxHairpin, gcContentMinPercentage, gcContentMaxPercentage, maxHomopolymer, loopMin, loopMax)
+    loop = asyncio.get_running_loop()
+    pool = multiprocessing.Pool(processes=min(numAttempts, os.cpu_count() or 1))
+    pending = set()
+    for attemptSeed in np.random.SeedSequence(seed).generate_state(numAttempts).tolist():
+        future = loop.create_future()
+        # the pool calls back from its own thread
+        pool.apply_async(build_answer_attempt, (args, attemptSeed, repairSeconds),
+                         callback=lambda result, future=future: loop.call_soon_threadsafe(set_attempt_result, future, result),
+                         error_callback=lambda error, future=future: loop.call_soon_threadsafe(set_attempt_error, future, error))
+        pending.add(future)
+    deadline = loop.time() + maxSeconds if maxSeconds >= 0 else None
+    best = None
+    try:
+        while pending:
+            # without any finished attempt, the deadline waits for the first one
+            timeout = None if deadline is None or best is None else max(0, deadline - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                result = future.result()
+                if best is None or result[3] > best[3]:
+                    best = result
+            if best[3] == 0:
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+        # drops the attempts that haven't started and ends the running ones
+        pool.terminate()
+        pool.join()
+    keys, payloads, motifs, totalScore = best
+    return keys, payloads, motifs, totalScore == 0
+
+def set_attempt_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def set_attempt_error(future, error):
+    if not future.done():
+        future.set_exception(error)
 
 if __name__ == '__main__':
     import asyncio
@@ -0,0 +1,149 @@
+from functools import lru_cache
+import numpy as np
+from language import nucleotides
+from packedSequences import nucleotideCodes
+
+# keys of the table are packed 2 bits per nucleotide (index in language.nucleotides), first nucleotide
+# in the highest bits and without the leading 1 bit of packedSequences: all keys have the same size
+maxTableKeySize = 12
+
+
+def key_bases(codes, keySize, i):
+    # nucleotide index at position i of every key
+    return ((codes >> np.uint32(2 * (keySize - 1 - i))) & np.uint32(3)).astype(np.uint8)
+
+def unpack_key(code, keySize):
+    return ''.join(nucleotides[(int(code) >> (2 * (keySize - 1 - i))) & 3] for i in range(keySize))
+
+
+@lru_cache(maxsize=1)
+def key_table(keySize, maxHom, maxHairpin, loopSizeMin, loopSizeMax):
+    """Homopolymer length over maxHom (summed over the runs), G/C count and number of hairpins
+    inside the key, as counted by Validate for keys, of every key of keySize. Row i is the key
+    packed as i, so the codes aren't stored; at keySize 12 the three columns take 48MB."""
+    assert(keySize <= maxTableKeySize)
+    codes = np.arange(4**keySize, dtype=np.uint32)
+    homExcess = np.zeros(len(codes), dtype=np.uint8)
+    gcCounts = np.zeros(len(codes), dtype=np.uint8)
+    hairpins = np.zeros(len(codes), dtype=np.uint8)
+
+    # C and G have indexes 2 and 3 in nucleotides
+    run = np.zeros(len(codes), dtype=np.uint8)
+    prev = None
+    for i in range(keySize):
+        bases = key_bases(codes, keySize, i)
+        gcCounts += bases >= 2
+        if prev is None:
+            run += 1
+        else:
+            isNewRun = bases != prev
+            homExcess += np.where(isNewRun & (run > maxHom), run - np.uint8(min(maxHom, keySize)), 0).astype(np.uint8)
+            run = np.where(isNewRun, np.uint8(1), run + np.uint8(1))
+        prev = bases
+    homExcess += np.where(run > maxHom, run - np.uint8(min(maxHom, keySize)), 0).astype(np.uint8)
+
+    # stem2 is the reverse complement of stem1, the converse of index b is b ^ 1
+    for loopSize in range(loopSizeMin, loopSizeMax + 1):
+        stemsSize = 2 * maxHairpin + loopSize
+        if stemsSize >= keySize:
+            continue
+        for stem1Start in range(keySize - stemsSize + 1):
+            isHairpin = np.ones(len(codes), dtype=bool)
+            for j in range(maxHairpin):
+                isHairpin &= key_bases(codes, keySize, stem1Start + j) == (key_bases(codes, keySize, stem1Start + stemsSize - 1 - j) ^ 1)
+            hairpins += isHairpin
+    return homExcess, gcCounts, hairpins
+
+
+class KeyTable:
+    """Picks keys from the table of all keys instead of building them base by base.
+    Only the penalties of a key on its own are scored (homopolymers, key GC content and
+    hairpins inside the key); the 'diverse' selection keeps the picked keys far apart
+    in Hamming distance instead of scoring similarity to the other keys."""
+
+    def __init__(self, constraints, weights, rng):
+        self.keySize = constraints.keySize
+        self.minGc = constraints.minGc
+        self.maxGc = constraints.maxGc
+        self.weights = weights
+        self.rng = rng
+        self.homExcess, self.gcCounts, self.hairpins = key_table(constraints.keySize, constraints.maxHom, constraints.maxHairpin,
+                                                                 constraints.loopSizeMin, constraints.loopSizeMax)
+
+    ### Scores ###
+
+    def penalties(self, withConstraints):
+        # weighted penalty of every key, 0 for keys within the limits of withConstraints
+        penalties = np.zeros(len(self.gcCounts), dtype=np.float32)
+        if 'hom' in withConstraints:
+            penalties += np.float32(self.weights['hom']) * self.homExcess
+        if 'keyGcContent' in withConstraints:
+            # GC penalty of every possible G/C count
+            gcContent = (100 * np.arange(self.keySize + 1)) / self.keySize
+            gcPenalties = np.maximum(np.maximum(self.minGc - gcContent, gcContent - self.maxGc), 0).astype(np.float32)
+            penalties += np.float32(self.weights['keyGcContent']) * gcPenalties[self.gcCounts]
+        if 'hairpin' in withConstraints:
+            penalties += np.float32(self.weights['hairpin']) * self.hairpins
+        return penalties
+
+    ### Selection ###
+
+    def select(self, withConstraints, keyNum, selection='weighted', exclude=set()):
+        # keyNum distinct keys not in exclude, fewer if there aren't enough
+        penalties = self.penalties(withConstraints)
+        isCandidate = np.ones(len(self.gcCounts), dtype=bool)
+        for key in exclude:
+            isCandidate[self.code(key)] = False
+        keyNum = min(keyNum, int(isCandidate.sum()))
+        if selection == 'weighted':
+            picked = self.select_weighted(penalties, isCandidate, keyNum)
+        else:
+            assert(selection == 'diverse')
+            picked = self.select_diverse(penalties, isCandidate, keyNum)
+        return [unpack_key(i, self.keySize) for i in picked]
+
+    def select_weighted(self, penalties, isCandidate, keyNum):
+        # drawn without replacement among the keys without penalty, then with probability exp(-penalty)
+        candidates = np.flatnonzero(isCandidate & (penalties == 0))
+        if len(candidates) >= keyNum:
+            return self.rng.choice(candidates, keyNum, replace=False)
+        others = np.flatnonzero(isCandidate & (penalties > 0))
+        p = np.exp(-(penalties[others] - penalties[others].min()))
+        return np.concatenate((candidates, self.rng.choice(others, keyNum - len(candidates), replace=False, p=p / p.sum())))
+
+    def select_diverse(self, penalties, isCandidate, keyNum):
+        # farthest-first among the keys of lowest penalty, then among the next lowest if they run out
+        picked = []
+        while len(picked) < keyNum:
+            level = penalties[isCandidate].min()
+            candidates = np.flatnonzero(isCandidate & (penalties == level))
+            isCandidate[candidates] = False
+            codes = candidates.astype(np.uint32)
+            distances = np.full(len(candidates), self.keySize, dtype=np.uint8)
+            for i in picked:
+                distances = np.minimum(distances, self.hamming_distances(codes, np.uint32(i)))
+            isLeft = np.ones(len(candidates), dtype=bool)
+            while len(picked) < keyNum and isLeft.any():
+                farthest = np.flatnonzero(isLeft & (distances == distances[isLeft].max()))
+                j = farthest[self.rng.integers(len(farthest))]
+                picked.append(candidates[j])
+                isLeft[j] = False
+                distances = np.minimum(distances, self.hamming_distances(codes, codes[j]))
+        return picked
+
+    def hamming_distances(self, codes, code):
+        # number of different nucleotides between code and every key of codes
+        x = codes ^ code
+        x = (x | (x >> np.uint32(1))) & np.uint32(0x55555555)
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(x)
+        distances = np.zeros(len(codes), dtype=np.uint8)
+        for i in range(self.keySize):
+            distances += ((x >> np.uint32(2 * i)) & np.uint32(1)).astype(np.uint8)
+        return distances
+
+    def code(self, key):
+        code = 0
+        for n in key:
+            code = (code << 2) | nucleotideCodes[n]
+        return code
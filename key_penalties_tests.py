@@ -1,7 +1,10 @@
 import pytest
+import numpy as np
 import baseKeyPenalties as bp
 import constraints as c
 import hyperparameters as h
+from language import nucleotides
+from hammingIndex import HammingIndex
 
 
 def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=2, maxHom=1, minGc=25, maxGc=60):
@@ -524,3 +527,100 @@ async def test_forward_full_stem1_and_part_stem2_in_key1():
     result = get_score(1, hairpinHyperparam, maxHairpin)
     assert result == hairpinScore
 
+
+###### Extension scores tests ######
+
+@pytest.mark.asyncio
+async def test_score_extensions_match_single_penalties():
+    keySize = 6
+    constraints = get_constraints(maxHairpin=2, loopSize=1, keySize=keySize, maxHom=2)
+    hyperparams = h.Hyperparameters({'hom': 5, 'keyGcContent': 5, 'hairpin': 5, 'similarity': 5, 'uniqueJoints': 5})
+    baseKeyPenalties = bp.BaseKeyPenalties(constraints, hyperparams)
+    await baseKeyPenalties.add_keys({'AGTGCA', 'GACTTA'})
+    baseKeyPenalties.start_new_key()
+    key = ''
+    for b in 'AGTTCA':
+        # payloadDistance has no key extension penalties
+        scores = baseKeyPenalties.score_extensions(key, ['hom', 'hairpin', 'keyGcContent', 'similarity', 'uniqueJoints', 'payloadDistance'])
+        assert scores.shape == (4, 6)
+        for i, n in enumerate(nucleotides):
+            assert baseKeyPenalties.get_homopolymer_penalty(key, n) == scores[i, 0]
+            assert baseKeyPenalties.get_hairpin_penalty(key, n) == scores[i, 1]
+            assert baseKeyPenalties.get_gc_penalty(key, n) == pytest.approx(scores[i, 2])
+            assert baseKeyPenalties.get_similarity_penalty(key, n) == scores[i, 3]
+            assert baseKeyPenalties.get_unique_joints_penalty(key, n) == pytest.approx(scores[i, 4])
+            assert scores[i, 5] == 0
+        key += b
+        await baseKeyPenalties.add_base(b)
+
+###### Similarity and unique joints tests ######
+
+@pytest.mark.asyncio
+async def test_similarity_and_unique_joints_use_key_and_joint_prefixes():
+    keySize = 4
+    constraints = get_constraints(keySize=keySize)
+    hyperparams = h.Hyperparameters({'similarity': 5, 'uniqueJoints': 3})
+    baseKeyPenalties = bp.BaseKeyPenalties(constraints, hyperparams)
+    keys = {'AGTC', 'AGCA', 'TTGC'}
+    await baseKeyPenalties.add_keys(keys)
+    for curKey in ['A', 'AG', 'AGT', 'AGTA', 'AGCA', 'TT', 'C', 'CCGC', 'GAGC']:
+        isKeyPrefix = any(k.startswith(curKey) for k in keys)
+        assert baseKeyPenalties.similarity_penalty(curKey) == pytest.approx(5**((len(curKey) if isKeyPrefix else 0) / keySize))
+        if len(curKey) <= 2:
+            similarity = len(curKey) if any(k[:2].startswith(curKey) for k in keys) else 0
+            # start joints: AG, TT
+            weight = 100 * (16 - 2) / 16
+        else:
+            similarity = len(curKey) - 2 if any(k[2:].startswith(curKey[2:]) for k in keys) else 0
+            # end joints: TC, CA, GC
+            weight = 100 * (16 - 3) / 16
+        assert baseKeyPenalties.unique_joints_penalty(curKey) == pytest.approx(weight * 3**(similarity / 2))
+
+###### Key distance tests ######
+
+def test_hamming_index_neighbours_match_pairwise_distances():
+    rng = np.random.default_rng(3)
+    for size, minDistance in [(12, 4), (40, 6)]:
+        sequences = [''.join(rng.choice(nucleotides, size)) for _ in range(200)]
+        index = HammingIndex(size, minDistance, sequences)
+        # stored sequences with 0 to 2 * minDistance substitutions
+        queries = []
+        for sequence in sequences[:100]:
+            query = list(sequence)
+            for i in rng.choice(size, rng.integers(2 * minDistance + 1), replace=False):
+                query[i] = nucleotides[rng.integers(4)]
+            queries.append(''.join(query))
+        for query in queries:
+            distances = [sum(a != b for a, b in zip(sequence, query)) for sequence in sequences]
+            assert sorted(index.neighbours(query)) == sorted(s for s, d in zip(sequences, distances) if d < minDistance)
+        assert index.compared < len(queries) * len(sequences) / 4
+        index.compared = 0
+        for query in queries:
+            prefixDistances = [sum(a != b for a, b in zip(sequence, query[:size - 2])) for sequence in sequences]
+            assert index.prefix_conflicts(query[:size - 2]) == sum(d <= minDistance - 3 for d in prefixDistances)
+        assert index.compared < len(queries) * len(sequences) / 4
+
+def test_hamming_index_remove_keeps_the_other_sequences():
+    rng = np.random.default_rng(5)
+    sequences = sorted({''.join(rng.choice(nucleotides, 8)) for _ in range(60)})
+    index = HammingIndex(8, 3, sequences)
+    removed = set(sequences[::3])
+    for sequence in removed:
+        assert index.remove(sequence)
+    assert not index.remove(sequences[0])
+    kept = [sequence for sequence in sequences if sequence not in removed]
+    assert len(index) == len(kept) and sorted(index.sequences) == kept
+    for query in sequences:
+        assert sorted(index.neighbours(query)) == sorted(s for s in kept if sum(a != b for a, b in zip(s, query)) < 3)
+
+@pytest.mark.asyncio
+async def test_key_distance_keeps_keys_apart():
+    constraints = c.Constraints(10, 5, 1, 2, 1, 25, 60, 4, minKeyDistance=2)
+    baseKeyPenalties = bp.BaseKeyPenalties(constraints, get_hyperparameters())
+    await baseKeyPenalties.add_keys({'ACGT'})
+    assert not baseKeyPenalties.is_valid('ACGA', {'keyDistance'})
+    assert baseKeyPenalties.is_valid('ACTA', {'keyDistance'})
+    assert baseKeyPenalties.is_valid('ACGA', {'hom'})
+    # with a single base left, ACG can't get 2 bases away from ACGT
+    assert baseKeyPenalties.score_extensions('AC', ['keyDistance'])[:, 0].tolist() == [0, 0, 0, 1]
+    assert baseKeyPenalties.score_extensions('A', ['keyDistance'])[:, 0].tolist() == [0, 0, 0, 0]
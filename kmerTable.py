@@ -0,0 +1,116 @@
+import numpy as np
+from packedSequences import nucleotideCodes
+
+# nucleotide code of every ASCII character
+asciiCodes = np.zeros(256, dtype=np.uint8)
+for n, code in nucleotideCodes.items():
+    asciiCodes[ord(n)] = code
+
+
+def rolling_kmers(sequences, k):
+    # k-mers of sequences of the same length packed 2 bits per base, one row per sequence
+    sequences = list(sequences)
+    if not sequences or len(sequences[0]) < k:
+        return np.zeros((len(sequences), 0), dtype=np.uint64)
+    length = len(sequences[0])
+    rows = asciiCodes[np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)].reshape(len(sequences), length).astype(np.uint64)
+    mask = np.uint64((1 << (2 * k)) - 1)
+    code = np.zeros(len(sequences), dtype=np.uint64)
+    kmers = np.empty((len(sequences), length - k + 1), dtype=np.uint64)
+    # the code of a window is the code of the previous one shifted by a base
+    for j in range(length):
+        code = ((code << np.uint64(2)) | rows[:, j]) & mask
+        if j >= k - 1:
+            kmers[:, j - k + 1] = code
+    return kmers
+
+def junction_kmers(startJoints, endJoints, payloads, k):
+    # k-mers crossing the joint/payload junctions of the motifs startJoint + payload + endJoint,
+    # each k-mer once per payload
+    kmers = []
+    for payload in payloads:
+        starts = rolling_kmers([startJoint + payload[:k - 1] for startJoint in startJoints], k)
+        ends = rolling_kmers([payload[-(k - 1):] + endJoint for endJoint in endJoints], k)
+        kmers.append(np.unique(np.concatenate((starts.ravel(), ends.ravel()))))
+    return np.concatenate(kmers) if kmers else np.zeros(0, dtype=np.uint64)
+
+
+class KmerTable:
+    """Number of occurrences of packed k-mers, in an open-addressing hash table (linear probing)
+    of NumPy arrays. A batch of k-mers is added or looked up in rounds: every round moves the
+    k-mers that haven't found their slot yet to the next one."""
+
+    def __init__(self, k, capacity=1024):
+        assert(0 < k <= 32)
+        self.k = k
+        self.size = 0
+        self.allocate(capacity)
+
+    def __len__(self):
+        return self.size
+
+    def allocate(self, capacity):
+        assert(capacity & (capacity - 1) == 0)
+        self.capacity = capacity
+        self.kmers = np.zeros(capacity, dtype=np.uint64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.used = np.zeros(capacity, dtype=bool)
+
+    def slots(self, kmers):
+        # Fibonacci hashing of the packed k-mers, wraps around in uint64
+        bits = self.capacity.bit_length() - 1
+        return ((kmers * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(64 - bits)).astype(np.int64) if bits else np.zeros(len(kmers), dtype=np.int64)
+
+    ### Add ###
+
+    def add(self, kmers, counts=None):
+        kmers = np.asarray(kmers, dtype=np.uint64)
+        counts = np.ones(len(kmers), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        # at most half full
+        if 2 * (self.size + len(kmers)) > self.capacity:
+            self.grow(2 * (self.size + len(kmers)))
+        pending = np.arange(len(kmers))
+        slots = self.slots(kmers)
+        while len(pending):
+            s = slots[pending]
+            # an empty slot goes to one of the k-mers asking for it
+            isEmpty = ~self.used[s]
+            if isEmpty.any():
+                emptySlots, first = np.unique(s[isEmpty], return_index=True)
+                self.kmers[emptySlots] = kmers[pending[isEmpty][first]]
+                self.used[emptySlots] = True
+                self.size += len(emptySlots)
+            isFound = self.kmers[s] == kmers[pending]
+            np.add.at(self.counts, s[isFound], counts[pending[isFound]])
+            pending = pending[~isFound]
+            slots[pending] = (slots[pending] + 1) & (self.capacity - 1)
+
+    def grow(self, minCapacity):
+        kmers, counts = self.kmers[self.used], self.counts[self.used]
+        capacity = self.capacity
+        while capacity < minCapacity:
+            capacity *= 2
+        self.allocate(capacity)
+        self.size = 0
+        self.add(kmers, counts)
+
+    ### Search ###
+
+    def get(self, kmers):
+        # number of occurrences of every k-mer of kmers
+        kmers = np.asarray(kmers, dtype=np.uint64)
+        found = np.zeros(len(kmers), dtype=np.int64)
+        pending = np.arange(len(kmers))
+        slots = self.slots(kmers)
+        while len(pending):
+            s = slots[pending]
+            isFound = self.used[s] & (self.kmers[s] == kmers[pending])
+            found[pending[isFound]] = self.counts[s[isFound]]
+            # an empty slot ends the probe
+            pending = pending[self.used[s] & ~isFound]
+            slots[pending] = (slots[pending] + 1) & (self.capacity - 1)
+        return found
+
+    def repeats(self):
+        # occurrences after the first of every k-mer
+        return int(np.sum(np.maximum(self.counts[self.used] - 1, 0)))
@@ -0,0 +1,278 @@
+import time
+import numpy as np
+from language import nucleotides
+from validation import Validate
+from hammingIndex import HammingIndex
+from keyAutomaton import KeyAutomaton
+from keyAutomaton import reverse_complement
+from kmerTable import KmerTable
+from kmerTable import rolling_kmers
+from kmerTable import junction_kmers
+from hairpinIndex import HairpinIndex
+
+
+class LibraryRepair:
+    """Local search on the keys and payloads of a library that fails validation.
+    Only the elements taking part in a penalty are mutated, by single-base substitutions and,
+    for payloads, by replacement with random payloads. The homopolymer and GC penalties of a
+    mutation come from the validation pre-stats with the old element taken out and the new
+    one counted, the close pairs, keys in payloads and joint repeats from indexes updated the
+    same way. Every payload and joint keeps the number of hairpins it takes part in, and a
+    mutation lists only the hairpins of the changed element, from an index of the k-mers of
+    the library. The whole library is validated once per round, to confirm what the local
+    scores found."""
+
+    def __init__(self, constraints, withConstraints, rng=None, numReplacements=4):
+        # the hairpin memo would be cleared by every mutation
+        self.validate = Validate(constraints, hairpinMemoSize=0)
+        self.withConstraints = withConstraints
+        self.rng = np.random.default_rng(rng)
+        self.numReplacements = numReplacements
+        self.payloadSize = constraints.payloadSize
+        # hairpin count of the library, kept up to date with the recounted hairpins
+        self.hairpinEstimate = 0
+        # accepted mutations
+        self.steps = 0
+        # penalty of the library returned by repair
+        self.penalty = 0
+
+        # isKey -> keys or payloads by Hamming distance and their close pairs
+        self.indexes = {}
+        self.closePairs = {True: 0, False: 0}
+        # keys and joints in the payloads, from the keySize windows of the payloads
+        self.keyAutomaton = None
+        self.payloadWindows = None
+        self.keysInPayloads = 0
+        # junction k-mers of the motifs and their repeats
+        self.junctionKmers = None
+        self.jointRepeats = 0
+        # hairpins of the library and (isKey, payload or joint) -> number of hairpins it takes part in
+        self.hairpinIndex = None
+        self.elemHairpins = {}
+
+    ### Repair ###
+
+    async def repair(self, keys, payloads, maxSeconds=1):
+        # (keys, payloads, True if they pass validation), the best library seen is kept
+        await self.validate.add_keys_and_payloads(set(keys), set(payloads))
+        self.build_indexes()
+        startTime = time.monotonic()
+        penalty = self.full_penalty()
+        best = (penalty, set(self.validate.keys), set(self.validate.payloads))
+        while penalty > 0 and time.monotonic() - startTime <= maxSeconds:
+            offenders = await self.offenders()
+            if not offenders:
+                break
+            for isKey, elem in offenders:
+                if time.monotonic() - startTime > maxSeconds:
+                    break
+                if elem in (self.validate.keys if isKey else self.validate.payloads):
+                    await self.improve(isKey, elem)
+            penalty = self.full_penalty()
+            if penalty < best[0]:
+                best = (penalty, set(self.validate.keys), set(self.validate.payloads))
+        self.penalty, keys, payloads = best
+        return keys, payloads, self.penalty == 0
+
+    async def offenders(self):
+        # (isKey, elem) of the keys and payloads taking part in a penalty, in random order
+        offenders = []
+        for isKey, elems in [(True, self.validate.keys), (False, self.validate.payloads)]:
+            for elem in list(elems):
+                if await self.elem_penalty(isKey, elem) > 0:
+                    offenders.append((isKey, elem))
+        return [offenders[i] for i in self.rng.permutation(len(offenders))]
+
+    async def improve(self, isKey, elem):
+        # replaces elem with one of its best mutations if that doesn't raise the penalty,
+        # moves between mutations of the same penalty let the search leave plateaus
+        elems = self.validate.keys if isKey else self.validate.payloads
+        hairpins = self.elemHairpins.get((isKey, self.hairpin_elem(isKey, elem)), 0)
+        penalty = self.stats_penalty() + self.hairpinEstimate
+        best = []
+        bestPenalty = penalty
+        for newElem in self.mutations(isKey, elem):
+            if newElem in elems:
+                continue
+            await self.replace(isKey, elem, newElem)
+            newHairpins = self.hairpins_with(isKey, newElem)
+            newPenalty = self.stats_penalty() + self.hairpinEstimate - hairpins + newHairpins
+            await self.replace(isKey, newElem, elem)
+            if newPenalty < bestPenalty:
+                best, bestPenalty = [], newPenalty
+            if newPenalty == bestPenalty:
+                best.append((newElem, newHairpins))
+
+        if not best:
+            return False
+        newElem, newHairpins = best[self.rng.integers(len(best))]
+        self.count_hairpins(self.elem_hairpins(isKey, elem), -1)
+        await self.replace(isKey, elem, newElem)
+        self.count_hairpins(self.elem_hairpins(isKey, newElem), 1)
+        self.hairpinEstimate += newHairpins - hairpins
+        self.steps += 1
+        return True
+
+    def mutations(self, isKey, elem):
+        mutations = [elem[:i] + n + elem[i + 1:] for i in range(len(elem)) for n in nucleotides if n != elem[i]]
+        if not isKey:
+            for _ in range(self.numReplacements):
+                mutations.append(''.join(nucleotides[i] for i in self.rng.integers(0, len(nucleotides), self.payloadSize)))
+        return mutations
+
+    async def replace(self, isKey, elem, newElem):
+        # elem is taken out of the library and newElem is counted, None for neither
+        v = self.validate
+        elems, statsElems, add_stats = (v.keys, v.statsKeys, v.add_key_stats) if isKey else (v.payloads, v.statsPayloads, v.add_payload_stats)
+        sequences = self.automaton_sequences()
+        if elem is not None:
+            elems.discard(elem)
+            statsElems.discard(elem)
+            await add_stats(elem, -1)
+            self.remove_from_indexes(isKey, elem)
+        if newElem is not None:
+            elems.add(newElem)
+            statsElems.add(newElem)
+            await add_stats(newElem)
+            self.add_to_indexes(isKey, newElem)
+        if isKey:
+            self.update_joint_indexes(sequences)
+        v.clear_hairpin_memo()
+
+    ### Indexes ###
+
+    def build_indexes(self):
+        # indexes of the penalties of withConstraints, for the library in validate
+        v = self.validate
+        if 'keyDistance' in self.withConstraints:
+            self.indexes[True] = HammingIndex(v.keySize, v.minKeyDistance)
+        if 'payloadDistance' in self.withConstraints:
+            self.indexes[False] = HammingIndex(v.payloadSize, v.minPayloadDistance)
+        for isKey, index in self.indexes.items():
+            self.closePairs[isKey] = 0
+            for elem in (v.keys if isKey else v.payloads):
+                self.closePairs[isKey] += len(index.neighbours(elem))
+                index.add(elem)
+        if 'keyInPayload' in self.withConstraints:
+            self.keyAutomaton = KeyAutomaton(self.automaton_sequences())
+            self.payloadWindows = KmerTable(v.keySize)
+            self.payloadWindows.add(rolling_kmers(v.payloads, v.keySize).ravel())
+            self.keysInPayloads = sum(self.keyAutomaton.count(payload) for payload in v.payloads)
+        if 'jointRepeat' in self.withConstraints:
+            self.junctionKmers = v.junction_kmers_table()
+            self.jointRepeats = self.junctionKmers.repeats()
+        if 'hairpin' in self.withConstraints:
+            self.hairpinIndex = HairpinIndex(v, v.payloads, v.joints)
+            self.elemHairpins = {}
+            self.count_hairpins(self.hairpinIndex.all_hairpins(), 1)
+
+    def automaton_sequences(self):
+        v = self.validate
+        return set(v.keys) | v.joints
+
+    def remove_from_indexes(self, isKey, elem):
+        if isKey in self.indexes:
+            self.indexes[isKey].remove(elem)
+            self.closePairs[isKey] -= len(self.indexes[isKey].neighbours(elem))
+        if self.hairpinIndex is not None:
+            self.hairpinIndex.remove(self.hairpin_elem(isKey, elem), isKey)
+        if isKey:
+            return
+        if self.keyAutomaton is not None:
+            self.keysInPayloads -= self.keyAutomaton.count(elem)
+            windows = rolling_kmers([elem], self.validate.keySize).ravel()
+            self.payloadWindows.add(windows, -np.ones(len(windows), dtype=np.int64))
+        if self.junctionKmers is not None:
+            # a junction k-mer repeats while it is in 2 payloads or more
+            kmers = self.payload_junction_kmers(elem)
+            self.jointRepeats -= int(np.sum(self.junctionKmers.get(kmers) >= 2))
+            self.junctionKmers.add(kmers, -np.ones(len(kmers), dtype=np.int64))
+
+    def add_to_indexes(self, isKey, newElem):
+        if isKey in self.indexes:
+            self.closePairs[isKey] += len(self.indexes[isKey].neighbours(newElem))
+            self.indexes[isKey].add(newElem)
+        if self.hairpinIndex is not None:
+            self.hairpinIndex.add(self.hairpin_elem(isKey, newElem), isKey)
+        if isKey:
+            return
+        if self.keyAutomaton is not None:
+            self.keysInPayloads += self.keyAutomaton.count(newElem)
+            self.payloadWindows.add(rolling_kmers([newElem], self.validate.keySize).ravel())
+        if self.junctionKmers is not None:
+            kmers = self.payload_junction_kmers(newElem)
+            self.jointRepeats += int(np.sum(self.junctionKmers.get(kmers) >= 1))
+            self.junctionKmers.add(kmers)
+
+    def update_joint_indexes(self, oldSequences):
+        # keys and joints have the size of the payload windows, so the keys in payloads only change by
+        # the windows of the sequences that came and went, a new joint changes the junctions of every payload
+        v = self.validate
+        if self.keyAutomaton is not None:
+            sequences = self.automaton_sequences()
+            added, removed = list(sequences - oldSequences), list(oldSequences - sequences)
+            self.keysInPayloads += int(np.sum(self.payloadWindows.get(rolling_kmers(added, v.keySize).ravel())))
+            self.keysInPayloads -= int(np.sum(self.payloadWindows.get(rolling_kmers(removed, v.keySize).ravel())))
+            self.keyAutomaton = KeyAutomaton(sequences)
+        if self.junctionKmers is not None:
+            self.junctionKmers = v.junction_kmers_table()
+            self.jointRepeats = self.junctionKmers.repeats()
+
+    def payload_junction_kmers(self, payload):
+        v = self.validate
+        jointSize = int(v.keySize / 2)
+        return junction_kmers({joint[jointSize:] for joint in v.joints}, {joint[:jointSize] for joint in v.joints}, [payload], v.keySize)
+
+    ### Penalties ###
+
+    async def elem_penalty(self, isKey, elem):
+        # penalty that goes away without elem, its hairpins from the per-elem counts
+        penalty = self.stats_penalty()
+        await self.replace(isKey, elem, None)
+        penalty -= self.stats_penalty()
+        await self.replace(isKey, None, elem)
+        return penalty + self.elemHairpins.get((isKey, self.hairpin_elem(isKey, elem)), 0)
+
+    def stats_penalty(self):
+        # homopolymer and GC penalties of the library from the pre-stats, its close pairs, keys in payloads and joint repeats from the indexes
+        v = self.validate
+        penalty = 0
+        if 'hom' in self.withConstraints:
+            penalty += v.get_motif_and_key_homopolymer_penalty()
+        if 'motifGcContent' in self.withConstraints:
+            penalty += v.get_motif_gc_penalty() + v.get_key_gc_penalty()
+        if 'keyDistance' in self.withConstraints:
+            penalty += self.closePairs[True]
+        if 'payloadDistance' in self.withConstraints:
+            penalty += self.closePairs[False]
+        if 'keyInPayload' in self.withConstraints:
+            penalty += self.keysInPayloads
+        if 'jointRepeat' in self.withConstraints:
+            penalty += self.jointRepeats
+        return penalty
+
+    def hairpins_with(self, isKey, elem):
+        # hairpins elem takes part in, listed from the hairpin index
+        return len(self.elem_hairpins(isKey, elem))
+
+    def elem_hairpins(self, isKey, elem):
+        # hairpins of elem (of its joint for a key) as the sets of (isKey, payload or joint) they cross
+        if self.hairpinIndex is None:
+            return []
+        return self.hairpinIndex.hairpins(self.hairpin_elem(isKey, elem), isKey)
+
+    def hairpin_elem(self, isKey, elem):
+        # payload or joint of a key in the hairpins
+        return reverse_complement(elem) if isKey else elem
+
+    def count_hairpins(self, hairpins, count):
+        # adds count to the hairpins of every elem a hairpin crosses
+        for hairpin in hairpins:
+            for member in hairpin:
+                self.elemHairpins[member] = self.elemHairpins.get(member, 0) + count
+                if self.elemHairpins[member] == 0:
+                    del self.elemHairpins[member]
+
+    def full_penalty(self):
+        self.hairpinEstimate = self.validate.get_motif_and_key_hairpin_penalty() if 'hairpin' in self.withConstraints else 0
+        return self.stats_penalty() + self.hairpinEstimate
@@ -3,12 +3,18 @@ from constraints import Constraints
 from validation import Validate
 from hyperparameters import Hyperparameters
 from language import nucleotides
+from nucleotideSampler import NucleotideSampler
+from populationBuilder import PopulationBuilder
+from exactSampler import ExactPayloadSampler
+from beamPayloadSearch import BeamPayloadSearch
+from packedSequences import PackedSequenceSet
 
+import time
 import numpy as np
 
 
 class MotifBuilder:
-    def __init__(self, constraints, hyperparameters, weights):
+    def __init__(self, constraints, hyperparameters, weights, seed=None, prefixTrieSize=0):
         self.keySize = constraints.keySize
         self.constraints = constraints
 
@@ -19,7 +25,10 @@ class MotifBuilder:
         self.payloadSize = constraints.payloadSize
        # self.motifSize = constraints.motifSize
 
-        self.penalties = BasePayloadPenalties(constraints, hyperparameters)
+        self.penalties = BasePayloadPenalties(constraints, hyperparameters, prefixTrieSize=prefixTrieSize)
+        self.sampler = NucleotideSampler(seed)
+        # prefixes expanded by the last buildAllPayloadsBeam
+        self.expandedNodes = 0
         
     async def add_joints(self, joints):
         await self.penalties.add_joints(joints)
@@ -27,45 +36,36 @@ class MotifBuilder:
     ### Build Payload ###
 
     async def buildPayload(self, withConstraints):
+        payload = await self.drawPayload(withConstraints)
+        await self.penalties.add_payload(payload)
+        return payload
+
+    async def drawPayload(self, withConstraints):
+        # payload built against the current library, without adding it
         payload = ''
+        self.penalties.start_new_payload()
 
         for _ in range(self.payloadSize):
             
-            constraintPenalties = {}
             # 'hom', 'hairpin', 'motifGcContent'
-            for constraint in withConstraints:
-                constraintPenalties[constraint] = []
-
-            for n in nucleotides:
-                for constraint in constraintPenalties:
-                    if constraint == 'hom':
-                        homPenalty = self.penalties.get_homopolymer_penalty(payload, n)
-                        constraintPenalties[constraint].append(homPenalty)
-                    elif constraint == 'hairpin':
-                        hairpinPenalty = self.penalties.get_hairpin_penalty(payload, n)
-                        constraintPenalties[constraint].append(hairpinPenalty)
-                    elif constraint == 'motifGcContent':
-                        motifGcPenalty = self.penalties.get_gc_penalty(payload, n)
-                        constraintPenalties[constraint].append(motifGcPenalty)
-            
-            for constraint in constraintPenalties:
-                constraintPenalties[constraint] = np.array(constraintPenalties[constraint])
-            
-            if not withConstraints:
+            # constraints without extension penalties don't weigh on the draw
+            constraints = [constraint for constraint in withConstraints if constraint in self.penalties.extensionPenalties]
+            constraintPenalties = self.penalties.score_extensions(payload, constraints)
+
+            if not constraints:
                 p = [0.25, 0.25, 0.25, 0.25]
             else:
                 lp = 0
-                for constraint in constraintPenalties:
+                for i, constraint in enumerate(constraints):
                     weight = self.weights[constraint]
-                    lp -= 1.0 * weight * constraintPenalties[constraint]
+                    lp -= 1.0 * weight * constraintPenalties[:, i]
                 p = np.exp(lp)
-                p /= p.sum()
+                p = (p / p.sum()).tolist()
 
-            new_nucleotide = np.random.choice(nucleotides, p=p)
+            new_nucleotide = self.sampler.choose(p)
 
             payload += new_nucleotide
-
-        await self.penalties.add_payload(payload)
+            await self.penalties.add_base(new_nucleotide)
 
         return payload
     
@@ -76,6 +76,65 @@ class MotifBuilder:
             allPayloads.add(payload)
         return allPayloads
 
+    async def buildAllUniquePayloads(self, withConstraints, maxAttempts=-1, maxSeconds=-1):
+        # draws until payloadNum distinct valid payloads are built or the attempt/time budget runs out
+        if maxAttempts < 0:
+            maxAttempts = 10 * self.payloadNum
+        startTime = time.monotonic()
+        seen = PackedSequenceSet(self.penalties.payloads)
+        allPayloads = set()
+        for _ in range(maxAttempts):
+            if len(allPayloads) == self.payloadNum or (maxSeconds >= 0 and time.monotonic() - startTime > maxSeconds):
+                break
+            payload = await self.drawPayload(withConstraints)
+            if seen.add(payload) and self.penalties.is_valid(payload, withConstraints):
+                allPayloads.add(payload)
+                await self.penalties.add_payload(payload)
+        return allPayloads
+
+    async def buildAllPayloadsBatch(self, withConstraints, populationSize=-1, maxPopulations=10):
+        # grows populations of candidates in lockstep until payloadNum distinct payloads are found
+        if populationSize < 0:
+            populationSize = max(4 * self.payloadNum, 256)
+        populationBuilder = PopulationBuilder(self.penalties, self.weights, self.sampler.rng)
+        allPayloads = []
+        for _ in range(maxPopulations):
+            payloads, scores = populationBuilder.build(withConstraints, populationSize)
+            allPayloads += populationBuilder.select(payloads, scores, self.payloadNum - len(allPayloads), self.penalties.payloads | set(allPayloads))
+            if len(allPayloads) == self.payloadNum:
+                break
+        await self.penalties.add_payloads(allPayloads)
+        return set(allPayloads)
+
+    async def buildAllPayloadsExact(self, maxAttempts=-1):
+        # payloads drawn uniformly from the ones meeting the homopolymer and GC limits, see ExactPayloadSampler
+        if maxAttempts < 0:
+            maxAttempts = 100 * self.payloadNum
+        exactSampler = ExactPayloadSampler(self.penalties, self.sampler.rng)
+        allPayloads = set()
+        for _ in range(maxAttempts):
+            payload = exactSampler.sample()
+            if payload is None:
+                break
+            if payload not in self.penalties.payloads:
+                allPayloads.add(payload)
+                await self.penalties.add_payload(payload)
+            if len(allPayloads) == self.payloadNum:
+                break
+        return allPayloads
+
+    async def buildAllPayloadsBeam(self, withConstraints, beamWidth=8):
+        # payloads built by beam search, see BeamPayloadSearch; stops early once a search finds nothing new
+        beamSearch = BeamPayloadSearch(self.penalties, self.weights, self.sampler.rng, beamWidth)
+        allPayloads = set()
+        for _ in range(self.payloadNum):
+            payload = beamSearch.search(withConstraints, self.penalties.payloads)
+            if payload is None:
+                break
+            allPayloads.add(payload)
+            await self.penalties.add_payload(payload)
+        self.expandedNodes = beamSearch.expanded
+        return allPayloads
 
 async def main():
     payloadSize = 8
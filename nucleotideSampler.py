@@ -0,0 +1,33 @@
+import numpy as np
+from language import nucleotides
+
+
+class NucleotideSampler:
+    # draws nucleotides from a seedable numpy Generator, uniforms are drawn blockSize at a time
+    def __init__(self, seed=None, blockSize=1024):
+        assert(blockSize > 0)
+        self.rng = np.random.default_rng(seed)
+        self.blockSize = blockSize
+        self.uniforms = []
+        self.uniformIndex = 0
+
+    def uniform(self):
+        if self.uniformIndex == len(self.uniforms):
+            self.uniforms = self.rng.random(self.blockSize).tolist()
+            self.uniformIndex = 0
+        u = self.uniforms[self.uniformIndex]
+        self.uniformIndex += 1
+        return u
+
+    def choose(self, p):
+        # p: probability of every nucleotide, in the order of nucleotides
+        u = self.uniform()
+        cumulative = 0
+        for n, pn in zip(nucleotides, p):
+            cumulative += pn
+            if u < cumulative:
+                return n
+        # rounding left u above the last cumulative probability
+        for n, pn in zip(reversed(nucleotides), reversed(p)):
+            if pn > 0:
+                return n
@@ -0,0 +1,51 @@
+from language import nucleotides
+
+# 2 bits per nucleotide, index in language.nucleotides; the converse of code i is i ^ 1
+nucleotideCodes = {n: i for i, n in enumerate(nucleotides)}
+
+
+def pack_sequence(sequence):
+    # leading 1 bit so that sequences of different lengths never share a code
+    code = 1
+    for n in sequence:
+        code = (code << 2) | nucleotideCodes[n]
+    return code
+
+def unpack_sequence(code):
+    sequence = []
+    while code > 1:
+        sequence.append(nucleotides[code & 3])
+        code >>= 2
+    return ''.join(reversed(sequence))
+
+
+class PackedSequenceSet:
+    # set of sequences stored as packed integers
+    def __init__(self, sequences=()):
+        self.codes = set()
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, sequence):
+        return pack_sequence(sequence) in self.codes
+
+    def __iter__(self):
+        return (unpack_sequence(code) for code in self.codes)
+
+    def add(self, sequence):
+        # True if sequence was not in the set yet
+        code = pack_sequence(sequence)
+        if code in self.codes:
+            return False
+        self.codes.add(code)
+        return True
+
+    def add_prefixes(self, sequence):
+        # every non-empty prefix of sequence, packed incrementally
+        code = 1
+        for n in sequence:
+            code = (code << 2) | nucleotideCodes[n]
+            self.codes.add(code)
@@ -1,7 +1,11 @@
+import itertools
 import pytest
 import basePayloadPenalties as bp
 import constraints as c
 import hyperparameters as h
+from language import nucleotides
+from keyAutomaton import reverse_complement
+from validation import Validate
 
 
 def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=2, payloadNum=5, maxHom=1, minGC=25, maxGC=60):
@@ -106,6 +110,27 @@ async def test_gc_empty_returns_keys_gc_within_bounds():
     result = 0
     assert result == gcScore
 
+@pytest.mark.asyncio
+async def test_gc_penalties_of_all_nucleotides_follow_added_bases():
+    minGC = 30
+    maxGC = 50
+    keySize = 4
+    payloadSize = 8
+    constraints = get_constraints(minGC=minGC, maxGC=maxGC, keySize=keySize, payloadSize=payloadSize)
+    hyperparams = get_hyperparameters()
+    joints = {'AGTG', 'ACCT'}
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, hyperparams)
+    await basePayloadPenalties.add_joints(joints)
+    basePayloadPenalties.start_new_payload()
+    payload = ''
+    for newBase in 'GGCATTAC':
+        gcScores = basePayloadPenalties.get_gc_penalties(payload)
+        result = [basePayloadPenalties.motif_GC_content_penalty(payload + n) for n in nucleotides]
+        assert result == gcScores
+        payload += newBase
+        await basePayloadPenalties.add_base(newBase)
+    assert basePayloadPenalties.curGcCount == 4
+
 @pytest.mark.asyncio
 async def test_gc_edge_min():
     minGC = 20
@@ -316,6 +341,26 @@ async def test_hom_with_full_key_start_with_itself_and_other_payloads():
     result = get_score(9, homHyperparam, maxHom) * 3
     assert result == homScore
 
+@pytest.mark.asyncio
+async def test_hom_run_lengths_are_counted_once_per_length():
+    maxHom = 2
+    homHyperparam = 5
+    keySize = 4
+    payloadSize = 6
+    constraints = get_constraints(maxHom=maxHom, keySize=keySize, payloadSize=payloadSize)
+    hyperparams = get_hyperparameters(homHyperparam=homHyperparam)
+    joints = {'AAAA', 'GGCC'}
+    payloads = {'AGAATA', 'AGAACA', 'ACATGA', 'TTAGCA'}
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, hyperparams)
+    await basePayloadPenalties.add_joints(joints)
+    await basePayloadPenalties.add_payloads(payloads)
+    assert basePayloadPenalties.startHomPayload['A'] == {1: 3}
+    assert basePayloadPenalties.endHomPayload['A'] == {1: 4}
+    curPayload = 'AGAAAA'
+    homScore = basePayloadPenalties.homopolymer_penalty(curPayload)
+    result = get_score(9, homHyperparam, maxHom) * 4
+    assert result == pytest.approx(homScore)
+
 @pytest.mark.asyncio
 async def test_hom_full_motif():
     maxHom = 2
@@ -868,3 +913,147 @@ async def test_forward_stem1_in_payload1_stem2_in_payload12_and_payload2():
     hairpinScore = basePayloadPenalties.forward_hairpin_counter(curPayload, payloads, joints)
     result = get_score(4, hairpinHyperparam, maxHairpin) * 2
     assert result == hairpinScore
+
+###### Hyperparameter powers tests ######
+
+@pytest.mark.asyncio
+async def test_power_tables_match_direct_computation():
+    constraints = get_constraints(maxHairpin=3, loopSize=2, payloadSize=8, keySize=4, maxHom=2)
+    joints = {'AAAA', 'ATCA', 'GGAT', 'CTTC'}
+    payloads = {'TATAAGGA', 'AAGCTTAA', 'CCATCGGT'}
+    scores = []
+    for precomputePowers in [True, False]:
+        hyperparams = get_hyperparameters(hairpinHyperparam=3, homHyperparam=7)
+        basePayloadPenalties = bp.BasePayloadPenalties(constraints, hyperparams, precomputePowers=precomputePowers)
+        await basePayloadPenalties.add_joints(joints)
+        await basePayloadPenalties.add_payloads(payloads)
+        curScores = []
+        for curPayload in ['A', 'AAA', 'TAAGC', 'AGGTAAAA', 'ACGTTTTT', 'CCCCCCCC']:
+            curScores.append(basePayloadPenalties.get_all_penalties(curPayload[:-1], curPayload[-1]))
+        hyperparams.hom.give_hyperparameter(2)
+        curScores.append(basePayloadPenalties.get_homopolymer_penalty('AAA', 'A'))
+        scores.append(curScores)
+    assert scores[0] == scores[1]
+
+###### Extension scores tests ######
+
+@pytest.mark.asyncio
+async def test_score_extensions_match_single_penalties():
+    constraints = get_constraints(maxHairpin=3, loopSize=2, payloadSize=8, keySize=4, maxHom=2)
+    hyperparams = get_hyperparameters()
+    joints = {'AAAA', 'ATCA', 'GGAT', 'CTTC'}
+    payloads = {'TATAAGGA', 'AAGCTTAA'}
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, hyperparams)
+    await basePayloadPenalties.add_joints(joints)
+    await basePayloadPenalties.add_payloads(payloads)
+    for payload in ['', 'A', 'TAA', 'TAAGCT', 'CCATCGG']:
+        scores = basePayloadPenalties.score_extensions(payload, ['hom', 'hairpin', 'motifGcContent'])
+        assert scores.shape == (4, 3)
+        for i, n in enumerate(nucleotides):
+            assert basePayloadPenalties.get_homopolymer_penalty(payload, n) == pytest.approx(scores[i, 0])
+            assert basePayloadPenalties.get_hairpin_penalty(payload, n) == pytest.approx(scores[i, 1])
+            assert basePayloadPenalties.get_gc_penalty(payload, n) == pytest.approx(scores[i, 2])
+
+###### Prefix trie tests ######
+
+@pytest.mark.asyncio
+async def test_prefix_trie_matches_uncached_scores():
+    constraints = get_constraints(maxHairpin=3, loopSize=2, payloadSize=8, keySize=4, maxHom=2)
+    joints = {'AAAA', 'ATCA', 'GGAT', 'CTTC'}
+    scores = []
+    for prefixTrieSize in [0, 50]:
+        basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters(), prefixTrieSize=prefixTrieSize)
+        await basePayloadPenalties.add_joints(joints)
+        curScores = []
+        for newPayload in ['TATAAGGA', 'TATCCGGA', 'AAGCTTAA']:
+            for i in range(len(newPayload)):
+                curScores.append(basePayloadPenalties.score_extensions(newPayload[:i], ['hom', 'hairpin', 'motifGcContent']).tolist())
+            await basePayloadPenalties.add_payload(newPayload)
+        scores.append(curScores)
+    assert scores[0] == scores[1]
+
+@pytest.mark.asyncio
+async def test_prefix_trie_recomputes_only_hairpins_after_new_payload():
+    constraints = get_constraints(maxHairpin=3, loopSize=2, payloadSize=8, keySize=4, maxHom=2)
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters(), prefixTrieSize=50)
+    await basePayloadPenalties.add_joints({'ATCA', 'GGAT', 'CTTC'})
+    basePayloadPenalties.score_extensions('TAA', ['hom', 'hairpin', 'motifGcContent'])
+    await basePayloadPenalties.add_payload('TATAAGGA')
+    prefixTrie = basePayloadPenalties.prefixTrie
+    prefixTrie.hits, prefixTrie.misses = 0, 0
+    scores = basePayloadPenalties.score_extensions('TAA', ['hom', 'hairpin', 'motifGcContent'])
+    assert (prefixTrie.hits, prefixTrie.misses) == (2, 1)
+    for i, n in enumerate(nucleotides):
+        assert basePayloadPenalties.get_hairpin_penalty('TAA', n) == pytest.approx(scores[i, 1])
+
+@pytest.mark.asyncio
+async def test_prefix_trie_is_bounded():
+    constraints = get_constraints(maxHairpin=3, loopSize=2, payloadSize=8, keySize=4, maxHom=2)
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters(), prefixTrieSize=10)
+    await basePayloadPenalties.add_joints({'ATCA', 'GGAT', 'CTTC'})
+    for newPayload in ['TATAAGGA', 'CCATCGGT', 'AAGCTTAA']:
+        for i in range(len(newPayload)):
+            basePayloadPenalties.score_extensions(newPayload[:i], ['hom', 'motifGcContent'])
+            assert len(basePayloadPenalties.prefixTrie) <= 10
+
+###### Payload distance tests ######
+
+@pytest.mark.asyncio
+async def test_payload_distance_scores_follow_added_payloads():
+    constraints = c.Constraints(6, 5, 2, 2, 1, 25, 60, 2, minPayloadDistance=3)
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters(), prefixTrieSize=100)
+    assert basePayloadPenalties.score_extensions('TCTTA', ['payloadDistance'])[:, 0].tolist() == [0, 0, 0, 0]
+    await basePayloadPenalties.add_payload('ACGTAC')
+    # TCTTA is 2 bases away from ACGTA, only C keeps it fewer than 3 away from ACGTAC
+    assert basePayloadPenalties.score_extensions('TCTTA', ['payloadDistance'])[:, 0].tolist() == [0, 0, 1, 0]
+    assert not basePayloadPenalties.is_valid('TCTTAC', {'payloadDistance'})
+    assert basePayloadPenalties.is_valid('TCTTAA', {'payloadDistance'})
+
+###### Key in payload tests ######
+
+@pytest.mark.asyncio
+async def test_key_in_payload_scores_follow_the_automaton():
+    constraints = c.Constraints(8, 5, 2, 2, 1, 25, 60, 4)
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, h.Hyperparameters({'keyInPayload': 3}))
+    # keys: ACGT, GCAA
+    await basePayloadPenalties.add_joints({'ACGT', 'TTGC'})
+    for i in range(5):
+        expected = [0, 3, 0, 0] if i == 4 else [0, 0, 0, 0]
+        assert basePayloadPenalties.score_extensions('AAACG'[:i + 1], ['keyInPayload'])[:, 0].tolist() == expected
+    # not an extension of the last prefix
+    assert basePayloadPenalties.score_extensions('GCA', ['keyInPayload'])[:, 0].tolist() == [3, 0, 0, 0]
+    assert not basePayloadPenalties.is_valid('TTGCATAT', {'keyInPayload'})
+    assert basePayloadPenalties.is_valid('ATATATAT', {'keyInPayload'})
+
+###### Joint repeat tests ######
+
+@pytest.mark.asyncio
+async def test_joint_repeat_scores_follow_added_junctions():
+    constraints = c.Constraints(6, 5, 2, 2, 1, 25, 60, 4)
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters())
+    # motifs GT + payload + AC
+    await basePayloadPenalties.add_joints({'ACGT'})
+    # junction k-mers: GTCA, TCAT, AGCA, GCAC
+    await basePayloadPenalties.add_payload('CATAGC')
+    assert basePayloadPenalties.score_extensions('C', ['jointRepeat'])[:, 0].tolist() == [1, 0, 0, 0]
+    assert basePayloadPenalties.score_extensions('CA', ['jointRepeat'])[:, 0].tolist() == [0, 1, 0, 0]
+    assert basePayloadPenalties.score_extensions('CAG', ['jointRepeat'])[:, 0].tolist() == [0, 0, 0, 0]
+    assert basePayloadPenalties.score_extensions('GGGAG', ['jointRepeat'])[:, 0].tolist() == [0, 0, 2, 0]
+    assert not basePayloadPenalties.is_valid('CATGGG', {'jointRepeat'})
+    assert basePayloadPenalties.is_valid('AAAAAA', {'jointRepeat'})
+
+###### Validity tests ######
+
+@pytest.mark.asyncio
+async def test_is_valid_homopolymers_match_validation():
+    constraints = c.Constraints(6, 1, 2, 2, 1, 0, 100, 4)
+    keys = {'AATG', 'GCCT', 'TTAC'}
+    basePayloadPenalties = bp.BasePayloadPenalties(constraints, get_hyperparameters())
+    # motifs TT/GC/AA + payload + CA/AG/GT
+    await basePayloadPenalties.add_joints({reverse_complement(key) for key in keys})
+    assert not basePayloadPenalties.is_valid('TTCAGC', {'hom'})
+    for payload in itertools.product(nucleotides, repeat=constraints.payloadSize):
+        payload = ''.join(payload)
+        validate = Validate(constraints, hairpinMemoSize=0)
+        await validate.add_keys_and_payloads(set(keys), {payload})
+        assert basePayloadPenalties.is_valid(payload, {'hom'}) == (validate.get_motif_and_key_homopolymer_penalty() == 0)
@@ -0,0 +1,120 @@
+import numpy as np
+from language import nucleotides
+
+# payloads are uint8 indices into language.nucleotides (the converse of i is i ^ 1),
+# ASCII byte of every index to decode them
+nucleotideBytes = np.frombuffer(''.join(nucleotides).encode(), dtype=np.uint8)
+isGc = np.array([n in ['G', 'C'] for n in nucleotides])
+
+
+class PopulationBuilder:
+    """Grows a population of candidate payloads in lockstep, as an N x payloadSize
+    uint8 matrix. At every position the homopolymer, GC and hairpin-within-payload
+    penalties of all candidates and all four bases are array operations; the
+    candidates with the lowest summed penalties are then taken into the library."""
+
+    def __init__(self, penalties, weights, rng):
+        self.penalties = penalties
+        self.weights = weights
+        self.rng = rng
+
+    ### Build ###
+
+    def build(self, withConstraints, populationSize):
+        # -> (payloads, summed penalties of the chosen bases)
+        p = self.penalties
+        constraints = list(withConstraints)
+        payloads = np.zeros((populationSize, p.payloadSize), dtype=np.uint8)
+        scores = np.zeros(populationSize)
+        homs = np.zeros(populationSize, dtype=np.int64)
+        gcCounts = np.zeros(populationSize, dtype=np.int64)
+        rows = np.arange(populationSize)
+        homPowers = self.hom_powers()
+
+        for pos in range(p.payloadSize):
+            lp = np.zeros((populationSize, len(nucleotides)))
+            for constraint in constraints:
+                if constraint == 'hom':
+                    constraintPenalties = self.homopolymer_penalties(payloads, homs, pos, homPowers)
+                elif constraint == 'hairpin':
+                    constraintPenalties = self.hairpin_penalties(payloads, pos)
+                elif constraint == 'motifGcContent':
+                    constraintPenalties = self.gc_penalties(gcCounts, pos)
+                else:
+                    # no batch penalty for this constraint
+                    continue
+                lp -= 1.0 * self.weights[constraint] * constraintPenalties
+
+            # softmax over the four bases, then one uniform per candidate
+            probabilities = np.exp(lp - lp.max(axis=1, keepdims=True))
+            cumulative = np.cumsum(probabilities, axis=1)
+            u = self.rng.random(populationSize) * cumulative[:, -1]
+            newBases = np.minimum((u[:, None] >= cumulative).sum(axis=1), len(nucleotides) - 1).astype(np.uint8)
+
+            scores -= lp[rows, newBases]
+            if pos > 0:
+                homs = np.where(payloads[:, pos - 1] == newBases, homs + 1, 1)
+            else:
+                homs[:] = 1
+            gcCounts += isGc[newBases]
+            payloads[:, pos] = newBases
+
+        return payloads, scores
+
+    def select(self, payloads, scores, payloadNum, exclude=set()):
+        # distinct payloads not in exclude, lowest summed penalties first
+        selected = []
+        seen = set(exclude)
+        for i in np.argsort(scores, kind='stable'):
+            payload = self.decode(payloads[i])
+            if payload in seen:
+                continue
+            seen.add(payload)
+            selected.append(payload)
+            if len(selected) == payloadNum:
+                break
+        return selected
+
+    def decode(self, payload):
+        return nucleotideBytes[payload].tobytes().decode()
+
+    ### Penalties of the four bases at pos ###
+
+    def hom_powers(self):
+        # homopolymer penalty of every run length up to payloadSize
+        p = self.penalties
+        return np.array([p.homPowers.power(k) for k in range(p.payloadSize + 1)])
+
+    def homopolymer_penalties(self, payloads, homs, pos, powers=None):
+        if powers is None:
+            powers = self.hom_powers()
+        newHoms = np.ones((len(payloads), len(nucleotides)), dtype=np.int64)
+        if pos > 0:
+            isSame = payloads[:, pos - 1, None] == np.arange(len(nucleotides))
+            newHoms[isSame] = (homs + 1)[np.nonzero(isSame)[0]]
+        return powers[newHoms]
+
+    def gc_penalties(self, gcCounts, pos):
+        p = self.penalties
+        gcCount = gcCounts[:, None] + isGc[None, :]
+        curMotifSize = pos + 1 + p.keySize
+        weight = curMotifSize / p.motifSize
+        minGcContent = (100 * (gcCount + p.minJointsGcCount)) / curMotifSize
+        maxGcContent = (100 * (gcCount + p.maxJointsGcCount)) / curMotifSize
+        return np.maximum(np.maximum(weight * (p.minGc - minGcContent), weight * (maxGcContent - p.maxGc)), 0)
+
+    def hairpin_penalties(self, payloads, pos):
+        # whole stems closed by the base at pos, stem1 and stem2 both inside the payload
+        p = self.penalties
+        maxHairpin = p.maxHairpin
+        hairpins = np.zeros((len(payloads), len(nucleotides)))
+        for loopSize in range(p.loopSizeMin, p.loopSizeMax + 1):
+            stem1Start = pos - 2 * maxHairpin - loopSize + 1
+            if stem1Start < 0:
+                continue
+            stem1 = payloads[:, stem1Start + 1:stem1Start + maxHairpin]
+            stem2 = payloads[:, pos - np.arange(1, maxHairpin)] ^ 1
+            isStem = np.all(stem1 == stem2, axis=1)
+            closes = payloads[:, stem1Start, None] == (np.arange(len(nucleotides)) ^ 1)
+            hairpins += isStem[:, None] & closes
+        return hairpins * p.hairpinPowers.power(maxHairpin)
@@ -0,0 +1,63 @@
+class PrefixNode:
+    __slots__ = ('children', 'scores')
+
+    def __init__(self):
+        self.children = {}
+        # constraint -> (version of the penalties state the scores were computed with, scores)
+        self.scores = {}
+
+
+class PrefixTrie:
+    # prefixes visited while building payloads, with the extension scores computed for them.
+    # Dropped as a whole once a walk could take it over maxNodes
+    def __init__(self, maxNodes):
+        assert(maxNodes > 0)
+        self.maxNodes = maxNodes
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def __len__(self):
+        return self.numNodes
+
+    def clear(self):
+        self.root = PrefixNode()
+        self.numNodes = 1
+        self.cursorPrefix = ''
+        self.cursor = self.root
+
+    def node(self, prefix):
+        # a payload grows one base at a time, so the walk usually starts at the last node
+        if prefix == self.cursorPrefix:
+            return self.cursor
+        isChild = len(prefix) == len(self.cursorPrefix) + 1 and prefix.startswith(self.cursorPrefix)
+        if self.numNodes + (1 if isChild else len(prefix)) > self.maxNodes:
+            self.clear()
+            isChild = len(prefix) == 1
+
+        if isChild:
+            node = self.child(self.cursor, prefix[-1])
+        else:
+            node = self.root
+            for n in prefix:
+                node = self.child(node, n)
+        self.cursorPrefix = prefix
+        self.cursor = node
+        return node
+
+    def child(self, node, n):
+        if n not in node.children:
+            node.children[n] = PrefixNode()
+            self.numNodes += 1
+        return node.children[n]
+
+    def get(self, node, constraint, version):
+        cached = node.scores.get(constraint)
+        if cached is None or cached[0] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached[1]
+
+    def put(self, node, constraint, version, scores):
+        node.scores[constraint] = (version, scores)
@@ -0,0 +1,157 @@
+import numpy as np
+from language import converse
+from vectorizedHairpin import VectorizedHairpinCounter
+
+# stem indexes kept by a counter (payloads, joints, keys, ...)
+maxIndexedSets = 8
+
+
+def cur_option(curElem, stem, offset, hasLastPair):
+    # curElem itself as the elem crossed by stem2
+    numSkipped = 0
+    for q, nuc in enumerate(stem):
+        if offset + q >= len(curElem):
+            numSkipped += 1
+        elif curElem[offset + q] != nuc:
+            return (0, 0)
+    # the last pair of stem2 must be compared for the hairpin to be counted
+    if hasLastPair and stem and offset + len(stem) - 1 >= len(curElem):
+        return (0, 0)
+    return (1, numSkipped)
+
+def combine_options(skipped, options):
+    # options of one crossed elem: (number of elems, number of skipped pairs)
+    nextSkipped = {}
+    for numElems, numSkipped in options:
+        if numElems == 0:
+            continue
+        for s, count in skipped.items():
+            nextSkipped[s + numSkipped] = nextSkipped.get(s + numSkipped, 0) + count * numElems
+    return nextSkipped
+
+
+class StemIndex:
+    # number of elems having a k-mer (k <= maxHairpin) at a given offset
+    def __init__(self, elems, maxHairpin):
+        self.elems = elems
+        self.maxHairpin = maxHairpin
+        self.members = set()
+        self.lengths = set()
+        self.stems = {}
+        for elem in elems:
+            self.add(elem)
+
+    def add(self, elem):
+        if elem in self.members:
+            return
+        self.members.add(elem)
+        self.lengths.add(len(elem))
+        for offset in range(len(elem)):
+            for end in range(offset + 1, min(offset + self.maxHairpin, len(elem)) + 1):
+                stem = (offset, elem[offset:end])
+                self.stems[stem] = self.stems.get(stem, 0) + 1
+
+    def count(self, offset, stem):
+        return self.stems.get((offset, stem), 0)
+
+    def is_index_of(self, elems):
+        return elems is self.elems and len(elems) == len(self.members)
+
+    def has_only_size(self, size):
+        return not self.lengths or self.lengths == {size}
+
+
+class IndexedHairpinCounter(VectorizedHairpinCounter):
+    """Hairpins whose stem1 lies in the current elem are counted by looking up,
+    for every payload/joint crossed by stem2, how many indexed elems carry the
+    reverse complement of stem1 there. The other windows use the vectorized walk."""
+
+    def __init__(self, penalties):
+        VectorizedHairpinCounter.__init__(self, penalties)
+        self.indexes = {}
+
+    ### Index ###
+
+    def index(self, elems):
+        stemIndex = self.indexes.get(id(elems))
+        if stemIndex is None or stemIndex.elems is not elems:
+            if len(self.indexes) >= maxIndexedSets:
+                self.indexes.clear()
+            stemIndex = StemIndex(elems, self.penalties.maxHairpin)
+            self.indexes[id(elems)] = stemIndex
+        elif not stemIndex.is_index_of(elems):
+            for elem in elems:
+                stemIndex.add(elem)
+        return stemIndex
+
+    def add_elem(self, elems, newElem):
+        stemIndex = self.indexes.get(id(elems))
+        if stemIndex is not None and stemIndex.elems is elems:
+            stemIndex.add(newElem)
+
+    ### Counters ###
+
+    def hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, direction):
+        p = self.penalties
+        if loopSizeMin < 0 or loopSizeMax < 0:
+            loopSizeMin = p.loopSizeMin
+            loopSizeMax = p.loopSizeMax
+
+        elem1Size = p.keySize if isKey else p.payloadSize
+        elem2Size = p.payloadSize if isKey else p.keySize
+        index1 = self.index(elems1)
+        index2 = self.index(elems2)
+        isIndexed = 0 <= stem1Start and stem1Start + p.maxHairpin <= elem1Size and len(curElem) <= elem1Size \
+            and index1.has_only_size(elem1Size) and index2.has_only_size(elem2Size)
+
+        for loopSize in range(loopSizeMin, loopSizeMax + 1):
+            stem2Start = stem1Start + direction * (loopSize + p.maxHairpin)
+            hairpinLengths = self.indexed_hairpin_lengths(curElem, index1, index2, elem1Size, stem1Start, stem2Start) if isIndexed else None
+            if hairpinLengths is None:
+                VectorizedHairpinCounter.hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSize, loopSize, direction)
+            elif hairpinLengths:
+                self.hairpinLengths = hairpinLengths
+                hairpins.append(self.hairpins_total(hairpinCount))
+
+        return np.sum(np.array(hairpins))
+
+    def indexed_hairpin_lengths(self, curElem, index1, index2, elem1Size, stem1Start, stem2Start):
+        # stem1 is in curElem; its bases past len(curElem) are not known yet and are not compared
+        motifSize = self.penalties.motifSize
+        maxHairpin = self.penalties.maxHairpin
+        numKnown = min(maxHairpin, len(curElem) - stem1Start)
+        stem2End = stem2Start + maxHairpin
+        firstKnown = stem2End - numKnown
+
+        # (number of pairs skipped because curElem is too short) -> number of hairpins
+        skipped = {0: 1}
+        pos = stem2Start
+        while pos < stem2End:
+            elemStart = pos - pos % motifSize
+            isElem2 = pos % motifSize >= elem1Size
+            if isElem2:
+                end = min(stem2End, elemStart + motifSize)
+                if not index2.members:
+                    return None
+            else:
+                end = min(stem2End, elemStart + elem1Size)
+
+            # stem2 bases needed to pair with the known part of stem1
+            stem = ''.join(converse[curElem[stem1Start + stem2End - 1 - q]] for q in range(max(pos, firstKnown), end))
+            options = []
+            if isElem2:
+                numElems = index2.count(max(pos, firstKnown) - elemStart - elem1Size, stem) if stem else len(index2.members)
+                options.append((numElems, 0))
+            else:
+                if elemStart != 0:
+                    numElems = index1.count(max(pos, firstKnown) - elemStart, stem) if stem else len(index1.members)
+                    options.append((numElems, 0))
+                options.append(cur_option(curElem, stem, max(pos, firstKnown) - elemStart, end == stem2End))
+
+            skipped = combine_options(skipped, options)
+            if not skipped:
+                return {}
+            pos = end
+
+        return {numKnown - s: count for s, count in skipped.items()}
+
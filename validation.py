@@ -1,12 +1,17 @@
 from language import nucleotides
 from language import converse
 import numpy as np
+from collections import Counter
 from basePenalties import BasePenalties
+from hammingIndex import HammingIndex
+from keyAutomaton import KeyAutomaton
+from kmerTable import KmerTable
+from kmerTable import junction_kmers
 
 class Validate (BasePenalties):
     # 0 is good, score < 0 if bad
-    def __init__(self, constraints):
-        BasePenalties.__init__(self, constraints)
+    def __init__(self, constraints, hairpinEngine='recursive', hairpinMemoSize=100000):
+        BasePenalties.__init__(self, constraints, hairpinEngine=hairpinEngine, hairpinMemoSize=hairpinMemoSize)
 
         # Keys
         self.keys = set()
@@ -14,19 +19,8 @@ class Validate (BasePenalties):
         # Payloads
         self.payloads = set()
 
-        # Joints
-        self.joints = set()
-        self.startJointHom = {'A':[], 'T':[], 'C':[], 'G':[]}
-        self.endJointHom = {'A':[], 'T':[], 'C':[], 'G':[]}
-        self.wholeJointHom = {'A':0, 'T':0, 'C':0, 'G':0}
-
-        self.wholeHomPayload = {'A':0, 'T':0, 'C':0, 'G':0}
-        self.startHomPayload = {'A':[], 'T':[], 'C':[], 'G':[]}
-        self.endHomPayload = {'A':[], 'T':[], 'C':[], 'G':[]}
-
-        self.startJointsGcCount = []
-        self.endJointsGcCount = []
-        self.payloadsGcCount = []
+        # Joints and pre-stats
+        self.reset_motifs_stats()
 
         # Motifs
         self.motifSize = constraints.motifSize
@@ -39,24 +33,23 @@ class Validate (BasePenalties):
 
         # Homopolymer
         self.maxHom = constraints.maxHom
-        self.homOutBoundary = []
 
         # GC-content
         self.minGc = constraints.minGc
         self.maxGc = constraints.maxGc
         self.gcContentsOutBoundary = []
 
-        self.payloadsGcCount = []
-
         # Key
         self.startKeys = set()
         self.endKeys = set()
         self.keySize = constraints.keySize
         # GC-content key
-        self.startJointsGcCount = []
-        self.endJointsGcCount = []
         self.keyGcContentsOutBoundary = []
 
+        # Hamming distance
+        self.minKeyDistance = constraints.minKeyDistance
+        self.minPayloadDistance = constraints.minPayloadDistance
+
         # Penalties
         self.motifHomPenalty = 0
         self.motifGcPenalty = 0
@@ -76,16 +69,19 @@ class Validate (BasePenalties):
     async def add_keys_and_payloads(self, keys, payloads):
         self.keys = keys
         self.payloads = payloads
+        self.clear_hairpin_memo()
         # Generate pre-stats
         await self.generate_motifs_stats()
 
     async def add_payloads(self, payloads):
         self.payloads = payloads
+        self.clear_hairpin_memo()
         # Generate pre-stats
         await self.generate_motifs_stats()
 
     def add_keys(self, keys):
         self.keys = keys
+        self.clear_hairpin_memo()
 
     ### Calculate Scores ###
 
@@ -117,6 +113,14 @@ class Validate (BasePenalties):
                     score += self.get_motifs_gc_score()
             if constraint == 'keyGcContent':
                     score += self.get_keys_gc_score()
+            if constraint == 'keyDistance':
+                    score += self.get_keys_distance_score()
+            if constraint == 'payloadDistance':
+                    score += self.get_payloads_distance_score()
+            if constraint == 'keyInPayload':
+                    score += self.get_keys_in_payloads_score()
+            if constraint == 'jointRepeat':
+                    score += self.get_joint_repeat_score()
         return score
 
     def get_motifs_and_keys_homopolymer_score(self):
@@ -137,6 +141,18 @@ class Validate (BasePenalties):
     def get_keys_gc_score(self):
         return -self.get_key_gc_penalty()
 
+    def get_keys_distance_score(self):
+        return -self.close_pairs_count(self.keys, self.keySize, self.minKeyDistance)
+
+    def get_payloads_distance_score(self):
+        return -self.close_pairs_count(self.payloads, self.payloadSize, self.minPayloadDistance)
+
+    def get_keys_in_payloads_score(self):
+        return -self.get_key_in_payload_penalty()
+
+    def get_joint_repeat_score(self):
+        return -self.get_joint_repeat_penalty()
+
     ##### Key Penalties Only #####
 
     ### Generate Key Homopoylmer Score (no need to use if check motif homopolymers) ###
@@ -193,89 +209,118 @@ class Validate (BasePenalties):
                     hairpinCount += self.forward_hairpin_counter_at_startPos(key, self.keys, set(), stem1Start, [], isKey=True, loopSizeMin=loopSize, loopSizeMax=loopSize)
         return hairpinCount
     
+    ### Generate Distance Score ###
+
+    def close_pairs_count(self, sequences, size, minDistance):
+        # pairs of sequences fewer than minDistance nucleotides apart
+        index = HammingIndex(size, minDistance)
+        closePairs = 0
+        for sequence in sequences:
+            closePairs += len(index.neighbours(sequence))
+            index.add(sequence)
+        return closePairs
+
+    ### Generate Key in Payload Score ###
+
+    def get_key_in_payload_penalty(self):
+        return len(self.key_in_payload_occurrences())
+
+    def key_in_payload_occurrences(self):
+        # (payload, end position, key or joint) of every key and joint inside a payload, in one pass over the payloads
+        automaton = KeyAutomaton(set(self.keys) | self.joints)
+        return [(payload, end, sequence) for payload in self.payloads for end, sequence in automaton.occurrences(payload)]
+
+    ### Generate Joint Repeat Score ###
+
+    def get_joint_repeat_penalty(self):
+        return self.junction_kmers_table().repeats()
+
+    def junction_kmers_table(self):
+        # junction k-mer of the motifs (k = keySize) -> number of payloads whose junctions have it
+        jointSize = int(self.keySize / 2)
+        startJoints = {joint[jointSize:] for joint in self.joints}
+        endJoints = {joint[:jointSize] for joint in self.joints}
+        table = KmerTable(self.keySize)
+        table.add(junction_kmers(startJoints, endJoints, self.payloads, self.keySize))
+        return table
+
     ##### Motif Penalties #####
     
     ### Generate Motif Homopolymer Score ###
 
     def get_motif_and_key_homopolymer_penalty(self):
-        homOutBoundary = self.add_homopolymer_over_motifs_stats()
-        if len(homOutBoundary) == 0:
-            homStats = 0
-        else:
-            homStats = np.sum(np.array(homOutBoundary))
-        return homStats
+        homExcess, homNum = self.homopolymer_over_motifs_stats()
+        return homExcess
+
+    def homopolymer_over_motifs_stats(self):
+        # (total length over maxHom, number of homopolymers over maxHom)
+        homExcess = self.innerHomExcess
+        homNum = self.innerHomNum
+        # homopolymer length across joints and payloads -> number of motifs
+        homs = Counter()
 
-    def add_homopolymer_over_motifs_stats(self):
-        jointSize = int(self.keySize / 2)
-        
         for nuc in nucleotides:
             # worst case: whole motif is homopolymer
             if self.wholeHomPayload[nuc] > 0 and self.wholeJointHom[nuc] > 0:
-                return [self.motifSize * self.maxPossibleMotifNum]
+                return self.motifSize * self.maxPossibleMotifNum, self.maxPossibleMotifNum
             # start and end joints
             if self.wholeHomPayload[nuc] > 0:
                 if len(self.startJointHom[nuc]) == 0 and len(self.endJointHom[nuc]) == 0:
-                    if self.payloadSize - self.maxHom > 0:
-                        self.homOutBoundary.append(self.payloadSize - self.maxHom)
+                    homs[self.payloadSize] += 1
                 elif len(self.startJointHom[nuc]) == 0:
-                    for hom in self.endJointHom[nuc]:
-                        if self.payloadSize + hom - self.maxHom > 0:
-                            self.homOutBoundary.append(self.payloadSize + hom - self.maxHom)
+                    self.add_joined_homs(homs, self.payloadSize, self.endJointHom[nuc])
                 elif len(self.endJointHom[nuc]) == 0:
-                    for hom in self.startJointHom[nuc]:
-                        if self.payloadSize + hom - self.maxHom > 0:
-                            self.homOutBoundary.append(self.payloadSize + hom - self.maxHom)
+                    self.add_joined_homs(homs, self.payloadSize, self.startJointHom[nuc])
                 else:
-                    for hom1 in self.startHomPayload[nuc]:
-                        for hom2 in self.endHomPayload[nuc]:
-                            if self.payloadSize + hom1 + hom2 - self.maxHom > 0:
-                                self.homOutBoundary.append(self.payloadSize + hom1 + hom2 - self.maxHom)
+                    self.add_joined_homs(homs, self.payloadSize, self.startJointHom[nuc], self.endJointHom[nuc])
             # start and end payloads
             if self.wholeJointHom[nuc] > 0:
                 if len(self.startHomPayload[nuc]) == 0 and len(self.endHomPayload[nuc]) == 0:
-                    if self.keySize - self.maxHom > 0:
-                        self.homOutBoundary.append(self.keySize - self.maxHom)
+                    homs[self.keySize] += 1
                 elif len(self.startHomPayload[nuc]) == 0:
-                    for hom in self.endHomPayload[nuc]:
-                        if self.keySize + hom - self.maxHom > 0:
-                            self.homOutBoundary.append(self.keySize + hom - self.maxHom)
+                    self.add_joined_homs(homs, self.keySize, self.endHomPayload[nuc])
                 elif len(self.endHomPayload[nuc]) == 0:
-                    for hom in self.startHomPayload[nuc]:
-                        if self.keySize + hom - self.maxHom > 0:
-                            self.homOutBoundary.append(self.keySize + hom - self.maxHom)
+                    self.add_joined_homs(homs, self.keySize, self.startHomPayload[nuc])
                 else:
-                    for hom1 in self.startHomPayload[nuc]:
-                        for hom2 in self.endHomPayload[nuc]:
-                            if self.keySize + hom1 + hom2 - self.maxHom > 0:
-                                self.homOutBoundary.append(self.keySize + hom1 + hom2 - self.maxHom)
+                    self.add_joined_homs(homs, self.keySize, self.startHomPayload[nuc], self.endHomPayload[nuc])
             # end payload with end joint
-            for homPayload in self.endHomPayload[nuc]:
-                for homJoint in self.endJointHom[nuc]:
-                    if homPayload + homJoint - self.maxHom > 0:
-                        self.homOutBoundary.append(homPayload + homJoint - self.maxHom)
+            self.add_joined_homs(homs, 0, self.endHomPayload[nuc], self.with_ending_joints(self.endJointHom[nuc], nuc))
             # start payload with start joint
-            for homPayload in self.startHomPayload[nuc]:
-                for homJoint in self.startJointHom[nuc]:
-                    if homPayload + homJoint - self.maxHom > 0:
-                        self.homOutBoundary.append(homPayload + homJoint - self.maxHom)
-        homOutBoundary = self.homOutBoundary
-        return homOutBoundary
+            self.add_joined_homs(homs, 0, self.startHomPayload[nuc], self.with_ending_joints(self.startJointHom[nuc], nuc))
+
+        for hom, count in homs.items():
+            if hom - self.maxHom > 0:
+                homExcess += count * (hom - self.maxHom)
+                homNum += count
+        return homExcess, homNum
+
+    def with_ending_joints(self, jointHoms, nuc):
+        # runs of nuc of the joints next to a payload run of nuc, 0 for the joints that don't go on with nuc
+        endingJoints = len(self.joints) - sum(jointHoms.values()) - self.wholeJointHom[nuc] if self.joints else 1
+        return jointHoms + Counter({0: endingJoints})
+
+    def add_joined_homs(self, homs, size, homs1, homs2=None):
+        # homopolymers of length size + hom1 (+ hom2) for every pair of runs in homs1 (and homs2)
+        if homs2 is None:
+            homs2 = {0: 1}
+        for hom1, count1 in homs1.items():
+            for hom2, count2 in homs2.items():
+                homs[size + hom1 + hom2] += count1 * count2
 
     ### Generate Motif GC Score ###
 
     def get_motif_gc_penalty(self):
-        gcScores = []
-        for payloadGcCount in self.payloadsGcCount:
-            for startJointGcCount in self.startJointsGcCount:
-                for endJointGcCount in self.endJointsGcCount:
-                    gcCount = payloadGcCount + startJointGcCount + endJointGcCount
-                    gcContent = (100 * gcCount) / self.motifSize
-                    score = 0
-                    score = max(score, self.minGc - gcContent)
-                    score = max(score, gcContent - self.maxGc)
-                    if score > 0:
-                        gcScores.append(score)
-        return np.sum(np.array(gcScores))
+        gcPenalty, gcNum = self.motif_gc_stats()
+        return gcPenalty
+
+    def motif_gc_stats(self):
+        # (total penalty, number of motifs out of the GC bounds)
+        # number of motifs per GC count = convolution of the payload and joint GC count histograms
+        motifsGcCount = np.convolve(np.convolve(self.payloadsGcCount, self.startJointsGcCount), self.endJointsGcCount)
+        gcContent = (100 * np.arange(len(motifsGcCount))) / self.motifSize
+        scores = np.maximum(np.maximum(self.minGc - gcContent, gcContent - self.maxGc), 0)
+        isOut = (scores > 0) & (motifsGcCount > 0)
+        return np.sum(motifsGcCount[isOut] * scores[isOut]), int(np.sum(motifsGcCount[isOut]))
 
     ### Generate Motif Hairpin Score ###
 
@@ -299,87 +344,137 @@ class Validate (BasePenalties):
         return hairpinsCount
     
     ##### Generate pre-stats #####
-    
+
+    def reset_motifs_stats(self):
+        # keys and payloads already in the pre-stats
+        self.statsKeys = set()
+        self.statsPayloads = set()
+        self.joints = set()
+
+        # homopolymer length -> number of joints/payloads
+        self.startJointHom = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+        self.endJointHom = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+        self.wholeJointHom = {'A':0, 'T':0, 'C':0, 'G':0}
+
+        self.wholeHomPayload = {'A':0, 'T':0, 'C':0, 'G':0}
+        self.startHomPayload = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+        self.endHomPayload = {'A':Counter(), 'T':Counter(), 'C':Counter(), 'G':Counter()}
+
+        # homopolymers over maxHom inside keys and payloads
+        self.innerHomExcess = 0
+        self.innerHomNum = 0
+
+        # GC count -> number of joints/payloads
+        self.startJointsGcCount = np.zeros(self.keySize + 1, dtype=np.int64)
+        self.endJointsGcCount = np.zeros(self.keySize + 1, dtype=np.int64)
+        self.payloadsGcCount = np.zeros(self.payloadSize + 1, dtype=np.int64)
+
     async def generate_motifs_stats(self):
-        jointSize = int(self.keySize / 2)
+        # only keys and payloads added or removed since the last call are counted or taken out
 
         # Joint stats
         # Joints = reverse complementary of keys
-        for k in self.keys:
-            cur = k[0]
-            curHom = 1
-            curGcCount = 1 if cur in ['G', 'C'] else 0
-            isEnd = True
-            joint = converse[k[0]]
-
-            for i in range(1, self.keySize):
-                nuc = k[i]
-                joint = converse[nuc] + joint
-
-                # Update start hom
-                if cur != nuc:
-                    if isEnd:
-                        isEnd = False
-                        self.startJointHom[converse[cur]].append(curHom)
-                    elif curHom - self.maxHom > 0:
-                        self.homOutBoundary.append(curHom - self.maxHom)
-                    cur = nuc
-                    curHom = 0
-                
-                # Update end gc count
-                if i == jointSize:
-                    self.endJointsGcCount.append(curGcCount)
-                    curGcCount = 0
-                
-                curGcCount += 1 if nuc in ['G', 'C'] else 0
+        for k in self.statsKeys - self.keys:
+            await self.add_key_stats(k, -1)
+        for k in self.keys - self.statsKeys:
+            await self.add_key_stats(k)
+        self.statsKeys = set(self.keys)
 
-                curHom += 1
+        # Payload stats
+        for payload in self.statsPayloads - self.payloads:
+            await self.add_payload_stats(payload, -1)
+        for payload in self.payloads - self.statsPayloads:
+            await self.add_payload_stats(payload)
+        self.statsPayloads = set(self.payloads)
+
+    def add_hom(self, homs, hom, count):
+        # count = -1 takes a homopolymer out
+        homs[hom] += count
+        if homs[hom] == 0:
+            del homs[hom]
+
+    async def add_inner_hom(self, hom, count=1):
+        if hom - self.maxHom > 0:
+            self.innerHomExcess += count * (hom - self.maxHom)
+            self.innerHomNum += count
+
+    async def add_key_stats(self, k, count=1):
+        jointSize = int(self.keySize / 2)
+        cur = k[0]
+        curHom = 1
+        curGcCount = 1 if cur in ['G', 'C'] else 0
+        isEnd = True
+        joint = converse[k[0]]
+
+        for i in range(1, self.keySize):
+            nuc = k[i]
+            joint = converse[nuc] + joint
+
+            # Update start hom
+            if cur != nuc:
+                if isEnd:
+                    isEnd = False
+                    self.add_hom(self.startJointHom[converse[cur]], curHom, count)
+                else:
+                    await self.add_inner_hom(curHom, count)
+                cur = nuc
+                curHom = 0
+            
+            # Update end gc count
+            if i == jointSize:
+                self.endJointsGcCount[curGcCount] += count
+                curGcCount = 0
             
+            curGcCount += 1 if nuc in ['G', 'C'] else 0
+
+            curHom += 1
+        
+        if count > 0:
             self.joints.add(joint)
+        else:
+            self.joints.discard(joint)
 
-            # Update end hom
-            if isEnd:
-                self.wholeJointHom[converse[cur]] += 1
-            else:
-                self.endJointHom[converse[cur]].append(curHom)
+        # Update end hom
+        if isEnd:
+            self.wholeJointHom[converse[cur]] += count
+        else:
+            self.add_hom(self.endJointHom[converse[cur]], curHom, count)
 
-            # Update start gc count
-            self.startJointsGcCount.append(curGcCount)
+        # Update start gc count
+        self.startJointsGcCount[curGcCount] += count
 
-        # Payload stats
-        for payload in self.payloads:
-            isStart = True
-            cur = payload[0]
-            homCount = 1
-            gcCount = 1 if cur in ['G', 'C'] else 0
-            for i in range(1, self.payloadSize):
-                nuc = payload[i]
-
-                # Update homopolymer stats
-                if cur != nuc:
-                    if isStart:
-                        isStart = False
-                        self.startHomPayload[cur].append(homCount)
-                    elif homCount - self.maxHom > 0:
-                        self.homOutBoundary.append(homCount - self.maxHom)
-                    
-                    homCount = 0
-                    cur = nuc
-                homCount += 1
-
-                # Update GC Count
-                if nuc in ['G', 'C']:
-                    gcCount += 1
+    async def add_payload_stats(self, payload, count=1):
+        isStart = True
+        cur = payload[0]
+        homCount = 1
+        gcCount = 1 if cur in ['G', 'C'] else 0
+        for i in range(1, self.payloadSize):
+            nuc = payload[i]
 
             # Update homopolymer stats
-            if isStart:
-                self.wholeHomPayload[cur] += homCount
-            else:
-                self.endHomPayload[cur].append(homCount)
+            if cur != nuc:
+                if isStart:
+                    isStart = False
+                    self.add_hom(self.startHomPayload[cur], homCount, count)
+                else:
+                    await self.add_inner_hom(homCount, count)
+                
+                homCount = 0
+                cur = nuc
+            homCount += 1
 
             # Update GC Count
-            self.payloadsGcCount.append(gcCount)
+            if nuc in ['G', 'C']:
+                gcCount += 1
+
+        # Update homopolymer stats
+        if isStart:
+            self.wholeHomPayload[cur] += count * homCount
+        else:
+            self.add_hom(self.endHomPayload[cur], homCount, count)
 
+        # Update GC Count
+        self.payloadsGcCount[gcCount] += count
 
 if __name__ == '__main__':
     motifs = {'ATCGGCGCGC', 'CAGTGATACGATCG'}
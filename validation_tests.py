@@ -1,6 +1,9 @@
 import pytest
+import numpy as np
 import validation as v
 import constraints as c
+from collections import Counter
+from kmerTable import KmerTable
 
 # class TestFunctions(unittest.TestCase):
 def get_constraints(maxHairpin=2, loopSize=1, payloadSize=10, keySize=2, payloadNum=5, maxHom=1, minGc=25, maxGc=60):
@@ -73,6 +76,57 @@ async def test_hom_whole_motif_and_part_other_motif():
     result = -5
     assert result == homScore
 
+@pytest.mark.asyncio
+async def test_hom_score_is_same_on_every_call():
+    maxHom = 2
+    keySize = 4
+    payloadSize = 7
+    constraints = get_constraints(maxHom=maxHom, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'GCGCGCG', 'ATATATA'}
+    keys = {'TATT', 'TTTT'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    validate.get_motifs_and_keys_homopolymer_score()
+    homScore = validate.get_motifs_and_keys_homopolymer_score()
+    result = -5
+    assert result == homScore
+
+@pytest.mark.asyncio
+async def test_hom_stats_are_updated_with_new_payloads():
+    maxHom = 2
+    keySize = 4
+    payloadSize = 7
+    constraints = get_constraints(maxHom=maxHom, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'GCGCGCG', 'ATATATA'}
+    keys = {'TATT', 'TTTT'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    validate.get_motifs_and_keys_homopolymer_score()
+    await validate.add_payloads(payloads | {'AAATCGA'})
+    fromScratch = v.Validate(constraints)
+    await fromScratch.add_keys_and_payloads(keys, payloads | {'AAATCGA'})
+    homStats = validate.homopolymer_over_motifs_stats()
+    assert fromScratch.homopolymer_over_motifs_stats() == homStats
+    assert homStats[1] > 0 and homStats[0] >= homStats[1]
+
+@pytest.mark.asyncio
+async def test_stats_are_updated_with_removed_keys_and_payloads():
+    maxHom = 2
+    keySize = 4
+    payloadSize = 7
+    constraints = get_constraints(maxHom=maxHom, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'GCGCGCG', 'ATATATA', 'AAATCGA', 'CCCCCCC'}
+    keys = {'TATT', 'TTTT', 'GACC'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    await validate.add_keys_and_payloads({'TATT', 'GGAC'}, {'GCGCGCG', 'AAATCGA'})
+    fromScratch = v.Validate(constraints)
+    await fromScratch.add_keys_and_payloads({'TATT', 'GGAC'}, {'GCGCGCG', 'AAATCGA'})
+    assert fromScratch.homopolymer_over_motifs_stats() == validate.homopolymer_over_motifs_stats()
+    assert fromScratch.motif_gc_stats() == validate.motif_gc_stats()
+    assert fromScratch.joints == validate.joints
+    assert all(0 not in validate.startHomPayload[n].values() for n in 'ATCG')
+
 ##### GC Content tests ######
 
 def get_score_gc_content(gcCount, size, minGc, maxGc):
@@ -160,6 +214,22 @@ async def test_gc_motif_max_edge():
     result = 0
     assert result == gcScore
 
+@pytest.mark.asyncio
+async def test_gc_motif_max_counts_motifs_out_of_bounds():
+    minGc = 20
+    maxGc = 60
+    keySize = 4
+    payloadSize = 7
+    constraints = get_constraints(minGc=minGc, maxGc=maxGc, keySize=keySize, payloadSize=payloadSize)
+    payloads = {'CCGAGCG', 'AGAGAGA'}
+    keys = {'TAGT', 'TTTT'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    gcPenalty, gcNum = validate.motif_gc_stats()
+    result = get_score_gc_content(7, payloadSize + keySize, minGc, maxGc) * 2
+    assert result == -gcPenalty
+    assert 2 == gcNum
+
 ### Key GC Content tests ###
 
 @pytest.mark.asyncio
@@ -271,3 +341,58 @@ async def test_stem1_in_payload_stem2_in_key():
     hairpinCount = validate.get_motifs_and_keys_hairpin_score()
     result = -2
     assert result == hairpinCount
+
+##### Distance tests ######
+
+@pytest.mark.asyncio
+async def test_distance_scores_count_close_pairs():
+    constraints = c.Constraints(6, 5, 1, 2, 1, 25, 60, 4, minKeyDistance=2, minPayloadDistance=3)
+    # close keys: ACGT-ACGA, ACGA-TCGA
+    keys = {'ACGT', 'ACGA', 'TCGA', 'GGCC'}
+    # close payloads: ACGTAC-TCTTAC, TCTTAC-TCTTAA
+    payloads = {'ACGTAC', 'TCTTAC', 'TCTTAA', 'GGGGGG'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    assert validate.get_keys_distance_score() == -2
+    assert validate.get_payloads_distance_score() == -2
+    assert validate.get_total_scores_of_constraints({'keyDistance', 'payloadDistance'}) == -4
+
+##### Key in payload tests ######
+
+@pytest.mark.asyncio
+async def test_keys_and_joints_inside_payloads():
+    constraints = get_constraints(keySize=4, payloadSize=9)
+    # joints: ACGT, GCAA
+    keys = {'ACGT', 'TTGC'}
+    payloads = {'AACGTTGCA', 'GCAAGCAAT', 'ATATATATA'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    assert sorted(validate.key_in_payload_occurrences()) == [('AACGTTGCA', 5, 'ACGT'), ('AACGTTGCA', 8, 'TTGC'),
+                                                             ('GCAAGCAAT', 4, 'GCAA'), ('GCAAGCAAT', 8, 'GCAA')]
+    assert validate.get_total_scores_of_constraints({'keyInPayload'}) == -4
+
+##### Joint repeat tests ######
+
+def test_kmer_table_counts_match_counter():
+    rng = np.random.default_rng(5)
+    table = KmerTable(8, capacity=4)
+    added = []
+    for _ in range(6):
+        kmers = rng.integers(0, 100, rng.integers(300)).astype(np.uint64)
+        table.add(kmers)
+        added += kmers.tolist()
+    counts = Counter(added)
+    assert table.get(np.arange(120, dtype=np.uint64)).tolist() == [counts[i] for i in range(120)]
+    assert len(table) == len(counts)
+    assert table.repeats() == sum(count - 1 for count in counts.values())
+
+@pytest.mark.asyncio
+async def test_joint_repeats_across_payloads():
+    constraints = get_constraints(keySize=4, payloadSize=6)
+    # joint ACGT, motifs GT + payload + AC
+    keys = {'ACGT'}
+    # junction k-mers: GTCA TCAT AGCA GCAC, GTCA TCAT TTTA TTAC, GTGG TGGG AGCA GCAC
+    payloads = {'CATAGC', 'CATTTT', 'GGGAGC'}
+    validate = v.Validate(constraints)
+    await validate.add_keys_and_payloads(keys, payloads)
+    assert validate.get_total_scores_of_constraints({'jointRepeat'}) == -4
@@ -0,0 +1,444 @@
+import numpy as np
+from language import nucleotides
+
+# 2-bit codes in the order of `nucleotides`, so that the complement of a code is `code ^ 1`
+codes = np.zeros(256, dtype=np.uint8)
+for i, n in enumerate(nucleotides):
+    codes[ord(n)] = i
+
+
+def encode_elems(elems, width):
+    encoded = np.zeros((len(elems), width), dtype=np.uint8)
+    for i, elem in enumerate(elems):
+        if elem:
+            encoded[i, :len(elem)] = codes[np.frombuffer(elem.encode(), dtype=np.uint8)]
+    return encoded
+
+
+# encoded elem sets kept by a counter (payloads, joints, keys, ...)
+maxEncodedSets = 8
+
+
+class EncodedElems:
+    # elems as uint8 rows, grouped by length so that every batch has one skip pattern
+    def __init__(self, elems, width):
+        self.elems = elems
+        self.size = len(elems)
+        elemList = list(elems)
+        lengths = np.array([len(elem) for elem in elemList], dtype=np.intp)
+        self.width = max(width, int(lengths.max())) if len(elemList) else width
+        self.codes = encode_elems(elemList, self.width)
+        self.lengths = lengths
+        self.index = {}
+        self.ids = np.array([self.index.setdefault(elem, len(self.index)) for elem in elemList], dtype=np.intp)
+        self.groups = [np.flatnonzero(lengths == length) for length in np.unique(lengths)]
+
+    def is_encoding_of(self, elems):
+        return elems is self.elems and len(elems) == self.size
+
+
+class VectorizedHairpinCounter:
+    """Same walk as the recursive hairpin counter of BasePenalties, but every
+    send_to_* / hairpin_count_* call handles a whole batch of elem combinations
+    (rows of element indices with a multiplicity) instead of a single pair of strings."""
+
+    def __init__(self, penalties):
+        self.penalties = penalties
+        self.encoded = {}
+        self.loaded = None
+
+    ### Encoding ###
+
+    def encode(self, elems, width):
+        encoded = self.encoded.get(id(elems))
+        if encoded is None or not encoded.is_encoding_of(elems):
+            if len(self.encoded) >= maxEncodedSets:
+                self.encoded.clear()
+            encoded = EncodedElems(elems, width)
+            self.encoded[id(elems)] = encoded
+        return encoded
+
+    def load(self, curElem, elems1, elems2, isKey):
+        loaded = (curElem, id(elems1), len(elems1), id(elems2), len(elems2), isKey)
+        if loaded == self.loaded:
+            return
+        self.loaded = loaded
+        p = self.penalties
+        elem1Size = p.keySize if isKey else p.payloadSize
+        elem2Size = p.payloadSize if isKey else p.keySize
+        self.elem1Size = elem1Size
+        self.info = {'elem1Size': elem1Size, 'elem2Size': elem2Size}
+
+        # elems1 followed by curElem, so that curElem is the last row
+        encoded1 = self.encode(elems1, elem1Size)
+        width1 = max(encoded1.width, len(curElem))
+        self.codes1 = np.zeros((encoded1.size + 1, width1), dtype=np.uint8)
+        self.codes1[:encoded1.size, :encoded1.width] = encoded1.codes
+        self.codes1[encoded1.size, :len(curElem)] = encode_elems([curElem], len(curElem))[0]
+        self.lengths1 = np.append(encoded1.lengths, len(curElem))
+        self.ids1 = np.append(encoded1.ids, encoded1.index.get(curElem, len(encoded1.index)))
+        self.groups1 = encoded1.groups
+        self.cur = np.array([encoded1.size], dtype=np.intp)
+
+        encoded2 = self.encode(elems2, elem2Size)
+        self.codes2 = encoded2.codes
+        self.lengths2 = encoded2.lengths
+        self.ids2 = encoded2.ids
+        self.groups2 = encoded2.groups
+        self.numElems2 = encoded2.size
+        self.base = max(len(self.ids1), self.numElems2) + 1
+
+    def add_elem(self, elems, newElem):
+        # encodings are refreshed when a counter is called with a grown elem set
+        pass
+
+    ### Counters ###
+
+    def backward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        hairpins = []
+        for i in range(self.penalties.maxHairpin):
+            stem1Start = len(curElem) - 1 - i
+            self.backward_hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey=isKey, hairpinCount=hairpinCount)
+
+        return np.sum(np.array(hairpins))
+
+    def forward_hairpin_counter(self, curElem, elems1, elems2, isKey=False, hairpinCount=False):
+        hairpins = []
+        for i in range(self.penalties.maxHairpin):
+            stem1Start = len(curElem) - 1 - i
+            self.forward_hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey=isKey, hairpinCount=hairpinCount)
+
+        return np.sum(np.array(hairpins))
+
+    def backward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        return self.hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, -1)
+
+    def forward_hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey=False, hairpinCount=True, loopSizeMin=-1, loopSizeMax=-1):
+        return self.hairpin_counter_at_startPos(curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, 1)
+
+    def hairpin_counter_at_startPos(self, curElem, elems1, elems2, stem1Start, hairpins, isKey, hairpinCount, loopSizeMin, loopSizeMax, direction):
+        p = self.penalties
+        if loopSizeMin < 0 or loopSizeMax < 0:
+            loopSizeMin = p.loopSizeMin
+            loopSizeMax = p.loopSizeMax
+
+        self.load(curElem, elems1, elems2, isKey)
+        for loopSize in range(loopSizeMin, loopSizeMax + 1):
+            self.stem1Start = stem1Start
+            self.stem2Start = stem1Start + direction * (loopSize + p.maxHairpin)
+            self.hairpinLengths = {}
+            self.send_to_all_check(p.maxHairpin - 1, 0, np.ones(1, dtype=np.int64))
+            if self.hairpinLengths:
+                hairpins.append(self.hairpins_total(hairpinCount))
+
+        return np.sum(np.array(hairpins))
+
+    def hairpins_total(self, hairpinCount):
+        if hairpinCount:
+            return sum(self.hairpinLengths.values())
+        hairpinPowers = self.penalties.hairpinPowers
+        return sum(count * hairpinPowers.power(hairpinLength) for hairpinLength, count in self.hairpinLengths.items())
+
+    def add_hairpins(self, weights, hairpinLength):
+        self.hairpinLengths[hairpinLength] = self.hairpinLengths.get(hairpinLength, 0) + int(weights.sum())
+
+    ### Batches ###
+
+    def positions(self, curJ):
+        return self.stem1Start + curJ, self.stem2Start + self.penalties.maxHairpin - 1 - curJ
+
+    def stem_positions(self, j):
+        motifSize = self.penalties.motifSize
+        curStem1Pos = (self.stem1Start % motifSize + j) % motifSize
+        curStem2Pos = (self.stem2Start % motifSize + self.penalties.maxHairpin - 1 - j) % motifSize
+        return curStem1Pos, curStem2Pos
+
+    def fixed1(self, rows):
+        # an empty elem is falsy in the recursive walk, so it is not carried over
+        return rows if self.lengths1[rows[0]] > 0 else None
+
+    def fixed2(self, rows):
+        return rows if self.lengths2[rows[0]] > 0 else None
+
+    def collapse(self, weights, *rows):
+        # rows only differing in the elems that are not carried over are merged
+        fixed = [r for r in rows if r is not None]
+        if not fixed:
+            return np.array([weights.sum()], dtype=np.int64), rows
+        if len(weights) <= 1:
+            return weights, rows
+        key = np.zeros(len(weights), dtype=np.int64)
+        for r in fixed:
+            key = key * self.base + r
+        _, index, inverse = np.unique(key, return_index=True, return_inverse=True)
+        if len(index) == len(weights):
+            return weights, rows
+        weights = np.bincount(inverse.ravel(), weights=weights).astype(np.int64)
+        return weights, tuple(None if r is None else r[index] for r in rows)
+
+    def cross(self, weights, rows, elems):
+        # every row combined with every elem in elems
+        numRows, numElems = len(weights), len(elems)
+        return np.repeat(weights, numElems), [np.repeat(r, numElems) for r in rows], np.tile(elems, numRows)
+
+    def repeat_cur(self, weights):
+        return np.repeat(self.cur, len(weights))
+
+    ### Hairpin walk ###
+
+    def send_to_all_check(self, curJ, hairpinLength, weights, curE1_1=None, curE1_2=None, curE2_1=None, curE2_2=None):
+        if curJ < 0 and hairpinLength > 0:
+            self.add_hairpins(weights, hairpinLength)
+
+        for j in range(curJ, -1, -1):
+            if (not self.send_to_all_pos1_elem1(curJ, hairpinLength, weights, curE1_1, curE1_2, curE2_2)) \
+                and (not self.send_to_all_pos1_elem2(curJ, hairpinLength, weights, curE2_1, curE2_2, curE1_2)):
+                curJ -= 1
+            else:
+                return True
+
+            if curJ < 0 and hairpinLength > 0:
+                self.add_hairpins(weights, hairpinLength)
+                return True
+
+        return False
+
+    def send_to_all_pos1_elem1(self, curJ, hairpinLength, weights, curE1_1=None, curE1_2=None, curE2=None):
+        return self.send_to_elem1_elem1(curJ, hairpinLength, weights, curE1_1, curE1_2) or \
+            self.send_to_elem1_elem2(curJ, hairpinLength, weights, curE1_1, curE2)
+
+    def send_to_all_pos1_elem2(self, curJ, hairpinLength, weights, curE2_1=None, curE2_2=None, curE1=None):
+        return self.send_to_elem2_elem1(curJ, hairpinLength, weights, curE2_1, curE1) or \
+            self.send_to_elem2_elem2(curJ, hairpinLength, weights, curE2_1, curE2_2)
+
+    def send_to_elem1_elem1(self, curJ, hairpinLength, weights, curE1_1=None, curE1_2=None):
+        p, info = self.penalties, self.info
+        stem1Pos, stem2Pos = self.positions(curJ)
+
+        if p.is_in_elem2(info, stem1Pos) or p.is_in_elem2(info, stem2Pos):
+            return False
+
+        weights, (curE1_1, curE1_2) = self.collapse(weights, curE1_1, curE1_2)
+        isSame = p.is_in_same_elem1(info, stem1Pos, stem2Pos)
+        if curE1_1 is not None and curE1_2 is not None:
+            self.hairpin_count_elem1_elem1(curE1_1, curE1_2, curJ, hairpinLength, weights)
+        elif curE1_1 is not None:
+            if not p.is_in_curElem(info, stem2Pos):
+                for group in self.groups1:
+                    w, (e1_1,), e1_2 = self.cross(weights, [curE1_1], group)
+                    self.count_elem1_elem1_same(e1_1, e1_2, curJ, hairpinLength, w, isSame)
+            self.hairpin_count_elem1_elem1(curE1_1, self.repeat_cur(weights), curJ, hairpinLength, weights)
+        elif curE1_2 is not None:
+            if not p.is_in_curElem(info, stem1Pos):
+                for group in self.groups1:
+                    w, (e1_2,), e1_1 = self.cross(weights, [curE1_2], group)
+                    self.count_elem1_elem1_same(e1_1, e1_2, curJ, hairpinLength, w, isSame)
+            self.hairpin_count_elem1_elem1(self.repeat_cur(weights), curE1_2, curJ, hairpinLength, weights)
+        else:
+            stem1InCur = p.is_in_curElem(info, stem1Pos)
+            stem2InCur = p.is_in_curElem(info, stem2Pos)
+            p1_p2_in_curElem = stem1InCur and stem2InCur
+            if (not p1_p2_in_curElem) and stem1InCur:
+                for group in self.groups1:
+                    w, _, e1_2 = self.cross(weights, [], group)
+                    self.count_elem1_elem1_same(self.repeat_cur(w), e1_2, curJ, hairpinLength, w, isSame)
+            elif (not p1_p2_in_curElem) and stem2InCur:
+                for group in self.groups1:
+                    w, _, e1_1 = self.cross(weights, [], group)
+                    self.count_elem1_elem1_same(e1_1, self.repeat_cur(w), curJ, hairpinLength, w, isSame)
+            elif not (stem1InCur or stem2InCur):
+                for group1 in self.groups1:
+                    for group2 in self.groups1:
+                        w, _, e1_1 = self.cross(weights, [], group1)
+                        w, (e1_1,), e1_2 = self.cross(w, [e1_1], group2)
+                        self.count_elem1_elem1_same(e1_1, e1_2, curJ, hairpinLength, w, isSame)
+            self.hairpin_count_elem1_elem1(self.repeat_cur(weights), self.repeat_cur(weights), curJ, hairpinLength, weights)
+        return True
+
+    def count_elem1_elem1_same(self, elem1_1, elem1_2, curJ, hairpinLength, weights, isSame):
+        # both stems in the same elem1: only the combinations of an elem with itself
+        if isSame:
+            same = self.ids1[elem1_1] == self.ids1[elem1_2]
+            elem1_1, elem1_2, weights = elem1_1[same], elem1_2[same], weights[same]
+        self.hairpin_count_elem1_elem1(elem1_1, elem1_2, curJ, hairpinLength, weights)
+
+    def send_to_elem1_elem2(self, curJ, hairpinLength, weights, curE1=None, curE2=None):
+        p, info = self.penalties, self.info
+        stem1Pos, stem2Pos = self.positions(curJ)
+
+        if not ((not p.is_in_elem2(info, stem1Pos)) and p.is_in_elem2(info, stem2Pos)):
+            return False
+
+        weights, (curE1, curE2) = self.collapse(weights, curE1, curE2)
+        if curE1 is not None and curE2 is not None:
+            self.hairpin_count_elem1_elem2(curE1, curE2, curJ, hairpinLength, weights)
+        elif curE1 is not None:
+            for group in self.groups2:
+                w, (e1,), e2 = self.cross(weights, [curE1], group)
+                self.hairpin_count_elem1_elem2(e1, e2, curJ, hairpinLength, w)
+        elif curE2 is not None:
+            if not p.is_in_curElem(info, stem1Pos):
+                for group in self.groups1:
+                    w, (e2,), e1 = self.cross(weights, [curE2], group)
+                    self.hairpin_count_elem1_elem2(e1, e2, curJ, hairpinLength, w)
+            self.hairpin_count_elem1_elem2(self.repeat_cur(weights), curE2, curJ, hairpinLength, weights)
+        else:
+            for group2 in self.groups2:
+                if not p.is_in_curElem(info, stem1Pos):
+                    for group1 in self.groups1:
+                        w, _, e1 = self.cross(weights, [], group1)
+                        w, (e1,), e2 = self.cross(w, [e1], group2)
+                        self.hairpin_count_elem1_elem2(e1, e2, curJ, hairpinLength, w)
+                w, _, e2 = self.cross(weights, [], group2)
+                self.hairpin_count_elem1_elem2(self.repeat_cur(w), e2, curJ, hairpinLength, w)
+
+        if not (curE2 is not None or self.numElems2):
+            return self.send_to_all_check(curJ - 1, hairpinLength, weights, curE1_1=curE1, curE2_2=curE2)
+
+        return True
+
+    def send_to_elem2_elem1(self, curJ, hairpinLength, weights, curE2=None, curE1=None):
+        p, info = self.penalties, self.info
+        stem1Pos, stem2Pos = self.positions(curJ)
+
+        if not (p.is_in_elem2(info, stem1Pos) and p.is_in_other_elem1(info, stem2Pos)):
+            return False
+
+        weights, (curE2, curE1) = self.collapse(weights, curE2, curE1)
+        if curE2 is not None and curE1 is not None:
+            self.hairpin_count_elem2_elem1(curE2, curE1, curJ, hairpinLength, weights)
+        elif curE2 is not None:
+            if not p.is_in_curElem(info, stem2Pos):
+                for group in self.groups1:
+                    w, (e2,), e1 = self.cross(weights, [curE2], group)
+                    self.hairpin_count_elem2_elem1(e2, e1, curJ, hairpinLength, w)
+            self.hairpin_count_elem2_elem1(curE2, self.repeat_cur(weights), curJ, hairpinLength, weights)
+        elif curE1 is not None:
+            for group in self.groups2:
+                w, (e1,), e2 = self.cross(weights, [curE1], group)
+                self.hairpin_count_elem2_elem1(e2, e1, curJ, hairpinLength, w)
+        else:
+            for group2 in self.groups2:
+                if not p.is_in_curElem(info, stem2Pos):
+                    for group1 in self.groups1:
+                        w, _, e2 = self.cross(weights, [], group2)
+                        w, (e2,), e1 = self.cross(w, [e2], group1)
+                        self.hairpin_count_elem2_elem1(e2, e1, curJ, hairpinLength, w)
+                w, _, e2 = self.cross(weights, [], group2)
+                self.hairpin_count_elem2_elem1(e2, self.repeat_cur(w), curJ, hairpinLength, w)
+
+        if not (curE2 is not None or self.numElems2):
+            return self.send_to_all_check(curJ - 1, hairpinLength, weights, curE1_2=curE1, curE2_1=curE2)
+
+        return True
+
+    def send_to_elem2_elem2(self, curJ, hairpinLength, weights, curE2_1=None, curE2_2=None):
+        p, info = self.penalties, self.info
+        stem1Pos, stem2Pos = self.positions(curJ)
+
+        if not (p.is_in_elem2(info, stem1Pos) and p.is_in_elem2(info, stem2Pos)):
+            return False
+
+        weights, (curE2_1, curE2_2) = self.collapse(weights, curE2_1, curE2_2)
+        isSame = p.is_in_same_elem2(info, stem1Pos, stem2Pos)
+        if curE2_1 is not None and curE2_2 is not None:
+            self.hairpin_count_elem2_elem2(curE2_1, curE2_2, curJ, hairpinLength, weights)
+        elif curE2_1 is not None:
+            for group in self.groups2:
+                w, (e2_1,), e2_2 = self.cross(weights, [curE2_1], group)
+                self.count_elem2_elem2_same(e2_1, e2_2, curJ, hairpinLength, w, isSame)
+        elif curE2_2 is not None:
+            for group in self.groups2:
+                w, (e2_2,), e2_1 = self.cross(weights, [curE2_2], group)
+                self.count_elem2_elem2_same(e2_1, e2_2, curJ, hairpinLength, w, isSame)
+        else:
+            for group1 in self.groups2:
+                for group2 in self.groups2:
+                    w, _, e2_1 = self.cross(weights, [], group1)
+                    w, (e2_1,), e2_2 = self.cross(w, [e2_1], group2)
+                    self.count_elem2_elem2_same(e2_1, e2_2, curJ, hairpinLength, w, isSame)
+
+        if not ((curE2_1 is not None and curE2_2 is not None) or self.numElems2):
+            return self.send_to_all_check(curJ - 1, hairpinLength, weights, curE2_1=curE2_1, curE2_2=curE2_2)
+
+        return True
+
+    def count_elem2_elem2_same(self, elem2_1, elem2_2, curJ, hairpinLength, weights, isSame):
+        if isSame:
+            same = self.ids2[elem2_1] == self.ids2[elem2_2]
+            elem2_1, elem2_2, weights = elem2_1[same], elem2_2[same], weights[same]
+        self.hairpin_count_elem2_elem2(elem2_1, elem2_2, curJ, hairpinLength, weights)
+
+    def hairpin_count_elem1_elem1(self, elem1_1, elem1_2, curJ, hairpinLength, weights):
+        for j in range(curJ, -1, -1):
+            if len(weights) == 0:
+                return
+            if self.send_to_elem2_elem1(j, hairpinLength, weights, curE1=self.fixed1(elem1_2)) or \
+            self.send_to_elem2_elem2(j, hairpinLength, weights) or \
+            self.send_to_elem1_elem2(j, hairpinLength, weights, curE1=self.fixed1(elem1_1)):
+                return
+
+            curStem1Pos, curStem2Pos = self.stem_positions(j)
+            if curStem1Pos >= self.lengths1[elem1_1[0]] or curStem2Pos >= self.lengths1[elem1_2[0]]:
+                continue
+
+            match = self.codes1[elem1_1, curStem1Pos] == (self.codes1[elem1_2, curStem2Pos] ^ 1)
+            elem1_1, elem1_2, weights = elem1_1[match], elem1_2[match], weights[match]
+            hairpinLength += 1
+            if j == 0 and len(weights):
+                self.add_hairpins(weights, hairpinLength)
+
+    def hairpin_count_elem1_elem2(self, elem1, elem2, curJ, hairpinLength, weights):
+        for j in range(curJ, -1, -1):
+            if len(weights) == 0:
+                return
+            if self.send_to_elem2_elem1(j, hairpinLength, weights) or \
+            self.send_to_elem2_elem2(j, hairpinLength, weights, curE2_2=self.fixed2(elem2)) or \
+            self.send_to_elem1_elem1(j, hairpinLength, weights, curE1_1=self.fixed1(elem1)):
+                return
+
+            curStem1Pos, curStem2Pos = self.stem_positions(j)
+            if curStem1Pos >= self.lengths1[elem1[0]]:
+                continue
+
+            match = self.codes1[elem1, curStem1Pos] == (self.codes2[elem2, curStem2Pos - self.elem1Size] ^ 1)
+            elem1, elem2, weights = elem1[match], elem2[match], weights[match]
+            hairpinLength += 1
+            if j == 0 and len(weights):
+                self.add_hairpins(weights, hairpinLength)
+
+    def hairpin_count_elem2_elem1(self, elem2, elem1, curJ, hairpinLength, weights):
+        for j in range(curJ, -1, -1):
+            if len(weights) == 0:
+                return
+            if self.send_to_elem1_elem1(j, hairpinLength, weights, curE1_2=self.fixed1(elem1)) or \
+            self.send_to_elem1_elem2(j, hairpinLength, weights) or \
+            self.send_to_elem2_elem2(j, hairpinLength, weights, curE2_1=self.fixed2(elem2)):
+                return
+
+            curStem1Pos, curStem2Pos = self.stem_positions(j)
+            if curStem2Pos >= self.lengths1[elem1[0]]:
+                continue
+
+            match = self.codes2[elem2, curStem1Pos - self.elem1Size] == (self.codes1[elem1, curStem2Pos] ^ 1)
+            elem2, elem1, weights = elem2[match], elem1[match], weights[match]
+            hairpinLength += 1
+            if j == 0 and len(weights):
+                self.add_hairpins(weights, hairpinLength)
+
+    def hairpin_count_elem2_elem2(self, elem2_1, elem2_2, curJ, hairpinLength, weights):
+        for j in range(curJ, -1, -1):
+            if len(weights) == 0:
+                return
+            if self.send_to_elem1_elem1(j, hairpinLength, weights) or \
+            self.send_to_elem1_elem2(j, hairpinLength, weights, curE2=self.fixed2(elem2_2)) or \
+            self.send_to_elem2_elem1(j, hairpinLength, weights, curE2=self.fixed2(elem2_1)):
+                return
+
+            curStem1Pos, curStem2Pos = self.stem_positions(j)
+
+            match = self.codes2[elem2_1, curStem1Pos - self.elem1Size] == (self.codes2[elem2_2, curStem2Pos - self.elem1Size] ^ 1)
+            elem2_1, elem2_2, weights = elem2_1[match], elem2_2[match], weights[match]
+            hairpinLength += 1
+            if j == 0 and len(weights):
+                self.add_hairpins(weights, hairpinLength)